@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Throughput benchmark of the camera pipeline.
+
+Runs the replay camera node on a synthetic pattern once per combination of resolution,
+framerate, encoder, number of frame buffers and number of encoder threads, and measures what
+comes out of it.
+For each combination, the following are reported:
+
+    - fps: frames received per second by a subscriber
+    - cpu_percent, cpu_ms_per_frame: CPU used by the camera node (all threads)
+    - encode_p50_ms, encode_p95_ms, encode_p99_ms: latency of the JPEG encoder
+    - frame_age_p50_ms, frame_age_p95_ms: time from capture to publication of the frames
+    - bytes_per_frame: average size of the published JPEG frames
+    - drop_rate: fraction of the frames produced by the source that were never published
+
+A `roscore` must be running. Results are written as JSON and can be compared with those of a
+previous run, e.g.,
+
+    rosrun camera_driver camera_benchmark.py --output before.json
+    rosrun camera_driver camera_benchmark.py --output after.json --compare before.json
+
+A framerate of 0 runs the source as fast as possible. The fps of each combination is also
+reported relative to the same combination with a single encoder thread, to show how the parallel
+encoding scales.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import itertools
+import subprocess
+import importlib.util
+from typing import List, Tuple, Optional
+
+import psutil
+import rospy
+import rospkg
+from sensor_msgs.msg import CompressedImage
+from std_srvs.srv import Trigger
+
+NAMESPACE = "/camera_benchmark"
+NODE_NAME = "camera_node"
+DEFAULT_FRAMERATES = [15, 30, 0]
+DEFAULT_ENCODERS = ["opencv", "turbojpeg"]
+DEFAULT_BUFFERS = [3, 6]
+DEFAULT_ENCODER_THREADS = [1, 2, 4]
+# metrics compared between runs, and whether higher is better
+METRICS = {
+    "fps": True,
+    "cpu_percent": False,
+    "cpu_ms_per_frame": False,
+    "encode_p50_ms": False,
+    "encode_p95_ms": False,
+    "encode_p99_ms": False,
+    "frame_age_p50_ms": False,
+    "frame_age_p95_ms": False,
+    "bytes_per_frame": False,
+    "drop_rate": False,
+}
+
+
+def camera_mode_resolutions() -> List[Tuple[int, int]]:
+    """Returns the resolutions of the Jetson Nano camera modes (plus the default 640x480)."""
+    path = os.path.join(rospkg.RosPack().get_path("camera_driver"), "src", "jetson_nano_camera_node.py")
+    spec = importlib.util.spec_from_file_location("jetson_nano_camera_node", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sizes = {(m.width, m.height) for m in module.JetsonNanoCameraNode.CAMERA_MODES}
+    return sorted(sizes | {(640, 480)})
+
+
+class FrameCounter:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.counting = False
+
+    def callback(self, msg: CompressedImage):
+        if self.counting:
+            self.frames += 1
+            self.bytes += len(msg.data)
+
+
+def get_diagnostics() -> dict:
+    srv = rospy.ServiceProxy(f"{NAMESPACE}/{NODE_NAME}/get_diagnostics", Trigger)
+    return json.loads(srv().message)
+
+
+def measure_node(executable: str, params: dict, args: argparse.Namespace) -> Optional[dict]:
+    """Runs a camera node with the given parameters and measures its output.
+
+    Args:
+        executable (:obj:`str`): Node executable within the `camera_driver` package
+        params (:obj:`dict`): Private parameters of the node
+        args (:obj:`argparse.Namespace`): Needs `warmup`, `duration` and `startup_timeout`
+
+    Returns:
+        :obj:`dict`: The value of each of the :data:`METRICS`, `None` if the node failed
+    """
+    cmd = ["rosrun", "camera_driver", executable, f"__name:={NODE_NAME}", f"__ns:={NAMESPACE}"]
+    cmd += [f"_{k}:={v}" for k, v in params.items()]
+    node = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    counter = FrameCounter()
+    sub = rospy.Subscriber(
+        f"{NAMESPACE}/{NODE_NAME}/image/compressed",
+        CompressedImage,
+        counter.callback,
+        queue_size=10,
+        buff_size=2**26,
+        tcp_nodelay=True,
+    )
+    try:
+        rospy.wait_for_service(f"{NAMESPACE}/{NODE_NAME}/get_diagnostics", timeout=args.startup_timeout)
+        # depending on the setup, `rosrun` may run the node in a child process
+        proc = psutil.Process(node.pid)
+        procs = [proc] + proc.children(recursive=True)
+        time.sleep(args.warmup)
+        # measure
+        before = get_diagnostics()
+        cpu_before = sum(sum(p.cpu_times()[:2]) for p in procs)
+        counter.counting = True
+        tic = time.monotonic()
+        time.sleep(args.duration)
+        counter.counting = False
+        elapsed = time.monotonic() - tic
+        cpu = sum(sum(p.cpu_times()[:2]) for p in procs) - cpu_before
+        after = get_diagnostics()
+    except (rospy.ROSException, psutil.Error) as e:
+        print(f"  failed: {str(e)}", file=sys.stderr)
+        return None
+    finally:
+        sub.unregister()
+        node.terminate()
+        try:
+            node.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            node.kill()
+    counters_before, counters_after = before["counters"], after["counters"]
+
+    def delta(name: str) -> int:
+        return counters_after.get(name, 0) - counters_before.get(name, 0)
+
+    frames_in, frames_out = delta("frames_in"), delta("frames_out")
+    encode = after["stages"].get("encode", {})
+    age = after["stages"].get("frame_age", {})
+    return {
+        "fps": counter.frames / elapsed,
+        "cpu_percent": 100.0 * cpu / elapsed,
+        "cpu_ms_per_frame": 1000.0 * cpu / frames_out if frames_out else None,
+        "encode_p50_ms": encode.get("p50_ms"),
+        "encode_p95_ms": encode.get("p95_ms"),
+        "encode_p99_ms": encode.get("p99_ms"),
+        "frame_age_p50_ms": age.get("p50_ms"),
+        "frame_age_p95_ms": age.get("p95_ms"),
+        "bytes_per_frame": counter.bytes / counter.frames if counter.frames else None,
+        "drop_rate": 1.0 - frames_out / frames_in if frames_in else None,
+    }
+
+
+def run_combination(
+    width: int,
+    height: int,
+    framerate: int,
+    encoder: str,
+    buffers: int,
+    threads: int,
+    args: argparse.Namespace,
+) -> Optional[dict]:
+    params = {
+        "res_w": width,
+        "res_h": height,
+        "framerate": framerate or 30,
+        "realtime": "true" if framerate else "false",
+        "encoder": encoder,
+        "frame_buffers": buffers,
+        "encoder_threads": threads,
+        "pattern": args.pattern,
+        "exposure_mode": "sports",
+        "low_latency": "true" if args.low_latency else "false",
+    }
+    metrics = measure_node("replay_camera_node.py", params, args)
+    if metrics is None:
+        return None
+    return {
+        "resolution": f"{width}x{height}",
+        "framerate": framerate,
+        "encoder": encoder,
+        "frame_buffers": buffers,
+        "encoder_threads": threads,
+        "pattern": args.pattern,
+        **metrics,
+    }
+
+
+def format_value(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.2f}"
+
+
+def key(result: dict) -> tuple:
+    return (
+        result["resolution"],
+        result["framerate"],
+        result["encoder"],
+        result["frame_buffers"],
+        # results of runs made before the encoder threads existed were single-threaded
+        result.get("encoder_threads", 1),
+    )
+
+
+def report_scaling(results: List[dict]):
+    single = {key(r)[:-1]: r["fps"] for r in results if r.get("encoder_threads", 1) == 1}
+    lines = []
+    for result in results:
+        base = single.get(key(result)[:-1])
+        if result["encoder_threads"] == 1 or not base:
+            continue
+        lines.append(f"  {' '.join(map(str, key(result)))}: {result['fps'] / base:.2f}x")
+    if lines:
+        print("\nFramerate relative to a single encoder thread:")
+        print("\n".join(lines))
+
+
+def compare(results: List[dict], baseline_file: str):
+    with open(baseline_file, "r") as f:
+        baseline = {key(r): r for r in json.load(f)["results"]}
+    print(f"\nComparison with {baseline_file} (relative change, + is better):")
+    for result in results:
+        base = baseline.get(key(result))
+        if base is None:
+            continue
+        changes = []
+        for metric, higher_is_better in METRICS.items():
+            new, old = result.get(metric), base.get(metric)
+            if new is None or not old:
+                continue
+            change = (new - old) / old * (1 if higher_is_better else -1)
+            changes.append(f"{metric}: {change * 100:+.1f}%")
+        print(f"  {' '.join(map(str, key(result)))}: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--resolutions", help="Comma-separated WxH, default are the Jetson camera modes")
+    parser.add_argument("--framerates", default=",".join(map(str, DEFAULT_FRAMERATES)))
+    parser.add_argument("--encoders", default=",".join(DEFAULT_ENCODERS))
+    parser.add_argument("--buffers", default=",".join(map(str, DEFAULT_BUFFERS)), help="Frame buffers")
+    parser.add_argument(
+        "--encoder-threads", default=",".join(map(str, DEFAULT_ENCODER_THREADS)), help="JPEG encoder threads"
+    )
+    parser.add_argument("--pattern", default="bars", choices=["bars", "noise"])
+    parser.add_argument("--low-latency", action="store_true", help="Run the nodes in low latency mode")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds before measuring")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of measurement")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--output", default="camera_benchmark.json")
+    parser.add_argument("--compare", help="Results of a previous run to compare with")
+    args = parser.parse_args()
+
+    if args.resolutions:
+        resolutions = [tuple(map(int, r.split("x"))) for r in args.resolutions.split(",")]
+    else:
+        resolutions = camera_mode_resolutions()
+    framerates = [int(f) for f in args.framerates.split(",")]
+    encoders = args.encoders.split(",")
+    buffers = [int(b) for b in args.buffers.split(",")]
+    encoder_threads = [int(t) for t in args.encoder_threads.split(",")]
+
+    rospy.init_node("camera_benchmark", anonymous=True, disable_signals=True)
+    results = []
+    combinations = list(itertools.product(resolutions, framerates, encoders, buffers, encoder_threads))
+    for i, ((width, height), framerate, encoder, n_buffers, n_threads) in enumerate(combinations):
+        print(
+            f"[{i + 1}/{len(combinations)}] {width}x{height} @ {framerate or 'max'}fps, "
+            f"encoder: {encoder}, buffers: {n_buffers}, threads: {n_threads}"
+        )
+        result = run_combination(width, height, framerate, encoder, n_buffers, n_threads, args)
+        if result is None:
+            continue
+        results.append(result)
+        print("  " + ", ".join(f"{metric}: {format_value(result[metric])}" for metric in METRICS))
+
+    report = {
+        "host": socket.gethostname(),
+        "cpus": psutil.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "args": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    report_scaling(results)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Compares the capture modes of the legacy Raspberry Pi camera node.
+
+Runs the Raspberry Pi camera node once per combination of resolution, framerate and capture
+mode (`sequence`: JPEG captures from the video port, `recording`: split MJPEG recording) and
+reports, for each combination, the achieved fps and the CPU used by the node.
+
+Must run on a Raspberry Pi with the legacy camera stack and a `roscore` running, e.g.,
+
+    rosrun camera_driver picamera_benchmark.py --resolutions 640x480,1296x972 --framerates 30,60
+"""
+
+import json
+import time
+import socket
+import argparse
+import itertools
+
+import psutil
+import rospy
+
+from camera_benchmark import measure_node, format_value
+
+CAPTURE_MODES = ["sequence", "recording"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--resolutions", default="640x480,1296x972", help="Comma-separated WxH")
+    parser.add_argument("--framerates", default="30,60")
+    parser.add_argument("--modes", default=",".join(CAPTURE_MODES))
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds before measuring")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of measurement")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--output", default="picamera_benchmark.json")
+    args = parser.parse_args()
+
+    resolutions = [tuple(map(int, r.split("x"))) for r in args.resolutions.split(",")]
+    framerates = [int(f) for f in args.framerates.split(",")]
+    modes = args.modes.split(",")
+
+    rospy.init_node("picamera_benchmark", anonymous=True, disable_signals=True)
+    results = []
+    for (width, height), framerate in itertools.product(resolutions, framerates):
+        row = {}
+        for mode in modes:
+            print(f"{width}x{height} @ {framerate}fps, capture mode: {mode}")
+            params = {
+                "res_w": width,
+                "res_h": height,
+                "framerate": framerate,
+                "exposure_mode": "sports",
+                "capture_mode": mode,
+            }
+            metrics = measure_node("raspberry_pi_camera_node.py", params, args)
+            if metrics is None:
+                continue
+            row[mode] = metrics
+            results.append(
+                {"resolution": f"{width}x{height}", "framerate": framerate, "capture_mode": mode, **metrics}
+            )
+            print(
+                f"  fps: {format_value(metrics['fps'])}, cpu: {format_value(metrics['cpu_percent'])}%, "
+                f"cpu/frame: {format_value(metrics['cpu_ms_per_frame'])}ms"
+            )
+        if "sequence" in row and "recording" in row:
+            seq, rec = row["sequence"], row["recording"]
+            print(
+                f"  recording vs sequence: fps x{rec['fps'] / max(seq['fps'], 1e-6):.2f}, "
+                f"cpu/frame x{(rec['cpu_ms_per_frame'] or 0) / (seq['cpu_ms_per_frame'] or 1e-6):.2f}"
+            )
+
+    report = {
+        "host": socket.gethostname(),
+        "cpus": psutil.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "args": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
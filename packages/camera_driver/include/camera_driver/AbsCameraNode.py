@@ -1,19 +1,40 @@
 import os
 import time
+import json
 import yaml
 import copy
 import rospy
 import numpy as np
-from threading import Thread
+from queue import Queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread, Condition, Timer
+from typing import Optional, Tuple
 
 from abc import ABC, abstractmethod
 from cv_bridge import CvBridge
-from sensor_msgs.msg import CompressedImage, CameraInfo
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from sensor_msgs.msg import CompressedImage, CameraInfo, RegionOfInterest
 from sensor_msgs.srv import SetCameraInfo, SetCameraInfoResponse
+from std_msgs.msg import String, UInt32
+from std_srvs.srv import Trigger, TriggerResponse
 
+from duckietown_msgs.msg import BoolStamped
 from duckietown.dtros import DTROS, NodeType, TopicType, DTParam, ParamType
 from hardware_test_camera import HardwareTestCamera
 
+from .buffers import FrameBuffer, FrameBufferPool
+from .stats import PipelineStats
+from .encoders import AbsJPEGEncoder, OpenCVJPEGEncoder, JPEGDecoder, JPEGDownscaler, get_encoder
+from .shm import SharedMemoryFrameWriter
+from .rectification import Rectifier
+from .roi import CameraROI
+from .bitrate import BitrateController
+from .streaming import LatestFrame, MJPEGStreamServer
+from .h264 import H264Output
+from .change import ChangeDetector
+from .blackbox import FrameRing
+from .throttle import RateLimiter
+
 
 class AbsCameraNode(ABC, DTROS):
     """Handles the imagery.
@@ -26,23 +47,176 @@ class AbsCameraNode(ABC, DTROS):
     it will likely fail with an `Out of resource` exception.
 
     The configuration parameters can be changed dynamically while the node is running via
-    `rosparam set` commands.
+    `rosparam set` commands. Changes to the framerate, exposure mode and JPEG quality are applied
+    to the running camera when the backend supports it (see :meth:`reconfigure`), the camera is
+    restarted otherwise (and always for changes to the resolution). The stream downtime caused
+    by each change is logged and reported in the diagnostics as `reconfigure/<params>:<live|restart>`.
+
+    Frames are acquired and published by two different threads. The capture thread (running
+    the backend's :meth:`run`) writes frames into a small pool of preallocated buffers and hands
+    them over to the publisher thread, which always publishes the most recent frame.
+    A slow publisher thus results in skipped frames rather than in a stalled capture.
 
     Configuration:
         ~framerate (:obj:`float`): The camera image acquisition framerate, default is 30.0 fps
         ~res_w (:obj:`int`): The desired width of the acquired image, default is 640px
         ~res_h (:obj:`int`): The desired height of the acquired image, default is 480px
+        ~roi (:obj:`list`): Region of the `~res_w`x`~res_h` frame to publish, as `[x, y, w, h]` in
+            fractions of the frame, default is `[0.0, 0.0, 1.0, 1.0]` (the whole frame)
+        ~binning (:obj:`int`): Downscaling factor applied to the region of interest, one of 1, 2, 4, 8,
+            default is 1. The region and the binning are applied by the camera when the backend supports
+            it, in software before encoding otherwise
         ~exposure_mode (:obj:`str`): PiCamera exposure mode, one of
             `these <https://picamera.readthedocs.io/en/latest/api_camera.html?highlight=sport#picamera.PiCamera.exposure_mode>`_, default is `sports`
+        ~encoder (:obj:`str`): Software JPEG encoder used for raw frames, one of `opencv`
+            or `turbojpeg` (libjpeg-turbo), default is `opencv`
+        ~jpeg_quality (:obj:`int`): Quality of the JPEG produced by the software encoder, default is 95.
+            Cameras and hardware encoders keep their own default unless it is set explicitly (or
+            changed at runtime)
+        ~jpeg_subsampling (:obj:`str`): Chroma subsampling used by the software encoder, one of
+            `420`, `422`, `444` or `gray`, default is `420`
+        ~target_bitrate (:obj:`int`): Bandwidth budget of the image stream, in bytes per second. When set
+            (or when `~max_frame_size` is), the JPEG quality is adjusted after every frame to meet the
+            budget, between `~min_jpeg_quality` and `~jpeg_quality`. Default is 0 (disabled)
+        ~max_frame_size (:obj:`int`): Maximum size of a frame of the image stream, in bytes, default
+            is 0 (disabled)
+        ~min_jpeg_quality (:obj:`int`): Lowest JPEG quality the bitrate controller can choose,
+            default is 10
+        ~mono (:obj:`bool`): Publish a grayscale copy of the image stream, default is `False`. Frames are
+            only encoded while somebody subscribes to it. The luminance is taken straight from JPEG
+            frames (only the Y channel is decoded) and converted from raw ones
+        ~preview_scale (:obj:`int`): Downscaling factor of the preview stream, one of 2, 4, 8,
+            or 0 to disable the preview, default is 0
+        ~preview_framerate (:obj:`float`): Framerate of the preview stream, default is 5.0 fps
+        ~preview_quality (:obj:`int`): JPEG quality of the preview stream, default is 75
+        ~throttled_topics (:obj:`dict`): Extra copies of the image stream with a maximum rate each, as
+            `{name: max_rate}`, published on `~<name>/compressed`, e.g.,
+
+                throttled_topics:
+                  image_dashboard: 5
+                  image_recording: 10
+
+            Default is none. They publish the very same messages as `~image/compressed` (no copy,
+            no re-encoding), and take no work at all while nobody subscribes to them
+        ~shm_name (:obj:`str`): Name of the POSIX shared memory segment raw frames are written to,
+            empty (default) to disable the raw frame output
+        ~shm_slots (:obj:`int`): Number of raw frames kept in shared memory, default is 4
+        ~rectify (:obj:`bool`): Publish a rectified copy of the image stream, default is `False`
+        ~rectification_cache_dir (:obj:`str`): Directory the rectification maps are cached in,
+            default is `/data/cache/camera_rectification`, empty to disable the cache
+        ~h264 (:obj:`bool`): Publish an H.264 copy of the image stream, default is `False`. Backends
+            with a GStreamer pipeline encode it in there (in hardware when possible), the others
+            encode the published frames in a GStreamer pipeline of their own, only while the stream
+            has subscribers (or is sent over RTP), restarting it at a keyframe when one connects
+        ~h264_encoder (:obj:`str`): GStreamer H.264 encoder, one of `nvv4l2h264enc` (Jetson), `x264enc`,
+            `openh264enc`, or `auto` (default, the first one available)
+        ~h264_bitrate (:obj:`int`): Target bitrate of the H.264 stream in bits per second, default is
+            1000000
+        ~h264_keyframe_interval (:obj:`int`): Frames between two keyframes of the H.264 stream, default
+            is 30. New subscribers can only start decoding at a keyframe
+        ~h264_rtp_host (:obj:`str`): Host (or multicast group) the H.264 stream is also sent to over
+            RTP/UDP (payload type 96), empty (default) to disable
+        ~h264_rtp_port (:obj:`int`): UDP port of the RTP stream, default is 5000
+        ~change_gate (:obj:`bool`): Only publish frames that changed with respect to the last published
+            one (e.g., for watchtowers looking at a static scene), default is `False`. Frames are compared
+            on a luminance image decimated by a factor of 8
+        ~change_threshold (:obj:`int`): Difference of luminance (0-255) above which a pixel of the
+            decimated image has changed, default is 15
+        ~change_min_area (:obj:`float`): Fraction of the pixels that have to change for a frame to be
+            published, default is 0.001
+        ~heartbeat_rate (:obj:`float`): Rate at which frames are published by the change gate even if
+            nothing changed, default is 0.2 Hz
+        ~blackbox_seconds (:obj:`float`): Duration of the in-memory ring of the last published frames
+            that `~dump` writes to disk ("black box"), 0 (default) to disable it
+        ~blackbox_max_mb (:obj:`float`): Maximum size of the black box in MB, default is 64. The oldest
+            frames are dropped first when the limit is reached
+        ~blackbox_dir (:obj:`str`): Directory the black box is dumped into, default is
+            `/data/logs/camera_blackbox`
+        ~blackbox_post_trigger (:obj:`float`): Seconds of frames after an emergency stop that are
+            included in the automatic dump, default is 2.0
+        ~low_latency (:obj:`bool`): Always capture the newest frame the camera has, rather than the
+            oldest one queued in the driver, default is false. Backends keep (at most) one frame
+            queued and drop the ones the node cannot keep up with. The time from capture to publication
+            of each frame is reported as `frame_age` in the diagnostics, in either mode
+        ~frame_buffers (:obj:`int`): Number of preallocated frame buffers shared by the capture and
+            publisher threads, default (and minimum) is 3, raised to `~encoder_threads` + 4 if needed.
+            The pool grows when all of them are in use, counted as `grown_buffers` in the diagnostics
+        ~encoder_threads (:obj:`int`): Number of threads encoding raw frames into JPEG in parallel,
+            0 for one per CPU core, default is 1. Frames are still published in the order they were
+            captured, at most one per thread being encoded at any time
+        ~idle_mode (:obj:`str`): What to do while nobody subscribes to the image stream, one of
+            `none` (keep publishing), `idle` (stop retrieving and encoding frames) or `trickle`
+            (publish at `~idle_framerate`), default is `none`
+        ~idle_framerate (:obj:`float`): Keep-warm framerate used in `trickle` mode, default is 1.0 fps
+        ~http_port (:obj:`int`): TCP port of the MJPEG-over-HTTP server, 0 (default) to disable it.
+            The server streams the published JPEG frames as they are to any number of browsers at
+            `http://ROBOT_NAME.local:PORT/stream.mjpg`, and a fresh frame at `/snapshot.jpg`
+        ~http_framerate (:obj:`float`): Maximum framerate of each HTTP stream, default is 15.0 fps.
+            Viewers can ask for less through the `fps` query argument (e.g., `/stream.mjpg?fps=5`)
+        ~diagnostics_rate (:obj:`float`): Rate at which the pipeline statistics are published,
+            default is 1.0 Hz
+        ~calibration_folder (:obj:`str`): Folder containing the intrinsic calibrations, default is
+            `/data/config/calibrations/camera_intrinsic/`
 
     Publisher:
-        ~image/compressed (:obj:`CompressedImage`): The acquired camera images
-        ~camera_info (:obj:`CameraInfo`): The camera parameters
+        ~image/compressed (:obj:`CompressedImage`): The acquired camera images, stamped with the time
+            of capture reported by the driver (when the backend has one). The `seq` of the header is
+            consecutive, as set by rospy
+        ~skipped_frames (:obj:`UInt32`): Total number of captured frames that were not published
+            (e.g., dropped because the publisher could not keep up), latched and published every time
+            it grows. Frames held back by the change gate or the idle mode are not counted
+        ~camera_info (:obj:`CameraInfo`): The camera parameters. The camera and projection matrices
+            describe the published frames, i.e., the region of interest (reported in the `roi` field)
+            and the binning are already taken into account
+        ~image_mono/compressed (:obj:`CompressedImage`): Grayscale (single-channel JPEG) copy of the
+            image stream, only if `~mono` is set
+        ~<name>/compressed (:obj:`CompressedImage`): Rate-limited copies of the image stream, one per
+            entry of `~throttled_topics`
+        ~image_preview/compressed (:obj:`CompressedImage`): Downscaled copy of the image stream,
+            only if `~preview_scale` is set
+        ~raw/descriptor (:obj:`String`): JSON description (`name`, `slots`, `slot_size`) of the
+            shared memory segment holding the raw frames, only if `~shm_name` is set. Local consumers
+            read the frames through :class:`camera_driver.shm.SharedMemoryFrameReader` and should
+            stay subscribed to this topic while they do
+        ~image_rect/compressed (:obj:`CompressedImage`): Undistorted and rectified copy of the image
+            stream, only if `~rectify` is set. Frames are rectified by a worker thread, frames arriving
+            while the previous one is being rectified are skipped
+        ~image/h264 (:obj:`CompressedImage`): H.264 copy of the image stream, only if `~h264` is set.
+            Each message (format `h264`) carries one access unit (the NAL units of one frame) in
+            Annex B byte stream format, keyframes are preceded by the SPS and PPS. Stamped with the
+            capture time of the frame
+        ~change_roi (:obj:`RegionOfInterest`): Bounding box (in pixels of the published frames) of the
+            changes that caused a frame to be published, only if `~change_gate` is set. Published right
+            after the frame, not published for heartbeat frames
+        ~diagnostics (:obj:`DiagnosticArray`): Latency percentiles (in milliseconds) of each stage
+            of the pipeline (`read`, `encode`, `message`, `publish`) and frame counters. With a bandwidth
+            budget, also the JPEG quality applied to the frames (`jpeg_quality`), the measured bitrate in
+            bytes per second (`bitrate`) and the fraction of the frames the slowest subscriber did not
+            receive (`link_congestion`)
+
+    Subscriber:
+        ~emergency_stop (:obj:`BoolStamped`): Engaging the emergency stop dumps the black box
+            (`~blackbox_post_trigger` seconds later), if enabled
 
     Service:
+        ~get_diagnostics:
+            Returns the same statistics published on `~diagnostics` as a JSON string.
+
+            outputs:
+                success (`bool`): Always `True`
+                message (`str`): The statistics, JSON-encoded
+
+        ~dump:
+            Writes the frames held by the black box (see `~blackbox_seconds`) to an indexed MJPEG
+            file (see :class:`camera_driver.mjpeg.IndexedMJPEGWriter`) in `~blackbox_dir`.
+
+            outputs:
+                success (`bool`): `True` if the frames were written
+                message (`str`): The path of the file, or the reason of the failure
+
         ~set_camera_info:
             Saves a provided camera info
-            to `/data/config/calibrations/camera_intrinsic/HOSTNAME.yaml`.
+            to `~calibration_folder/HOSTNAME.yaml`.
 
             input:
                 camera_info (`CameraInfo`): The camera information to save
@@ -53,6 +227,14 @@ class AbsCameraNode(ABC, DTROS):
 
     """
 
+    IDLE_MODES = ["none", "idle", "trickle"]
+    # whether the backend includes the H.264 encoder in its own pipeline (see `h264`)
+    H264_IN_PIPELINE = False
+    # periods (in seconds) of the measurements of the links, and of the changes of the camera's JPEG quality
+    LINK_STATS_PERIOD = 1.0
+    LIVE_QUALITY_PERIOD = 0.5
+    CALIBRATION_FOLDER = "/data/config/calibrations/camera_intrinsic/"
+
     def __init__(self):
         # Initialize the DTROS parent class
         super(AbsCameraNode, self).__init__(
@@ -82,14 +264,42 @@ class AbsCameraNode(ABC, DTROS):
             "api_camera.html#picamera.PiCamera.exposure_mode",
         )
 
+        self._encoder_name = DTParam(
+            "~encoder",
+            param_type=ParamType.STRING,
+            default="opencv",
+            help="Software JPEG encoder used for raw frames (opencv, turbojpeg)",
+        )
+        self._jpeg_quality = DTParam(
+            "~jpeg_quality",
+            param_type=ParamType.INT,
+            default=95,
+            min_value=1,
+            max_value=100,
+            help="Quality of the JPEG images produced by the software encoder",
+        )
+        # cameras and hardware encoders keep their own default quality unless asked otherwise
+        self._jpeg_quality_set = rospy.has_param("~jpeg_quality")
+        self._jpeg_subsampling = DTParam(
+            "~jpeg_subsampling",
+            param_type=ParamType.STRING,
+            default="420",
+            help="Chroma subsampling used by the software encoder (420, 422, 444, gray)",
+        )
+
         # define parameters
         self._framerate.register_update_callback(self.parameters_updated)
         self._res_w.register_update_callback(self.parameters_updated)
         self._res_h.register_update_callback(self.parameters_updated)
         self._exposure_mode.register_update_callback(self.parameters_updated)
+        # the encoder can be swapped without restarting the camera
+        self._encoder_name.register_update_callback(self.encoder_parameters_updated)
+        self._jpeg_quality.register_update_callback(self.encoder_parameters_updated)
+        self._jpeg_subsampling.register_update_callback(self.encoder_parameters_updated)
 
         # intrinsic calibration
-        self.cali_file_folder = "/data/config/calibrations/camera_intrinsic/"
+        cali_file_folder = rospy.get_param("~calibration_folder", self.CALIBRATION_FOLDER)
+        self.cali_file_folder = os.path.join(cali_file_folder, "")
         self.frame_id = rospy.get_namespace().rstrip("/") + "/camera_optical_frame"
         self.cali_file = self.cali_file_folder + rospy.get_namespace().strip("/") + ".yaml"
 
@@ -102,6 +312,13 @@ class AbsCameraNode(ABC, DTROS):
         if not os.path.isfile(self.cali_file):
             rospy.signal_shutdown("Found no calibration file ... aborting")
 
+        # region of interest (the backends apply it at capture when they can)
+        self._roi_param = rospy.get_param("~roi", [0.0, 0.0, 1.0, 1.0])
+        self._binning = int(rospy.get_param("~binning", 1))
+        self.roi: Optional[CameraROI] = None
+        self._roi_applied = False
+        self._roi_buffer = FrameBuffer()
+
         # load the calibration file
         self.original_camera_info = self.load_camera_info(self.cali_file)
         self.original_camera_info.header.frame_id = self.frame_id
@@ -109,16 +326,84 @@ class AbsCameraNode(ABC, DTROS):
         self.update_camera_params()
         self.log("Using calibration file: %s" % self.cali_file)
 
+        # MJPEG-over-HTTP server
+        self._http_server = None
+        self._http_frame = LatestFrame()
+        http_port = int(rospy.get_param("~http_port", 0))
+        if http_port:
+            try:
+                self._http_server = MJPEGStreamServer(
+                    http_port, self._http_frame, float(rospy.get_param("~http_framerate", 15.0))
+                )
+                self._http_server.start()
+                self.loginfo(f"Streaming MJPEG over HTTP on port {http_port}.")
+            except OSError as e:
+                self.logwarn(f"Cannot stream MJPEG over HTTP on port {http_port}: {str(e)}")
+
         # user hardware test
-        self._hardware_test = HardwareTestCamera()
+        stream_url = None
+        if self._http_server is not None:
+            stream_url = f"http://{rospy.get_namespace().strip('/')}.local:{http_port}/stream.mjpg"
+        self._hardware_test = HardwareTestCamera(stream_url)
 
         # create cv bridge
         self._bridge = CvBridge()
 
+        # create software JPEG encoder
+        self._encoder: AbsJPEGEncoder = self._make_encoder()
+
+        # bandwidth budget
+        self._bitrate: Optional[BitrateController] = None
+        target_bitrate = float(rospy.get_param("~target_bitrate", 0))
+        max_frame_size = int(rospy.get_param("~max_frame_size", 0))
+        if target_bitrate > 0 or max_frame_size > 0:
+            self._bitrate = BitrateController(
+                target_bitrate,
+                max_frame_size,
+                min_quality=int(rospy.get_param("~min_jpeg_quality", 10)),
+                max_quality=self._jpeg_quality.value,
+            )
+        # whether the quality of the frames encoded by the camera can be changed while streaming
+        self._live_quality = True
+        self._camera_quality = None
+        self._last_quality_time = 0
+        # frames sent on each connection of the image stream, to measure the congestion of the links
+        self._link_stats = {}
+        self._link_frames = 0
+        self._last_link_time = 0
+
         # Setup publishers
         self._has_published = False
         self._is_stopped = False
         self._worker = None
+        self._publisher = None
+        # whether the backends drop stale frames rather than queueing them
+        self._low_latency = bool(rospy.get_param("~low_latency", False))
+        # parallel JPEG encoding (libjpeg releases the GIL while encoding)
+        self._encoder_threads = int(rospy.get_param("~encoder_threads", 1)) or os.cpu_count() or 1
+        self._encoder_pool: Optional[ThreadPoolExecutor] = None
+        frame_buffers = int(rospy.get_param("~frame_buffers", FrameBufferPool.MIN_SIZE))
+        if self._encoder_threads > 1:
+            self._encoder_pool = ThreadPoolExecutor(self._encoder_threads, thread_name_prefix="jpeg_encoder")
+            # frames being encoded or waiting for their turn hold on to their buffers
+            frame_buffers = max(frame_buffers, self._encoder_threads + 4)
+        self._buffers = FrameBufferPool(frame_buffers)
+        self._image_msg = CompressedImage(format="jpeg")
+        self._stats = PipelineStats()
+        # lazy capture
+        self._idle_mode = rospy.get_param("~idle_mode", "none")
+        if self._idle_mode not in self.IDLE_MODES:
+            self.logwarn(f"Idle mode '{self._idle_mode}' not supported, using 'none' instead.")
+            self._idle_mode = "none"
+        self._idle_framerate = max(0.01, float(rospy.get_param("~idle_framerate", 1.0)))
+        self._is_idle = False
+        self._last_idle_frame_time = 0
+        # software rate limit (frames per second), `None` if disabled
+        self._rate_limit = None
+        self._last_wanted_frame_time = 0
+        # reconfiguration
+        self._applied_params = self._reconfigurable_params()
+        self._reconfiguration = None
         self.pub_img = rospy.Publisher(
             "~image/compressed",
             CompressedImage,
@@ -134,13 +419,199 @@ class AbsCameraNode(ABC, DTROS):
             dt_help="The stream of camera calibration information, the message content is fixed",
         )
 
+        # frames are numbered when captured, the ones that never make it to the image stream are counted
+        self._capture_seq = 0
+        self._last_seq: Optional[int] = None
+        self._skipped_frames = 0
+        self.pub_skipped = rospy.Publisher(
+            "~skipped_frames",
+            UInt32,
+            queue_size=1,
+            latch=True,
+            dt_topic_type=TopicType.DRIVER,
+            dt_help="Number of captured frames that were not published (e.g., dropped to keep up)",
+        )
+
+        self.pub_diagnostics = rospy.Publisher(
+            "~diagnostics",
+            DiagnosticArray,
+            queue_size=1,
+            dt_topic_type=TopicType.DEBUG,
+            dt_help="Latency and throughput statistics of the camera pipeline",
+        )
+
         # Setup service (for camera_calibration)
         self.srv_set_camera_info = rospy.Service(
             "~set_camera_info", SetCameraInfo, self.srv_set_camera_info_cb
         )
+        self.srv_get_diagnostics = rospy.Service("~get_diagnostics", Trigger, self.srv_get_diagnostics_cb)
+        diagnostics_rate = max(0.01, float(rospy.get_param("~diagnostics_rate", 1.0)))
+        self._diagnostics_timer = rospy.Timer(
+            rospy.Duration.from_sec(1.0 / diagnostics_rate), self._publish_diagnostics
+        )
+
+        # image publishers that count as listeners of the camera stream
+        self._image_publishers = [self.pub_img]
+
+        # last published JPEG frame, as (stamp, data)
+        self._last_jpeg = None
+
+        # grayscale stream
+        self._mono_encoder: Optional[AbsJPEGEncoder] = None
+        if rospy.get_param("~mono", False):
+            self._mono_encoder = self._make_encoder("gray")
+            self.pub_mono = rospy.Publisher(
+                "~image_mono/compressed",
+                CompressedImage,
+                queue_size=1,
+                dt_topic_type=TopicType.DRIVER,
+                dt_help="The stream of grayscale JPEG compressed images from the camera",
+            )
+            self._image_publishers.append(self.pub_mono)
+
+        # preview stream
+        self._preview_scale = int(rospy.get_param("~preview_scale", 0))
+        self._preview = None
+        self._last_preview_stamp = None
+        if self._preview_scale:
+            try:
+                self._preview = JPEGDownscaler(
+                    self._preview_scale, quality=rospy.get_param("~preview_quality", 75)
+                )
+            except ValueError as e:
+                self.logwarn(f"Preview stream disabled: {str(e)}")
+        if self._preview is not None:
+            self.pub_preview = rospy.Publisher(
+                "~image_preview/compressed",
+                CompressedImage,
+                queue_size=1,
+                dt_topic_type=TopicType.DRIVER,
+                dt_help=f"The stream of JPEG compressed images from the camera, "
+                f"downscaled by a factor of {self._preview_scale}",
+            )
+            self._image_publishers.append(self.pub_preview)
+            preview_framerate = max(0.01, float(rospy.get_param("~preview_framerate", 5.0)))
+            self._preview_timer = rospy.Timer(
+                rospy.Duration.from_sec(1.0 / preview_framerate), self._publish_preview
+            )
+
+        # rate-limited copies of the image stream, for consumers that need fewer frames
+        self._throttled = []
+        for name, max_rate in (rospy.get_param("~throttled_topics", None) or {}).items():
+            try:
+                limiter = RateLimiter(float(max_rate))
+            except (TypeError, ValueError) as e:
+                self.logwarn(f"Throttled topic '{name}' disabled: {str(e)}")
+                continue
+            pub = rospy.Publisher(
+                f"~{name}/compressed",
+                CompressedImage,
+                queue_size=1,
+                dt_topic_type=TopicType.DRIVER,
+                dt_help=f"The stream of JPEG compressed images from the camera, at most {max_rate} fps",
+            )
+            self._throttled.append((pub, limiter))
+            self._image_publishers.append(pub)
+
+        # raw frames in shared memory
+        self._shm_writer = None
+        self._decoder = JPEGDecoder()
+        shm_name = rospy.get_param("~shm_name", "")
+        if shm_name:
+            self._shm_writer = SharedMemoryFrameWriter(shm_name, slots=rospy.get_param("~shm_slots", 4))
+            self.pub_raw_descriptor = rospy.Publisher(
+                "~raw/descriptor",
+                String,
+                queue_size=1,
+                latch=True,
+                dt_topic_type=TopicType.DRIVER,
+                dt_help="Description of the shared memory segment holding the raw camera frames",
+            )
+            self._image_publishers.append(self.pub_raw_descriptor)
+
+        # rectified stream
+        self._rectifier = None
+        self._rect_pending = None
+        self._rect_lock = Condition()
+        self._rect_decoder = JPEGDecoder()
+        if rospy.get_param("~rectify", False):
+            cache_dir = rospy.get_param("~rectification_cache_dir", "/data/cache/camera_rectification")
+            self._rectifier = Rectifier(self.cali_file, cache_dir or None)
+            self.pub_rect = rospy.Publisher(
+                "~image_rect/compressed",
+                CompressedImage,
+                queue_size=1,
+                dt_topic_type=TopicType.DRIVER,
+                dt_help="The stream of JPEG compressed images from the camera, undistorted and rectified",
+            )
+            self._image_publishers.append(self.pub_rect)
+            self._rectification_worker = Thread(target=self._rectification_loop, daemon=True)
+            self._rectification_worker.start()
+
+        # H.264 stream
+        self.h264: Optional[H264Output] = None
+        self._h264_subscribers = 0
+        self._h264_rtp = bool(rospy.get_param("~h264_rtp_host", ""))
+        if rospy.get_param("~h264", False):
+            rtp = None
+            if self._h264_rtp:
+                rtp = (rospy.get_param("~h264_rtp_host"), int(rospy.get_param("~h264_rtp_port", 5000)))
+            try:
+                self.h264 = H264Output(
+                    self._publish_h264,
+                    bitrate=int(rospy.get_param("~h264_bitrate", 1000000)),
+                    keyframe_interval=int(rospy.get_param("~h264_keyframe_interval", 30)),
+                    encoder=rospy.get_param("~h264_encoder", "auto"),
+                    rtp=rtp,
+                    in_pipeline=self.H264_IN_PIPELINE,
+                )
+            except RuntimeError as e:
+                self.logwarn(f"H.264 stream disabled: {str(e)}")
+        if self.h264 is not None:
+            self.loginfo(f"Using H.264 encoder '{self.h264.encoder}'.")
+            self.pub_h264 = rospy.Publisher(
+                "~image/h264",
+                CompressedImage,
+                # losing a frame breaks the stream until the next keyframe
+                queue_size=self.h264.keyframe_interval,
+                dt_topic_type=TopicType.DRIVER,
+                dt_help="The stream of H.264 access units from the camera",
+            )
+            self._image_publishers.append(self.pub_h264)
+
+        # change-gated publishing
+        self._change_detector = None
+        self._heartbeat_period = 0
+        self._last_change_stamp = 0
+        if rospy.get_param("~change_gate", False):
+            self._change_detector = ChangeDetector(
+                threshold=int(rospy.get_param("~change_threshold", 15)),
+                min_area=float(rospy.get_param("~change_min_area", 0.001)),
+            )
+            self._heartbeat_period = 1.0 / max(0.01, float(rospy.get_param("~heartbeat_rate", 0.2)))
+            self.pub_change = rospy.Publisher(
+                "~change_roi",
+                RegionOfInterest,
+                queue_size=1,
+                dt_topic_type=TopicType.DRIVER,
+                dt_help="Bounding box of the changes in the last frame published by the change gate",
+            )
+
+        # black box
+        self._blackbox = None
+        blackbox_seconds = float(rospy.get_param("~blackbox_seconds", 0))
+        if blackbox_seconds > 0:
+            max_bytes = int(float(rospy.get_param("~blackbox_max_mb", 64)) * 1024 * 1024)
+            self._blackbox = FrameRing(blackbox_seconds, max_bytes)
+            self._blackbox_dir = rospy.get_param("~blackbox_dir", "/data/logs/camera_blackbox")
+            self._blackbox_post_trigger = float(rospy.get_param("~blackbox_post_trigger", 2.0))
+            self._estop_engaged = False
+            self.srv_dump = rospy.Service("~dump", Trigger, self.srv_dump_cb)
+            self.sub_estop = rospy.Subscriber("~emergency_stop", BoolStamped, self._estop_cb, queue_size=1)
 
         # monitor
         self._last_image_published_time = 0
+        self._last_frame_time = 0
         # ---
         self.log("[AbsCameraNode]: Initialized.")
 
@@ -148,20 +619,96 @@ class AbsCameraNode(ABC, DTROS):
     def is_stopped(self):
         return self._is_stopped
 
+    def _reconfigurable_params(self) -> dict:
+        return {
+            "res_w": self._res_w.value,
+            "res_h": self._res_h.value,
+            "framerate": self._framerate.value,
+            "exposure_mode": self._exposure_mode.value,
+            "jpeg_quality": self._jpeg_quality.value,
+        }
+
     def parameters_updated(self):
-        self.stop()
-        self.update_camera_params()
-        self.start()
+        params = self._reconfigurable_params()
+        changes = {k: v for k, v in params.items() if self._applied_params.get(k) != v}
+        if not changes:
+            return
+        if "jpeg_quality" in changes:
+            self._jpeg_quality_set = True
+        tic, last_published = time.time(), self._last_image_published_time
+        # resolution changes always require a restart
+        live = "res_w" not in changes and "res_h" not in changes and self.reconfigure(changes)
+        if not live:
+            self.stop()
+            self.update_camera_params()
+            self.start()
+        self._applied_params = params
+        # the downtime is measured when the first frame captured from now on is published
+        label = "+".join(sorted(changes)) + (":live" if live else ":restart")
+        self._reconfiguration = (label, tic, last_published)
+
+    @property
+    def device_jpeg_quality(self) -> Optional[int]:
+        """JPEG quality cameras and hardware encoders should be set to, `None` to keep their default.
+
+        The quality is only pushed to the device if `~jpeg_quality` was set explicitly or changed
+        at runtime, the software encoder always uses it.
+        """
+        return self._jpeg_quality.value if self._jpeg_quality_set else None
+
+    def reconfigure(self, changes: dict) -> bool:
+        """Applies parameter changes to the running camera.
+
+        Backends override this to apply changes without restarting the camera, where the
+        hardware allows it. Changes to the resolution are never passed to this method.
+
+        Args:
+            changes (:obj:`dict`): New values of the changed parameters, keys are among
+                `framerate`, `exposure_mode` and `jpeg_quality`
+
+        Returns:
+            :obj:`bool`: `True` if all the changes were applied, `False` if the camera needs to
+            be restarted for them to take effect
+        """
+        return False
+
+    def _make_encoder(self, subsampling: Optional[str] = None) -> AbsJPEGEncoder:
+        name = str(self._encoder_name.value)
+        quality = self._jpeg_quality.value
+        subsampling = subsampling or str(self._jpeg_subsampling.value)
+        try:
+            encoder = get_encoder(name, quality=quality, subsampling=subsampling)
+        except (ValueError, RuntimeError, OSError) as e:
+            self.logwarn(f"Cannot use the JPEG encoder '{name}' ({str(e)}), falling back to 'opencv'.")
+            if subsampling not in AbsJPEGEncoder.SUBSAMPLINGS:
+                subsampling = "420"
+            encoder = OpenCVJPEGEncoder(quality=quality, subsampling=subsampling)
+        self.loginfo(
+            f"Using JPEG encoder '{type(encoder).__name__}' "
+            f"(quality: {encoder.quality}, subsampling: {encoder.subsampling})."
+        )
+        return encoder
+
+    def encoder_parameters_updated(self):
+        self._encoder = self._make_encoder()
+        if self._mono_encoder is not None:
+            self._mono_encoder = self._make_encoder("gray")
+        if self._bitrate is not None:
+            self._bitrate.max_quality = self._jpeg_quality.value
+        # the JPEG quality also affects backends encoding in hardware
+        self.parameters_updated()
 
-    def publish(self, image_msg):
-        # add time to messages
-        stamp = rospy.Time.now()
+    def publish(self, image_msg, stamp: Optional[float] = None):
+        # add time to messages, the time of capture if known
+        stamp = rospy.Time.now() if stamp is None else rospy.Time.from_sec(stamp)
         image_msg.header.stamp = stamp
         self.current_camera_info.header.stamp = stamp
         # update camera frame
         image_msg.header.frame_id = self.frame_id
         # publish image
+        tic = time.monotonic()
         self.pub_img.publish(image_msg)
+        self._stats.record("publish", time.monotonic() - tic)
         # publish camera info
         self.pub_camera_info.publish(self.current_camera_info)
         self._last_image_published_time = time.time()
@@ -170,6 +717,513 @@ class AbsCameraNode(ABC, DTROS):
             self.log("Published the first image.")
             self._has_published = True
 
+    def has_subscribers(self) -> bool:
+        server = self._http_server
+        if server is not None and (server.viewers > 0 or server.pending_snapshots > 0):
+            return True
+        # nobody knows who listens to the RTP stream
+        if self.h264 is not None and self._h264_rtp:
+            return True
+        return any(pub.get_num_connections() > 0 for pub in self._image_publishers)
+
+    def wants_frame(self) -> bool:
+        """Tells the capture thread whether the next frame should be retrieved.
+
+        Backends call this once per frame produced by the sensor. When it returns `False`,
+        they should only drain the frame from the device (e.g., `VideoCapture.grab`)
+        without retrieving, converting or publishing it.
+        """
+        now = time.time()
+        self._last_frame_time = now
+        wanted = self._wanted_by_subscribers(now)
+        # software rate limit, used when the framerate is lowered without restarting the sensor
+        if wanted and self._rate_limit is not None:
+            if now - self._last_wanted_frame_time < 0.95 / self._rate_limit:
+                return False
+            self._last_wanted_frame_time = now
+        return wanted
+
+    def _wanted_by_subscribers(self, now: float) -> bool:
+        if self._idle_mode == "none":
+            return True
+        # somebody is listening, resume (if needed)
+        if self.has_subscribers():
+            if self._is_idle:
+                self.loginfo("A subscriber connected, resuming the camera stream.")
+                self._is_idle = False
+            return True
+        # nobody is listening, idle
+        if not self._is_idle:
+            self.loginfo(f"No subscribers, the camera stream is now in '{self._idle_mode}' mode.")
+            self._is_idle = True
+        if self._idle_mode == "trickle" and now - self._last_idle_frame_time >= 1.0 / self._idle_framerate:
+            self._last_idle_frame_time = now
+            return True
+        return False
+
+    def acquire_buffer(self) -> FrameBuffer:
+        """Returns a free frame buffer the capture thread can write the next frame into."""
+        return self._buffers.acquire()
+
+    def commit_buffer(self, buf: FrameBuffer, fmt: str = "jpeg", stamp: Optional[float] = None):
+        """Hands a frame over to the publisher thread.
+
+        Args:
+            buf (:obj:`FrameBuffer`): A buffer obtained through :meth:`acquire_buffer`
+            fmt (:obj:`str`): The format of the frame, either ``jpeg`` or one of the raw
+                formats supported by the encoders (``bgr``, ``bgrx``, ``gray``)
+            stamp (:obj:`float`): Time (seconds since the epoch) at which the frame was captured,
+                as reported by the driver (see :class:`camera_driver.clock.CaptureClock`), default
+                is now
+        """
+        buf.format = fmt
+        buf.stamp = time.time() if stamp is None else stamp
+        self._capture_seq += 1
+        buf.seq = self._capture_seq
+        self._buffers.commit(buf)
+        self._stats.count("frames_in")
+
+    def release_buffer(self, buf: FrameBuffer):
+        """Gives back a frame buffer without publishing it."""
+        self._buffers.release(buf)
+
+    def _publisher_loop(self):
+        if self._encoder_pool is not None:
+            self._pooled_publisher_loop()
+            return
+        while (not self.is_stopped) and (not self.is_shutdown):
+            buf = self._buffers.take(timeout=0.1)
+            if buf is None:
+                continue
+            try:
+                self._publish_buffer(buf)
+            except Exception as e:
+                # a bad frame must not stop the publisher, capture would keep going unnoticed
+                self.logerr(f"Cannot publish frame: {str(e)}")
+            finally:
+                self._buffers.release(buf)
+        self.loginfo("Publisher worker stopped.")
+
+    def _pooled_publisher_loop(self):
+        # frames handed over to the encoder pool, in the order they were captured. The queue is
+        # bounded, so that the publisher waits (and the pool drops frames) rather than piling up work
+        in_flight = Queue(maxsize=self._encoder_threads)
+        publication = Thread(target=self._ordered_publication_loop, args=(in_flight,), daemon=True)
+        publication.start()
+        while (not self.is_stopped) and (not self.is_shutdown):
+            buf = self._buffers.take(timeout=0.1)
+            if buf is None:
+                continue
+            try:
+                frame = self._prepare_frame(buf, new_buffer=True)
+            except Exception as e:
+                self.logerr(f"Cannot publish frame: {str(e)}")
+                frame = None
+            if frame is None:
+                self._buffers.release(buf)
+                continue
+            if frame[0].format == "jpeg":
+                # nothing to encode, the frame still has to wait for the ones before it
+                future = Future()
+                future.set_result(self._encode_frame(frame[0]))
+            else:
+                future = self._encoder_pool.submit(self._encode_frame, frame[0], self._next_encoder())
+            in_flight.put((buf, frame, future))
+        in_flight.put(None)
+        publication.join()
+        self.loginfo("Publisher worker stopped.")
+
+    def _ordered_publication_loop(self, in_flight: Queue):
+        while True:
+            item = in_flight.get()
+            if item is None:
+                return
+            buf, (frame, change), future = item
+            try:
+                self._image_msg.data, elapsed = future.result()
+                self._stats.record("message" if frame.format == "jpeg" else "encode", elapsed)
+                self._publish_frame(frame, change)
+            except Exception as e:
+                self.logerr(f"Cannot publish frame: {str(e)}")
+            finally:
+                self._buffers.release(buf)
+
+    def _write_raw_frame(self, buf: FrameBuffer):
+        tic = time.monotonic()
+        if buf.format == "jpeg":
+            # JPEG backends cost one decode here, but save one decode per local consumer
+            image, fmt = self._decoder.decode(buf.data), "bgr"
+        else:
+            image, fmt = buf.data, buf.format
+        if self._shm_writer.write(image, buf.stamp, fmt):
+            descriptor = {
+                "name": self._shm_writer.name,
+                "slots": self._shm_writer.slots,
+                "slot_size": self._shm_writer.slot_size,
+            }
+            self.pub_raw_descriptor.publish(String(data=json.dumps(descriptor)))
+        self._stats.record("raw", time.monotonic() - tic)
+
+    def _apply_roi(self, buf: FrameBuffer, new_buffer: bool = False) -> FrameBuffer:
+        tic = time.monotonic()
+        # frames encoded in parallel cannot share the output buffer
+        out = FrameBuffer() if new_buffer else self._roi_buffer
+        scratch = out.data if isinstance(out.data, np.ndarray) else None
+        if buf.format == "jpeg":
+            # the binning comes for free while decoding
+            image = self._decoder.decode(buf.data, scale=self.roi.binning)
+            out.data, out.format = self.roi.apply(image, scratch, prebinned=True), "bgr"
+        else:
+            out.data, out.format = self.roi.apply(buf.data, scratch), buf.format
+        out.stamp, out.seq = buf.stamp, buf.seq
+        self._stats.record("roi", time.monotonic() - tic)
+        return out
+
+    def _publish_buffer(self, buf: FrameBuffer):
+        frame = self._prepare_frame(buf)
+        if frame is None:
+            return
+        buf, change = frame
+        encoder = self._next_encoder() if buf.format != "jpeg" else None
+        self._image_msg.data, elapsed = self._encode_frame(buf, encoder)
+        self._stats.record("message" if buf.format == "jpeg" else "encode", elapsed)
+        self._publish_frame(buf, change)
+
+    def _prepare_frame(
+        self, buf: FrameBuffer, new_buffer: bool = False
+    ) -> Optional[Tuple[FrameBuffer, Optional[tuple]]]:
+        """Everything that happens to a frame before it is encoded.
+
+        Returns:
+            :obj:`tuple`: The frame to encode and its change region (if any), `None` to skip it
+        """
+        # frames are prepared in the order they were captured, gaps are frames that were dropped
+        if self._last_seq is not None and buf.seq > self._last_seq + 1:
+            self._skipped_frames += buf.seq - self._last_seq - 1
+            self.pub_skipped.publish(UInt32(data=self._skipped_frames))
+        self._last_seq = buf.seq
+        # crop and bin in software, unless the camera did it already
+        if not self.roi.is_full and not self._roi_applied:
+            buf = self._apply_roi(buf, new_buffer)
+        # skip frames that did not change (before spending anything else on them)
+        change = None
+        if self._change_detector is not None:
+            publish, change = self._detect_change(buf)
+            if not publish:
+                self._stats.count("unchanged_frames")
+                return None
+        # raw frames go to shared memory first, before any encoding
+        if self._shm_writer is not None and self.pub_raw_descriptor.get_num_connections() > 0:
+            self._write_raw_frame(buf)
+        return buf, change
+
+    def _next_encoder(self) -> AbsJPEGEncoder:
+        """The encoder of the next raw frame, with the quality chosen by the bandwidth budget."""
+        encoder = self._encoder
+        if self._bitrate is not None:
+            encoder.quality = self._bitrate.quality
+        return encoder
+
+    @staticmethod
+    def _encode_frame(buf: FrameBuffer, encoder: Optional[AbsJPEGEncoder] = None) -> Tuple[bytes, float]:
+        """The JPEG data of a frame and the time it took, safe to call from any thread."""
+        tic = time.monotonic()
+        if buf.format == "jpeg":
+            # bytes and bytearrays are serialized as they are, without copying them into the message
+            data = buf.data if isinstance(buf.data, (bytes, bytearray)) else buf.tobytes()
+        else:
+            data = encoder.encode(buf.data, buf.format)
+        return data, time.monotonic() - tic
+
+    def _publish_frame(self, buf: FrameBuffer, change: Optional[tuple]):
+        """Publishes a frame encoded into `self._image_msg`, and feeds the other outputs."""
+        # the message is serialized within publish(), it is safe to reuse it for the next frame
+        self.publish(self._image_msg, buf.stamp)
+        for pub, limiter in self._throttled:
+            if pub.get_num_connections() > 0 and limiter.ready(buf.stamp):
+                pub.publish(self._image_msg)
+        age = time.time() - buf.stamp
+        self._stats.record("frame_age", age)
+        if change is not None:
+            self._publish_change(change)
+        if self._bitrate is not None:
+            self._update_bitrate(buf)
+        # the server always gets the latest frame, snapshots are served from it
+        has_server = self._http_server is not None
+        if self._preview is not None or has_server or self._blackbox is not None:
+            # buffers are recycled, keep an immutable copy (a no-op for frames that are bytes already)
+            jpeg = bytes(self._image_msg.data)
+            if self._preview is not None:
+                self._last_jpeg = (self._image_msg.header.stamp, jpeg)
+            if has_server:
+                self._http_frame.put(jpeg)
+            if self._blackbox is not None:
+                self._blackbox.add(self._image_msg.header.stamp.to_sec(), jpeg)
+        if self._rectifier is not None and self.pub_rect.get_num_connections() > 0:
+            self._submit_for_rectification(buf)
+        if self.h264 is not None and not self.H264_IN_PIPELINE:
+            subscribers = self.pub_h264.get_num_connections()
+            if subscribers > 0 or self._h264_rtp:
+                # new subscribers cannot decode anything before a keyframe
+                if subscribers > self._h264_subscribers:
+                    self.h264.request_keyframe()
+                self._encode_h264(buf)
+            self._h264_subscribers = subscribers
+        if self._mono_encoder is not None and self.pub_mono.get_num_connections() > 0:
+            self._publish_mono(buf)
+        self._stats.count("frames_out")
+        # first frame after a reconfiguration
+        if self._reconfiguration is not None and buf.stamp >= self._reconfiguration[1]:
+            label, _, last_published = self._reconfiguration
+            self._reconfiguration = None
+            downtime = self._last_image_published_time - last_published
+            self._stats.record(f"reconfigure/{label}", downtime)
+            self.loginfo(f"Reconfiguration '{label}' caused a downtime of {downtime * 1000:.0f}ms.")
+        # a frame is late if it was published after the next one was due
+        if age > 1.0 / max(1, self._framerate.value):
+            self._stats.count("late_frames")
+
+    def _update_bitrate(self, buf: FrameBuffer):
+        self._link_frames += 1
+        now = time.time()
+        if now - self._last_link_time >= self.LINK_STATS_PERIOD:
+            self._last_link_time = now
+            self._bitrate.congestion = self._link_congestion()
+        quality = self._bitrate.update(len(self._image_msg.data), buf.stamp)
+        # frames encoded by the camera get the new quality through a (rate limited) reconfiguration
+        if buf.format == "jpeg" and self._live_quality and quality != self._camera_quality:
+            if now - self._last_quality_time >= self.LIVE_QUALITY_PERIOD:
+                self._last_quality_time = now
+                if self.reconfigure({"jpeg_quality": quality}):
+                    self._camera_quality = quality
+                else:
+                    self._live_quality = False
+                    self.logwarn(
+                        f"The JPEG quality of the camera cannot be changed while streaming on this backend "
+                        f"({type(self).__name__}), the bandwidth budget is not enforced."
+                    )
+        if buf.format == "jpeg":
+            # the quality the camera encodes with, unknown while it uses its own default
+            quality = self.device_jpeg_quality if self._camera_quality is None else self._camera_quality
+        if quality is not None:
+            self._stats.set("jpeg_quality", quality)
+        self._stats.set("bitrate", round(self._bitrate.bitrate))
+        self._stats.set("link_congestion", round(self._bitrate.congestion, 3))
+
+    def _link_congestion(self) -> float:
+        """Returns the fraction of the frames published recently that the slowest subscriber missed.
+
+        Each subscriber has a queue of one frame, frames that find it still full are dropped.
+        """
+        published, self._link_frames = self._link_frames, 0
+        _, _, connections = self.pub_img.impl.get_stats()
+        congestion = 0.0
+        link_stats = {}
+        for cid, _, sent, connected in connections:
+            if not connected:
+                continue
+            link_stats[cid] = sent
+            # new connections are measured from the next period on
+            if cid in self._link_stats and published > 0:
+                # one frame might still be in the queue
+                missed = published - (sent - self._link_stats[cid]) - 1
+                congestion = max(congestion, missed / published)
+        self._link_stats = link_stats
+        return congestion
+
+    def _publish_mono(self, buf: FrameBuffer):
+        tic = time.monotonic()
+        if buf.format == "jpeg":
+            # only the luminance channel is decoded, there is no color conversion
+            image, fmt = self._decoder.decode(buf.data, "gray"), "gray"
+        else:
+            image, fmt = buf.data, buf.format
+        msg = CompressedImage(format="jpeg", data=self._mono_encoder.encode(image, fmt))
+        self._stats.record("mono", time.monotonic() - tic)
+        msg.header = self._image_msg.header
+        self.pub_mono.publish(msg)
+
+    def _detect_change(self, buf: FrameBuffer) -> Tuple[bool, Optional[Tuple[float, float, float, float]]]:
+        """Returns whether the frame passes the change gate, and the bounding box of the changes."""
+        tic = time.monotonic()
+        if buf.format == "jpeg":
+            luma = self._decoder.decode(buf.data, "gray", scale=ChangeDetector.DECIMATION)
+        else:
+            luma = self._change_detector.luminance(buf.data, buf.format)
+        change = self._change_detector.detect(luma)
+        heartbeat = buf.stamp - self._last_change_stamp >= self._heartbeat_period
+        if change is not None or heartbeat:
+            self._change_detector.set_reference(luma)
+            self._last_change_stamp = buf.stamp
+        self._stats.record("change", time.monotonic() - tic)
+        return change is not None or heartbeat, change
+
+    def _publish_change(self, change: Tuple[float, float, float, float]):
+        width, height = self.current_camera_info.width, self.current_camera_info.height
+        x, y, w, h = change
+        self.pub_change.publish(
+            RegionOfInterest(
+                x_offset=int(x * width),
+                y_offset=int(y * height),
+                width=int(round(w * width)),
+                height=int(round(h * height)),
+            )
+        )
+
+    def dump_blackbox(self, reason: str = "dump") -> str:
+        """Writes the black box to disk, returns the path of the file.
+
+        Raises:
+            OSError: If the file cannot be written
+        """
+        os.makedirs(self._blackbox_dir, exist_ok=True)
+        # milliseconds, two dumps within the same second (e.g., service and emergency stop) do not collide
+        now = time.time()
+        millis = int(now * 1000) % 1000
+        name = time.strftime("%Y%m%d_%H%M%S", time.localtime(now)) + f"_{millis:03d}_{reason}.mjpeg"
+        path = os.path.join(self._blackbox_dir, name)
+        tic = time.monotonic()
+        frames = self._blackbox.dump(path)
+        elapsed = time.monotonic() - tic
+        self.loginfo(f"Black box ({frames} frames) written to {path} in {elapsed * 1000:.0f}ms.")
+        return path
+
+    def srv_dump_cb(self, _):
+        try:
+            path = self.dump_blackbox()
+        except OSError as e:
+            return TriggerResponse(success=False, message=str(e))
+        return TriggerResponse(success=True, message=path)
+
+    def _estop_cb(self, msg: BoolStamped):
+        # only dump when the emergency stop gets engaged
+        engaged_before, self._estop_engaged = self._estop_engaged, msg.data
+        if msg.data and not engaged_before:
+            Timer(self._blackbox_post_trigger, self._dump_on_estop).start()
+
+    def _dump_on_estop(self):
+        try:
+            self.dump_blackbox("emergency_stop")
+        except OSError as e:
+            self.logerr(f"Cannot write the black box: {str(e)}")
+
+    def _encode_h264(self, buf: FrameBuffer):
+        tic = time.monotonic()
+        if buf.format == "jpeg":
+            image, fmt = self._decoder.decode(buf.data), "bgr"
+        else:
+            image, fmt = buf.data, buf.format
+        try:
+            self.h264.write(image, fmt, self._framerate.value, buf.stamp)
+        except RuntimeError as e:
+            self.logerr(f"H.264 stream stopped: {str(e)}")
+            self.h264.close()
+            self.h264 = None
+            return
+        self._stats.record("h264", time.monotonic() - tic)
+
+    def _publish_h264(self, data: bytes, keyframe: bool, stamp: float):
+        msg = CompressedImage(format="h264", data=data)
+        # the capture time of the frame, as for the image stream
+        msg.header.stamp = rospy.Time.from_sec(stamp)
+        msg.header.frame_id = self.frame_id
+        self.pub_h264.publish(msg)
+        self._stats.count("h264_frames")
+        if keyframe:
+            self._stats.count("h264_keyframes")
+
+    def _submit_for_rectification(self, buf: FrameBuffer):
+        # the buffer goes back to the capture thread, its content needs a copy (unless it is immutable)
+        data = buf.data.copy() if isinstance(buf.data, np.ndarray) else bytes(buf.data)
+        with self._rect_lock:
+            self._rect_pending = (self._image_msg.header.stamp, buf.format, data)
+            self._rect_lock.notify()
+
+    def _rectification_loop(self):
+        while not self.is_shutdown:
+            with self._rect_lock:
+                if self._rect_pending is None:
+                    self._rect_lock.wait(0.1)
+                frame, self._rect_pending = self._rect_pending, None
+            if frame is None:
+                continue
+            stamp, fmt, data = frame
+            # the maps depend on the resolution, which can change at runtime
+            camera_info = self.current_camera_info
+            if self._rectifier.resolution != (camera_info.width, camera_info.height):
+                tic = time.monotonic()
+                try:
+                    cached = self._rectifier.prepare(camera_info)
+                except OSError as e:
+                    self.logwarn(f"Cannot cache the rectification maps: {str(e)}")
+                    cached = False
+                self.loginfo(
+                    f"Rectification maps for {camera_info.width}x{camera_info.height} "
+                    f"{'loaded' if cached else 'computed'} in {(time.monotonic() - tic) * 1000:.0f}ms."
+                )
+            tic = time.monotonic()
+            if fmt == "jpeg":
+                image, fmt = self._rect_decoder.decode(data), "bgr"
+            else:
+                image = data
+            rectified = self._rectifier.rectify(image)
+            msg = CompressedImage(format="jpeg", data=self._encoder.encode(rectified, fmt))
+            self._stats.record("rectify", time.monotonic() - tic)
+            msg.header.stamp = stamp
+            msg.header.frame_id = self.frame_id
+            self.pub_rect.publish(msg)
+
+    def _publish_preview(self, _=None):
+        if self._last_jpeg is None or self.pub_preview.get_num_connections() <= 0:
+            return
+        stamp, data = self._last_jpeg
+        # do not publish the same frame twice
+        if stamp == self._last_preview_stamp:
+            return
+        self._last_preview_stamp = stamp
+        tic = time.monotonic()
+        msg = CompressedImage(format="jpeg", data=self._preview.downscale(data))
+        self._stats.record("preview", time.monotonic() - tic)
+        msg.header.stamp = stamp
+        msg.header.frame_id = self.frame_id
+        self.pub_preview.publish(msg)
+
+    def diagnostics(self) -> dict:
+        stats = self._stats.as_dict()
+        stats["counters"]["dropped_frames"] = self._buffers.dropped
+        stats["counters"]["grown_buffers"] = self._buffers.grown
+        if self._http_server is not None:
+            stats["values"]["http_viewers"] = self._http_server.viewers
+        if self._blackbox is not None:
+            stats["values"]["blackbox_frames"] = len(self._blackbox)
+            stats["values"]["blackbox_bytes"] = self._blackbox.size
+        return stats
+
+    def _publish_diagnostics(self, _=None):
+        if self.pub_diagnostics.get_num_connections() <= 0:
+            return
+        stats = self.diagnostics()
+        values = []
+        for stage, hist in stats["stages"].items():
+            values.extend(KeyValue(f"{stage}/{k}", f"{v:.3f}") for k, v in hist.items())
+        for group in ["counters", "rates", "values"]:
+            values.extend(KeyValue(k, str(v)) for k, v in stats[group].items())
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        msg.status = [
+            DiagnosticStatus(
+                level=DiagnosticStatus.OK,
+                name=rospy.get_name(),
+                message="Camera pipeline statistics",
+                hardware_id=self.frame_id,
+                values=values,
+            )
+        ]
+        self.pub_diagnostics.publish(msg)
+
+    def srv_get_diagnostics_cb(self, _):
+        return TriggerResponse(success=True, message=json.dumps(self.diagnostics()))
+
     def start(self):
         """
         Begins the camera capturing.
@@ -178,11 +1232,20 @@ class AbsCameraNode(ABC, DTROS):
         # ---
         try:
             try:
+                # backends set this in `setup()` if they apply the region of interest themselves
+                self._roi_applied = False
+                # (re)starting the camera resets the quality it encodes frames with
+                self._camera_quality = None
                 self.setup()
+                if not self.roi.is_full and not self._roi_applied:
+                    self.logwarn("The region of interest is applied in software.")
             except RuntimeError as e:
                 rospy.signal_shutdown(str(e))
                 return
-            # run camera thread
+            # run publisher and camera threads
+            self._buffers.clear()
+            self._publisher = Thread(target=self._publisher_loop, daemon=True)
+            self._publisher.start()
             self._worker = Thread(target=self.run, daemon=True)
             self._worker.start()
         except StopIteration:
@@ -196,7 +1259,10 @@ class AbsCameraNode(ABC, DTROS):
             if self._worker is not None:
                 self._worker.join()
                 time.sleep(1)
+            if self._publisher is not None:
+                self._publisher.join()
         self._worker = None
+        self._publisher = None
         # release resources
         self.release(force=force)
         time.sleep(1)
@@ -213,10 +1279,24 @@ class AbsCameraNode(ABC, DTROS):
 
     @abstractmethod
     def run(self):
+        """Capture loop.
+
+        Implementations keep reading frames into buffers obtained through
+        :meth:`acquire_buffer` and pass them on with :meth:`commit_buffer` until
+        the node is stopped or shut down.
+        """
         raise NotImplementedError("Child classes should implement this method.")
 
     def on_shutdown(self):
         self.stop(force=True)
+        if self._shm_writer is not None:
+            self._shm_writer.close()
+        if self._http_server is not None:
+            self._http_server.stop()
+        if self.h264 is not None:
+            self.h264.close()
+        if self._encoder_pool is not None:
+            self._encoder_pool.shutdown(wait=False)
 
     def srv_set_camera_info_cb(self, req):
         self.log("[srv_set_camera_info_cb] Callback!")
@@ -287,6 +1367,17 @@ class AbsCameraNode(ABC, DTROS):
         scale_matrix[6] *= scale_height
         self.current_camera_info.P = np.array(self.original_camera_info.P) * scale_matrix
 
+        # adjust to the region of interest
+        res_w, res_h = self._res_w.value, self._res_h.value
+        try:
+            self.roi = CameraROI.from_params(self._roi_param, self._binning, res_w, res_h)
+        except ValueError as e:
+            self.logwarn(f"Invalid region of interest ({str(e)}), using the whole frame instead.")
+            self.roi = CameraROI.full(res_w, res_h)
+        self.current_camera_info.roi = RegionOfInterest()
+        if not self.roi.is_full:
+            self.roi.adjust_camera_info(self.current_camera_info)
+
     @staticmethod
     def load_camera_info(filename):
         """Loads the camera calibration files.
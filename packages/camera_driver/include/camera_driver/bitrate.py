@@ -0,0 +1,108 @@
+import math
+from typing import Optional
+
+
+class BitrateController:
+    """Closed-loop controller of the JPEG quality that keeps a stream within a bandwidth budget.
+
+    The budget of each frame is the target bitrate divided by the observed framerate, capped at
+    the maximum frame size (either can be disabled), and reduced further while the link is
+    congested. After each frame, the quality is corrected proportionally to the (logarithmic)
+    error between the size of the frame and its budget, as the size of a JPEG grows roughly
+    exponentially with its quality.
+
+    Args:
+        target_bitrate (:obj:`float`): Target bitrate in bytes per second, 0 to disable
+        max_frame_size (:obj:`int`): Maximum size of a frame in bytes, 0 to disable
+        min_quality (:obj:`int`): Lowest quality the controller can choose
+        max_quality (:obj:`int`): Highest quality the controller can choose
+        gain (:obj:`float`): Quality points per halving/doubling of the frame size needed
+    """
+
+    # relative size errors smaller than this are ignored (~4%), to avoid dithering
+    DEADBAND = 0.05
+    # smoothing factor of the averages
+    ALPHA = 0.1
+
+    def __init__(
+        self,
+        target_bitrate: float = 0,
+        max_frame_size: int = 0,
+        min_quality: int = 10,
+        max_quality: int = 95,
+        gain: float = 10.0,
+    ):
+        if target_bitrate <= 0 and max_frame_size <= 0:
+            raise ValueError("Either a target bitrate or a maximum frame size is needed.")
+        self._target_bitrate = target_bitrate
+        self._max_frame_size = max_frame_size
+        self._min_quality = min_quality
+        self._max_quality = max_quality
+        self._gain = gain
+        self._quality = float(max_quality)
+        self._interval: Optional[float] = None
+        self._last_stamp: Optional[float] = None
+        self._bitrate = 0.0
+        self._congestion = 0.0
+
+    @property
+    def quality(self) -> int:
+        return int(round(self._quality))
+
+    @property
+    def bitrate(self) -> float:
+        """Measured bitrate, in bytes per second."""
+        return self._bitrate
+
+    @property
+    def max_quality(self) -> int:
+        return self._max_quality
+
+    @max_quality.setter
+    def max_quality(self, value: int):
+        self._max_quality = value
+        self._quality = min(self._quality, value)
+
+    @property
+    def congestion(self) -> float:
+        return self._congestion
+
+    @congestion.setter
+    def congestion(self, value: float):
+        """Fraction of the frames the link could not deliver recently, between 0 and 1."""
+        self._congestion = min(0.9, max(0.0, value))
+
+    def frame_budget(self) -> Optional[float]:
+        """Number of bytes the next frame can take, `None` until the framerate is known."""
+        budgets = []
+        if self._max_frame_size > 0:
+            budgets.append(self._max_frame_size)
+        if self._target_bitrate > 0:
+            if self._interval is None:
+                return None
+            budgets.append(self._target_bitrate * self._interval)
+        # a congested link delivers fewer frames, make them smaller
+        return min(budgets) * (1.0 - self._congestion)
+
+    def update(self, frame_size: int, stamp: float) -> int:
+        """Accounts for a frame that was just published and returns the quality for the next one.
+
+        Args:
+            frame_size (:obj:`int`): Size of the frame in bytes
+            stamp (:obj:`float`): Time (in seconds) at which the frame was captured
+        """
+        if self._last_stamp is not None and stamp > self._last_stamp:
+            interval = stamp - self._last_stamp
+            self._interval = interval if self._interval is None else self._ema(self._interval, interval)
+            self._bitrate = self._ema(self._bitrate, frame_size / self._interval)
+        self._last_stamp = stamp
+        budget = self.frame_budget()
+        if budget is None or frame_size <= 0:
+            return self.quality
+        error = math.log2(budget / frame_size)
+        if abs(error) > self.DEADBAND:
+            self._quality = min(self._max_quality, max(self._min_quality, self._quality + self._gain * error))
+        return self.quality
+
+    def _ema(self, average: float, value: float) -> float:
+        return average + self.ALPHA * (value - average)
@@ -0,0 +1,57 @@
+from collections import deque
+from threading import Lock
+from typing import Deque, List, Tuple
+
+from .mjpeg import IndexedMJPEGWriter
+
+
+class FrameRing:
+    """The most recent encoded frames, bounded both in duration and in size ("black box").
+
+    Frames are kept as they are (immutable :obj:`bytes`, shared with whoever else holds them),
+    adding one costs no copy and no encoding.
+
+    Args:
+        seconds (:obj:`float`): Frames older than this (with respect to the newest one) are dropped
+        max_bytes (:obj:`int`): The oldest frames are dropped once the frames take more than this
+    """
+
+    def __init__(self, seconds: float, max_bytes: int):
+        self._seconds = seconds
+        self._max_bytes = max_bytes
+        self._frames: Deque[Tuple[float, bytes]] = deque()
+        self._bytes = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @property
+    def size(self) -> int:
+        """Number of bytes held."""
+        return self._bytes
+
+    def add(self, stamp: float, data: bytes):
+        with self._lock:
+            self._frames.append((stamp, data))
+            self._bytes += len(data)
+            frames = self._frames
+            while frames and (self._bytes > self._max_bytes or stamp - frames[0][0] > self._seconds):
+                self._bytes -= len(frames.popleft()[1])
+
+    def frames(self) -> List[Tuple[float, bytes]]:
+        """The frames currently held, as (timestamp, data), oldest first."""
+        with self._lock:
+            return list(self._frames)
+
+    def dump(self, path: str) -> int:
+        """Writes the frames currently held to an indexed MJPEG file, returns the number of frames.
+
+        Raises:
+            OSError: If the file cannot be written
+        """
+        frames = self.frames()
+        with IndexedMJPEGWriter(path) as writer:
+            for stamp, data in frames:
+                writer.write(stamp, data)
+        return len(frames)
@@ -0,0 +1,124 @@
+import time
+from threading import Condition
+from typing import Optional, List, Union
+
+import numpy as np
+
+
+class FrameBuffer:
+    """A reusable container for a single camera frame.
+
+    Backends write directly into :attr:`data` (e.g., by passing it as output array to
+    ``cv2.VideoCapture.read``) so that, once the shape of the frame stabilizes,
+    no memory is allocated per frame.
+
+    Attributes:
+        data (:obj:`numpy.ndarray`, :obj:`bytes` or :obj:`bytearray`): The frame content
+        format (:obj:`str`): The format of the content, ``jpeg`` for already encoded frames,
+            a pixel format (e.g., ``bgr``) for raw frames
+        stamp (:obj:`float`): Time (seconds since the epoch) at which the frame was captured
+        seq (:obj:`int`): Sequence number of the frame, consecutive across the frames captured
+    """
+
+    def __init__(self):
+        self.data: Optional[Union[np.ndarray, bytes, bytearray]] = None
+        self.format: str = "jpeg"
+        self.stamp: float = 0.0
+        self.seq: int = 0
+
+    def tobytes(self) -> bytes:
+        if isinstance(self.data, np.ndarray):
+            return self.data.tobytes()
+        return bytes(self.data)
+
+
+class FrameBufferPool:
+    """A small pool of preallocated frame buffers with a latest-wins handoff.
+
+    A single producer (the capture thread) acquires a free buffer, fills it and commits it.
+    A single consumer (the publisher thread) takes the latest committed buffer and releases
+    it once done. If the producer commits a new frame before the consumer took the previous
+    one, the older frame is recycled and counted as dropped, so the producer never waits
+    on the consumer. If every buffer is held elsewhere (e.g., by encoder threads), the pool
+    grows by one buffer rather than making the producer wait, see :attr:`grown`.
+
+    Args:
+        size (:obj:`int`): Number of buffers in the pool, at least 3 (one being written,
+            one pending, one being published)
+    """
+
+    MIN_SIZE = 3
+
+    def __init__(self, size: int = MIN_SIZE):
+        size = max(self.MIN_SIZE, size)
+        self._buffers: List[FrameBuffer] = [FrameBuffer() for _ in range(size)]
+        self._free: List[FrameBuffer] = list(self._buffers)
+        self._pending: Optional[FrameBuffer] = None
+        self._lock = Condition()
+        self._dropped = 0
+        self._grown = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._buffers)
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    @property
+    def grown(self) -> int:
+        """Number of buffers allocated beyond the initial size of the pool."""
+        return self._grown
+
+    def acquire(self) -> FrameBuffer:
+        """Returns a free buffer the producer can write into."""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            # the pool is exhausted, steal the pending frame rather than blocking the capture
+            if self._pending is not None:
+                buf, self._pending = self._pending, None
+                self._dropped += 1
+                return buf
+            # every buffer is held by the consumer (or whoever it handed them to)
+            buf = FrameBuffer()
+            self._buffers.append(buf)
+            self._grown += 1
+            return buf
+
+    def commit(self, buf: FrameBuffer):
+        """Hands a filled buffer over to the consumer, replacing any frame not yet taken."""
+        with self._lock:
+            if self._pending is not None:
+                self._free.append(self._pending)
+                self._dropped += 1
+            self._pending = buf
+            self._lock.notify()
+
+    def release(self, buf: FrameBuffer):
+        """Returns a buffer to the pool without publishing it."""
+        with self._lock:
+            self._free.append(buf)
+
+    def take(self, timeout: float = None) -> Optional[FrameBuffer]:
+        """Returns the latest committed buffer, waiting up to `timeout` seconds for one.
+
+        The caller owns the buffer until it gives it back through :meth:`release`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._lock.wait(remaining)
+            buf, self._pending = self._pending, None
+            return buf
+
+    def clear(self):
+        """Discards the pending frame, if any."""
+        with self._lock:
+            if self._pending is not None:
+                self._free.append(self._pending)
+                self._pending = None
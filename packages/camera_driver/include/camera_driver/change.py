@@ -0,0 +1,62 @@
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class ChangeDetector:
+    """Detects changes between frames, on decimated luminance images.
+
+    Frames are compared with a reference frame (the last one published) rather than with the
+    previous one, so that slow changes are detected once they add up.
+
+    Args:
+        threshold (:obj:`int`): Difference of luminance (0-255) above which a pixel has changed
+        min_area (:obj:`float`): Fraction of the pixels that have to change for a frame to change
+    """
+
+    # frames are compared at 1/8th of their resolution, JPEG frames are decoded at that scale directly
+    DECIMATION = 8
+
+    def __init__(self, threshold: int = 15, min_area: float = 0.001):
+        self._threshold = threshold
+        self._min_area = min_area
+        self._reference: Optional[np.ndarray] = None
+        self._diff: Optional[np.ndarray] = None
+
+    def luminance(self, image: np.ndarray, fmt: str) -> np.ndarray:
+        """Decimated luminance of a raw frame (``bgr``, ``bgrx`` or ``gray``)."""
+        height, width = image.shape[:2]
+        size = (max(1, width // self.DECIMATION), max(1, height // self.DECIMATION))
+        # averaging the pixels also averages out the noise of the sensor
+        small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        if fmt == "bgr":
+            return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if fmt == "bgrx":
+            return cv2.cvtColor(small, cv2.COLOR_BGRA2GRAY)
+        return small
+
+    def detect(self, luma: np.ndarray) -> Optional[Tuple[float, float, float, float]]:
+        """Compares a decimated luminance image with the reference.
+
+        Returns:
+            :obj:`tuple`: The bounding box of the changes as `(x, y, w, h)`, in fractions of the
+            frame, or `None` if the frame did not change. Without a reference, the whole frame changed
+        """
+        if self._reference is None or self._reference.shape != luma.shape:
+            return 0.0, 0.0, 1.0, 1.0
+        if self._diff is None or self._diff.shape != luma.shape:
+            self._diff = np.empty_like(luma)
+        diff = cv2.absdiff(luma, self._reference, dst=self._diff)
+        cv2.threshold(diff, self._threshold, 255, cv2.THRESH_BINARY, dst=diff)
+        if cv2.countNonZero(diff) < max(1.0, self._min_area * diff.size):
+            return None
+        x, y, w, h = cv2.boundingRect(diff)
+        height, width = diff.shape
+        return x / width, y / height, w / width, h / height
+
+    def set_reference(self, luma: np.ndarray):
+        """Makes a (decimated luminance) frame the reference the next ones are compared with."""
+        if self._reference is None or self._reference.shape != luma.shape:
+            self._reference = np.empty_like(luma)
+        np.copyto(self._reference, luma)
@@ -0,0 +1,58 @@
+import time
+from typing import Callable, Optional
+
+
+class CaptureClock:
+    """Converts the capture timestamps of a camera (or of its driver) into time since the epoch.
+
+    If the current time of the clock of the device can be read (`now`), the conversion is exact.
+    Otherwise, the offset between the two clocks is estimated as the smallest difference seen
+    between the time a frame is received and its timestamp, i.e., the fastest delivery so far is
+    taken as no delay at all. The estimate is allowed to grow by `DRIFT` seconds per second, to
+    follow a device clock running slower than the system one.
+
+    Timestamps that cannot be right (in the future, or older than `MAX_AGE`) are replaced with
+    the time the frame was received.
+
+    Args:
+        now (:obj:`callable`): Returns the current time of the clock of the device, in seconds
+    """
+
+    # how fast the two clocks are expected to drift apart (100 ppm)
+    DRIFT = 1e-4
+    # frames older than this (seconds) on arrival are assumed to be wrongly timestamped
+    MAX_AGE = 1.0
+
+    def __init__(self, now: Optional[Callable[[], float]] = None):
+        self._now = now
+        self._offset: Optional[float] = None
+        self._last_time = 0.0
+
+    def reset(self):
+        """Forgets the estimated offset, e.g., when the device (and its clock) restarts."""
+        self._offset = None
+
+    def to_time(self, stamp: Optional[float]) -> float:
+        """Time (seconds since the epoch) at which a frame was captured.
+
+        Args:
+            stamp (:obj:`float`): Capture timestamp of the frame in the clock of the device, in
+                seconds. `None` or a non-positive value stand for a frame without timestamp
+        """
+        received = time.time()
+        if stamp is None or stamp <= 0:
+            return received
+        if self._now is not None:
+            capture = stamp + received - self._now()
+        else:
+            offset = received - stamp
+            if self._offset is not None:
+                allowed = self._offset + self.DRIFT * (received - self._last_time)
+                # a frame that looks too old means that the device clock jumped (e.g., it restarted)
+                if offset - allowed <= self.MAX_AGE:
+                    offset = min(offset, allowed)
+            self._offset, self._last_time = offset, received
+            capture = stamp + offset
+        if not received - self.MAX_AGE <= capture <= received:
+            return received
+        return capture
@@ -0,0 +1,228 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Type
+
+import cv2
+import numpy as np
+
+try:
+    import turbojpeg
+except ImportError:
+    turbojpeg = None
+
+
+class AbsJPEGEncoder(ABC):
+    """Encodes raw frames into JPEG.
+
+    Args:
+        quality (:obj:`int`): JPEG quality, between 1 and 100
+        subsampling (:obj:`str`): Chroma subsampling, one of :attr:`SUBSAMPLINGS`, `gray`
+            produces single-channel JPEGs
+    """
+
+    SUBSAMPLINGS = ["420", "422", "444", "gray"]
+    # pixel formats of the raw frames an encoder can take as input
+    PIXEL_FORMATS = ["bgr", "bgrx", "gray"]
+
+    def __init__(self, quality: int = 95, subsampling: str = "420"):
+        if subsampling not in self.SUBSAMPLINGS:
+            raise ValueError(
+                f"Subsampling `{subsampling}` not supported. "
+                f"Possible choices are `{self.SUBSAMPLINGS}`."
+            )
+        self._quality = 0
+        self._subsampling = subsampling
+        self.quality = quality
+
+    @property
+    def quality(self) -> int:
+        return self._quality
+
+    @quality.setter
+    def quality(self, value: int):
+        self._quality = int(min(100, max(1, value)))
+
+    @property
+    def subsampling(self) -> str:
+        return self._subsampling
+
+    @abstractmethod
+    def encode(self, image: np.ndarray, pixel_format: str = "bgr") -> bytes:
+        """Encodes a raw frame.
+
+        Args:
+            image (:obj:`numpy.ndarray`): The frame, with shape (H, W, 3) for `bgr`,
+                (H, W, 4) for `bgrx` and (H, W) for `gray`
+            pixel_format (:obj:`str`): One of :attr:`PIXEL_FORMATS`
+
+        Returns:
+            :obj:`bytes`: The JPEG-encoded frame
+        """
+
+
+class OpenCVJPEGEncoder(AbsJPEGEncoder):
+    """Encodes frames through ``cv2.imencode`` (libjpeg)."""
+
+    def __init__(self, quality: int = 95, subsampling: str = "420"):
+        super(OpenCVJPEGEncoder, self).__init__(quality, subsampling)
+        # chroma subsampling can only be controlled on OpenCV >= 4.5.5
+        self._sampling_factor = {
+            "420": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_420", None),
+            "422": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_422", None),
+            "444": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_444", None),
+            "gray": None,
+        }[subsampling]
+
+    def encode(self, image: np.ndarray, pixel_format: str = "bgr") -> bytes:
+        if self._subsampling == "gray" and pixel_format != "gray":
+            code = cv2.COLOR_BGRA2GRAY if pixel_format == "bgrx" else cv2.COLOR_BGR2GRAY
+            image = cv2.cvtColor(image, code)
+        params = [cv2.IMWRITE_JPEG_QUALITY, self._quality]
+        if self._sampling_factor is not None:
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, self._sampling_factor]
+        # NOTE: 4-channel (BGRx) images are converted to BGR internally by OpenCV
+        _, data = cv2.imencode(".jpg", image, params)
+        return data.tobytes()
+
+
+class TurboJPEGEncoder(AbsJPEGEncoder):
+    """Encodes frames through libjpeg-turbo (via PyTurboJPEG).
+
+    Frames in any of the supported pixel formats (including BGRx) are handed to libjpeg-turbo
+    as they are, without any intermediate conversion or copy.
+    """
+
+    def __init__(self, quality: int = 95, subsampling: str = "420"):
+        if turbojpeg is None:
+            raise RuntimeError("The module `turbojpeg` (PyTurboJPEG) is not installed.")
+        super(TurboJPEGEncoder, self).__init__(quality, subsampling)
+        self._jpeg = turbojpeg.TurboJPEG()
+        self._tj_subsampling = {
+            "420": turbojpeg.TJSAMP_420,
+            "422": turbojpeg.TJSAMP_422,
+            "444": turbojpeg.TJSAMP_444,
+            "gray": turbojpeg.TJSAMP_GRAY,
+        }[subsampling]
+        self._tj_pixel_format = {
+            "bgr": turbojpeg.TJPF_BGR,
+            "bgrx": turbojpeg.TJPF_BGRX,
+            "gray": turbojpeg.TJPF_GRAY,
+        }
+
+    def encode(self, image: np.ndarray, pixel_format: str = "bgr") -> bytes:
+        # grayscale input can only be encoded as a grayscale JPEG
+        subsampling = turbojpeg.TJSAMP_GRAY if pixel_format == "gray" else self._tj_subsampling
+        return self._jpeg.encode(
+            image,
+            quality=self._quality,
+            pixel_format=self._tj_pixel_format[pixel_format],
+            jpeg_subsample=subsampling,
+        )
+
+
+ENCODERS: Dict[str, Type[AbsJPEGEncoder]] = {
+    "opencv": OpenCVJPEGEncoder,
+    "turbojpeg": TurboJPEGEncoder,
+}
+
+
+def get_encoder(name: str, quality: int = 95, subsampling: str = "420") -> AbsJPEGEncoder:
+    """Instantiates the JPEG encoder with the given name.
+
+    Raises:
+        ValueError: If the encoder or the subsampling are not supported
+        RuntimeError: If the encoder backend is not available on this system
+    """
+    if name not in ENCODERS:
+        raise ValueError(f"Encoder `{name}` not supported. Possible choices are `{list(ENCODERS)}`.")
+    return ENCODERS[name](quality=quality, subsampling=subsampling)
+
+
+def _turbojpeg_or_none():
+    if turbojpeg is None:
+        return None
+    try:
+        return turbojpeg.TurboJPEG()
+    except (RuntimeError, OSError):
+        return None
+
+
+class JPEGDecoder:
+    """Decodes JPEG images, through libjpeg-turbo when available and OpenCV otherwise."""
+
+    def __init__(self):
+        self._jpeg = _turbojpeg_or_none()
+
+    def decode(self, jpeg: bytes, pixel_format: str = "bgr", scale: int = 1) -> np.ndarray:
+        """Decodes a JPEG image.
+
+        Args:
+            jpeg (:obj:`bytes`): The JPEG image
+            pixel_format (:obj:`str`): Either `bgr` or `gray`
+            scale (:obj:`int`): Downscaling factor applied while decoding, one of 1, 2, 4, 8
+
+        Returns:
+            :obj:`numpy.ndarray`: The image, with shape (H, W, 3) for `bgr`, (H, W) for `gray`
+        """
+        gray = pixel_format == "gray"
+        if self._jpeg is not None:
+            image = self._jpeg.decode(
+                jpeg,
+                pixel_format=turbojpeg.TJPF_GRAY if gray else turbojpeg.TJPF_BGR,
+                scaling_factor=(1, scale) if scale > 1 else None,
+            )
+            return image[:, :, 0] if gray else image
+        mode = {
+            (1, False): cv2.IMREAD_COLOR,
+            (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+            (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+            (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+            (1, True): cv2.IMREAD_GRAYSCALE,
+            (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+            (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+        }[(scale, gray)]
+        return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), mode)
+
+
+class JPEGDownscaler:
+    """Produces downscaled copies of JPEG images without fully decoding them.
+
+    With libjpeg-turbo available, the image is decoded straight into (scaled) YUV planes, using the
+    scaling factors that libjpeg-turbo applies in the DCT domain, and re-encoded from those planes,
+    no color conversion or resizing is involved. Otherwise, OpenCV's reduced decoding modes
+    (``IMREAD_REDUCED_*``, backed by the same libjpeg DCT scaling) are used.
+
+    Args:
+        scale (:obj:`int`): Downscaling factor, one of :attr:`SCALES`
+        quality (:obj:`int`): JPEG quality of the downscaled images
+    """
+
+    SCALES = [2, 4, 8]
+
+    def __init__(self, scale: int, quality: int = 75):
+        if scale not in self.SCALES:
+            raise ValueError(f"Scale `{scale}` not supported. Possible choices are `{self.SCALES}`.")
+        self._scale = scale
+        self._quality = int(min(100, max(1, quality)))
+        self._jpeg = _turbojpeg_or_none()
+        self._cv2_mode = {
+            2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8,
+        }[scale]
+
+    @property
+    def scale(self) -> int:
+        return self._scale
+
+    def downscale(self, jpeg: bytes) -> bytes:
+        if self._jpeg is not None:
+            _, _, subsampling, _ = self._jpeg.decode_header(jpeg)
+            yuv, planes = self._jpeg.decode_to_yuv(jpeg, scaling_factor=(1, self._scale), pad=4)
+            height, width = planes[0]
+            return self._jpeg.encode_from_yuv(
+                yuv, height, width, quality=self._quality, jpeg_subsample=subsampling
+            )
+        image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), self._cv2_mode)
+        _, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self._quality])
+        return data.tobytes()
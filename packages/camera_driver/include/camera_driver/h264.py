@@ -0,0 +1,287 @@
+import os
+import time
+import struct
+import subprocess
+from collections import deque
+from threading import Thread
+from typing import Callable, Deque, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .clock import CaptureClock
+
+# H.264 encoders, in order of preference
+H264_ENCODERS = ["nvv4l2h264enc", "x264enc", "openh264enc"]
+
+# NAL unit types
+NAL_SLICE = 1
+NAL_IDR_SLICE = 5
+# SEI, SPS, PPS and access unit delimiters only appear at the beginning of an access unit
+NAL_AU_PREFIXES = {6, 7, 8, 9}
+START_CODE = b"\x00\x00\x01"
+
+# GStreamer Data Protocol (`gdppay`) packets: a fixed size header followed by the payload. The header
+# holds the version, flags, payload type, payload length, PTS (then duration and offsets), buffer
+# flags (then DTS and checksums)
+GDP_HEADER = struct.Struct(">BBBxHIQ24xH18x")
+GDP_PAYLOAD_BUFFER = 1
+GDP_CLOCK_TIME_NONE = (1 << 64) - 1
+GST_BUFFER_FLAG_DELTA_UNIT = 1 << 13
+
+
+def gst_element_exists(name: str) -> bool:
+    try:
+        return subprocess.run(["gst-inspect-1.0", "--exists", name]).returncode == 0
+    except OSError:
+        return False
+
+
+def pick_encoder(name: str = "auto") -> str:
+    """Returns the H.264 encoder to use, the first one available in :data:`H264_ENCODERS` for `auto`.
+
+    Raises:
+        RuntimeError: If the encoder (or none of them, for `auto`) is available
+    """
+    candidates = H264_ENCODERS if name == "auto" else [name]
+    for encoder in candidates:
+        if encoder not in H264_ENCODERS:
+            raise RuntimeError(
+                f"H.264 encoder `{encoder}` not supported. Possible choices are {H264_ENCODERS}."
+            )
+        if gst_element_exists(encoder):
+            return encoder
+    raise RuntimeError(f"GStreamer element(s) {candidates} not found.")
+
+
+def gst_encoder_string(encoder: str, bitrate: int, keyframe_interval: int, nvmm: bool = False) -> str:
+    """GStreamer elements encoding raw frames into H.264, followed by a link (` ! `).
+
+    Args:
+        encoder (:obj:`str`): One of :data:`H264_ENCODERS`
+        bitrate (:obj:`int`): Target bitrate, in bits per second
+        keyframe_interval (:obj:`int`): Frames between two keyframes
+        nvmm (:obj:`bool`): Whether the frames come in NVMM memory (Jetson)
+    """
+    if encoder == "nvv4l2h264enc":
+        convert = "" if nvmm else "nvvidconv ! video/x-raw(memory:NVMM), format=I420 ! "
+        return (
+            f"{convert}nvv4l2h264enc bitrate={bitrate} iframeinterval={keyframe_interval} "
+            f"idrinterval={keyframe_interval} insert-sps-pps=true maxperf-enable=true ! "
+        )
+    convert = "nvvidconv" if nvmm else "videoconvert"
+    convert = f"{convert} ! video/x-raw, format=I420 ! "
+    if encoder == "x264enc":
+        return (
+            f"{convert}x264enc tune=zerolatency speed-preset=ultrafast bitrate={bitrate // 1000} "
+            f"key-int-max={keyframe_interval} ! "
+        )
+    if encoder == "openh264enc":
+        return f"{convert}openh264enc bitrate={bitrate} gop-size={keyframe_interval} complexity=low ! "
+    raise ValueError(f"H.264 encoder `{encoder}` not supported. Possible choices are {H264_ENCODERS}.")
+
+
+class AccessUnitSplitter:
+    """Splits an H.264 byte stream (Annex B) into access units, i.e., the data of one frame each.
+
+    An access unit is only complete once the first NAL unit of the next one is seen.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._scan = 0
+        self._has_slice = False
+        self._keyframe = False
+
+    def feed(self, chunk: bytes) -> List[Tuple[bytes, bool]]:
+        """Returns the access units completed by `chunk`, as `(data, is_keyframe)`."""
+        data = self._data
+        data += chunk
+        units = []
+        while True:
+            pos = data.find(START_CODE, self._scan)
+            # the type of the NAL unit and the first byte of its payload are needed
+            if pos < 0 or pos + 5 > len(data):
+                self._scan = max(0, len(data) - 4) if pos < 0 else pos
+                break
+            nal_type = data[pos + 3] & 0x1F
+            is_slice = nal_type in (NAL_SLICE, NAL_IDR_SLICE)
+            # the first slice of a frame starts at macroblock 0, i.e., its first bit is set
+            first_nal = nal_type in NAL_AU_PREFIXES or (is_slice and data[pos + 4] & 0x80)
+            if first_nal and self._has_slice:
+                start = pos - 1 if pos > 0 and data[pos - 1] == 0 else pos
+                units.append((bytes(data[:start]), self._keyframe))
+                del data[:start]
+                pos -= start
+                self._has_slice = self._keyframe = False
+            self._has_slice |= is_slice
+            self._keyframe |= nal_type == NAL_IDR_SLICE
+            self._scan = pos + 3
+        return units
+
+
+class GDPDepayloader:
+    """Splits the output of `gdppay` into the buffers it carries, with their timestamps.
+
+    Packets other than buffers (caps and events) are skipped.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def feed(self, chunk: bytes) -> List[Tuple[bytes, int, int]]:
+        """Returns the buffers completed by `chunk`, as `(data, pts, flags)`, `pts` in nanoseconds."""
+        data = self._data
+        data += chunk
+        buffers = []
+        start = 0
+        while len(data) - start >= GDP_HEADER.size:
+            _, _, _, payload_type, length, pts, flags = GDP_HEADER.unpack_from(data, start)
+            end = start + GDP_HEADER.size + length
+            if end > len(data):
+                break
+            if payload_type == GDP_PAYLOAD_BUFFER:
+                buffers.append((bytes(data[start + GDP_HEADER.size : end]), pts, flags))
+            start = end
+        del data[:start]
+        return buffers
+
+
+class H264Output:
+    """Collects the H.264 stream of a GStreamer pipeline and hands it over one access unit at a time.
+
+    The pipeline writes the stream into a pipe (see :meth:`gst_sink_string`), read by a worker
+    thread. Backends that build a GStreamer pipeline can include the encoder in it (`in_pipeline`),
+    frames can otherwise be fed with :meth:`write` (software path).
+
+    Access units are stamped with the capture time of their frame: in a pipeline, their PTS
+    (carried through the pipe by `gdppay`) converted by a :class:`CaptureClock`, on the software
+    path, the stamp given to :meth:`write` (every frame written comes out as one access unit, in
+    the same order).
+
+    Args:
+        callback (:obj:`callable`): Called with `(data, is_keyframe, stamp)` for every access unit,
+            `stamp` in seconds since the epoch
+        bitrate (:obj:`int`): Target bitrate, in bits per second
+        keyframe_interval (:obj:`int`): Frames between two keyframes (which carry SPS and PPS)
+        encoder (:obj:`str`): One of :data:`H264_ENCODERS`, or `auto`
+        rtp (:obj:`tuple`): `(host, port)` to also stream the video to over RTP/UDP, if any
+        in_pipeline (:obj:`bool`): Whether the encoder is part of the pipeline of the camera
+
+    Raises:
+        RuntimeError: If the encoder (or `gdppay`, in a pipeline) is not available
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[bytes, bool, float], None],
+        bitrate: int = 1000000,
+        keyframe_interval: int = 30,
+        encoder: str = "auto",
+        rtp: Optional[Tuple[str, int]] = None,
+        in_pipeline: bool = False,
+    ):
+        self.encoder = pick_encoder(encoder)
+        if in_pipeline and not gst_element_exists("gdppay"):
+            raise RuntimeError("GStreamer element `gdppay` not found.")
+        self.bitrate = bitrate
+        self.keyframe_interval = keyframe_interval
+        self._callback = callback
+        self._rtp = rtp
+        self._in_pipeline = in_pipeline
+        self._splitter = AccessUnitSplitter()
+        self._depayloader = GDPDepayloader()
+        self._clock = CaptureClock()
+        # capture stamps of the frames written, until their access unit comes out
+        self._stamps: Deque[float] = deque()
+        self._read_fd, self._write_fd = os.pipe()
+        self._writer: Optional[cv2.VideoWriter] = None
+        self._writer_size = None
+        self._worker = Thread(target=self._read_loop, daemon=True)
+        self._worker.start()
+
+    def gst_sink_string(self) -> str:
+        """GStreamer elements taking the H.264 stream of an encoder to this object (and to RTP)."""
+        if self._in_pipeline:
+            # a slow reader drops data rather than stalling the camera, access units keep their PTS
+            queue = "queue leaky=downstream max-size-buffers=30 ! gdppay"
+        else:
+            # stamps are matched to access units by their order, none can be dropped
+            queue = "queue max-size-buffers=30"
+        sink = f"{queue} ! fdsink fd={self._write_fd} sync=false"
+        if self._rtp is not None:
+            host, port = self._rtp
+            sink += (
+                f" h264. ! queue leaky=downstream ! rtph264pay config-interval=1 pt=96 ! "
+                f"udpsink host={host} port={port} sync=false"
+            )
+        return (
+            "h264parse config-interval=-1 ! video/x-h264, stream-format=byte-stream, alignment=au ! "
+            f"tee name=h264 ! {sink}"
+        )
+
+    def gst_branch_string(self, nvmm: bool = False) -> str:
+        """Encoder and sink elements, to be fed with raw frames."""
+        encoder = gst_encoder_string(self.encoder, self.bitrate, self.keyframe_interval, nvmm)
+        return encoder + self.gst_sink_string()
+
+    def write(self, image: np.ndarray, fmt: str, framerate: float, stamp: float):
+        """Encodes a raw frame in a pipeline of its own (software path).
+
+        Args:
+            image (:obj:`numpy.ndarray`): The frame
+            fmt (:obj:`str`): Its format, one of ``bgr``, ``bgrx``, ``gray``
+            framerate (:obj:`float`): Nominal framerate of the stream
+            stamp (:obj:`float`): Capture time of the frame, in seconds since the epoch
+        """
+        if fmt == "bgrx":
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        elif fmt == "gray":
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        size = (image.shape[1], image.shape[0])
+        if self._writer is None or self._writer_size != size:
+            self._open_writer(size, framerate)
+        self._stamps.append(stamp)
+        self._writer.write(image)
+
+    def request_keyframe(self):
+        """Starts the stream of :meth:`write` over, from a keyframe (with SPS and PPS).
+
+        OpenCV cannot reach the encoder to force a keyframe, the pipeline is reopened on the next frame.
+        """
+        self._close_writer()
+
+    def _open_writer(self, size: Tuple[int, int], framerate: float):
+        self._close_writer()
+        pipeline = f"appsrc ! {self.gst_branch_string()}"
+        writer = cv2.VideoWriter(pipeline, cv2.CAP_GSTREAMER, 0, framerate, size, True)
+        if not writer.isOpened():
+            raise RuntimeError(f"OpenCV cannot open the GStreamer pipeline `{pipeline}`.")
+        self._writer, self._writer_size = writer, size
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def _read_loop(self):
+        while True:
+            try:
+                chunk = os.read(self._read_fd, 1 << 16)
+            except OSError:
+                return
+            if not chunk:
+                return
+            if self._in_pipeline:
+                for data, pts, flags in self._depayloader.feed(chunk):
+                    keyframe = not flags & GST_BUFFER_FLAG_DELTA_UNIT
+                    stamp = self._clock.to_time(None if pts == GDP_CLOCK_TIME_NONE else pts / 1e9)
+                    self._callback(data, keyframe, stamp)
+            else:
+                for data, keyframe in self._splitter.feed(chunk):
+                    stamp = self._stamps.popleft() if self._stamps else time.time()
+                    self._callback(data, keyframe, stamp)
+
+    def close(self):
+        self._close_writer()
+        os.close(self._write_fd)
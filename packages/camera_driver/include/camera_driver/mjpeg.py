@@ -0,0 +1,291 @@
+import mmap
+import struct
+from typing import List, Tuple, Union, Callable, Optional
+
+from .buffers import FrameBuffer
+
+# JPEG markers
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+_SOS = 0xDA
+# markers without a length field
+_STANDALONE_MARKERS = {0x01, 0xD8, 0xD9} | set(range(0xD0, 0xD8))
+
+Buffer = Union[bytes, bytearray, mmap.mmap]
+
+# index of an MJPEG file, stored next to it
+INDEX_SUFFIX = ".idx"
+_INDEX_MAGIC = b"MJPGIDX1"
+# timestamp (seconds), offset and size of a frame
+_INDEX_ENTRY = struct.Struct("<dQI")
+
+
+def jpeg_frame_end(data: Buffer, start: int) -> int:
+    """Finds the end of the JPEG image starting at `start` in a stream of concatenated images.
+
+    The marker segments are walked one by one, so that thumbnails embedded in the metadata
+    (which have SOI/EOI markers of their own) are skipped, then the entropy-coded data following
+    each start-of-scan marker is scanned for the next marker that is not a stuffed byte or a
+    restart marker.
+
+    Returns:
+        :obj:`int`: The offset right after the EOI marker
+
+    Raises:
+        ValueError: If `start` does not point to an SOI marker or the image is truncated
+    """
+    size = len(data)
+    if data[start : start + 2] != SOI:
+        raise ValueError(f"No JPEG image starts at offset {start}.")
+    pos = start + 2
+    while pos + 2 <= size:
+        if data[pos] != 0xFF:
+            raise ValueError(f"Corrupted JPEG image at offset {pos}.")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker == 0xD9:
+            return pos + 2
+        if marker in _STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if pos + 4 > size:
+            break
+        length = (data[pos + 2] << 8) | data[pos + 3]
+        pos += 2 + length
+        if marker != _SOS:
+            continue
+        # entropy-coded data, runs until the next marker (other than stuffed bytes and RSTn)
+        while True:
+            pos = data.find(b"\xff", pos)
+            if pos < 0 or pos + 1 >= size:
+                raise ValueError("Truncated JPEG image.")
+            following = data[pos + 1]
+            if following == 0x00 or 0xD0 <= following <= 0xD7 or following == 0xFF:
+                pos += 1 if following == 0xFF else 2
+                continue
+            break
+    raise ValueError("Truncated JPEG image.")
+
+
+def index_mjpeg(data: Buffer) -> List[Tuple[int, int]]:
+    """Splits a stream of concatenated JPEG images (MJPEG) into its frames.
+
+    Data that is not part of an image (e.g., multipart boundaries) is skipped, as is a truncated
+    image at the end of the stream.
+
+    Returns:
+        :obj:`list`: The (start, end) offsets of the images in the stream
+    """
+    frames = []
+    pos = 0
+    while True:
+        start = data.find(SOI, pos)
+        if start < 0:
+            break
+        try:
+            end = jpeg_frame_end(data, start)
+        except ValueError:
+            # not an image after all, or a truncated one, keep looking after its SOI marker
+            pos = start + 2
+            continue
+        frames.append((start, end))
+        pos = end
+    return frames
+
+
+class MJPEGStreamSplitter:
+    """A file-like output that splits a stream of JPEG images written in chunks into frame buffers.
+
+    Meant as output of encoders producing MJPEG (e.g., ``PiCamera.start_recording``), each image
+    is accumulated into a recycled buffer obtained from `acquire` and handed over to `commit` as
+    soon as its EOI marker is written. Buffers hold a :obj:`bytearray` that is overwritten in place,
+    once the frame size stabilizes no memory is allocated per frame.
+
+    Args:
+        acquire (:obj:`callable`): Returns a :class:`FrameBuffer` for a new frame, or `None` to skip it
+        commit (:obj:`callable`): Receives the buffer once the frame is complete
+        release (:obj:`callable`): Receives the buffer of a frame left incomplete when closing
+    """
+
+    def __init__(
+        self,
+        acquire: Callable[[], Optional[FrameBuffer]],
+        commit: Callable[[FrameBuffer], None],
+        release: Callable[[FrameBuffer], None],
+    ):
+        self._acquire = acquire
+        self._commit = commit
+        self._release = release
+        self._buf: Optional[FrameBuffer] = None
+        self._size = 0
+        # whether the current frame is being skipped
+        self._skipping = False
+        self._in_frame = False
+
+    def write(self, chunk: bytes) -> int:
+        if not self._in_frame:
+            self._in_frame = True
+            self._buf = self._acquire()
+            self._skipping = self._buf is None
+            self._size = 0
+            if not self._skipping and not isinstance(self._buf.data, bytearray):
+                self._buf.data = bytearray()
+        if not self._skipping:
+            end = self._size + len(chunk)
+            self._buf.data[self._size : end] = chunk
+            self._size = end
+        if chunk.endswith(EOI):
+            self._in_frame = False
+            if not self._skipping:
+                # drop the tail of a previous, longer frame (shrinking by a little does not reallocate)
+                del self._buf.data[self._size :]
+                buf, self._buf = self._buf, None
+                self._commit(buf)
+        return len(chunk)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buf is not None:
+            self._release(self._buf)
+            self._buf = None
+        self._in_frame = False
+
+
+class IndexedMJPEGWriter:
+    """Writes JPEG images into an MJPEG file, along with an index of their timestamps and offsets.
+
+    The MJPEG file is a plain concatenation of the images, readable without its index (e.g., by
+    :class:`camera_driver.replay.MJPEGFileSource`, ffmpeg or VLC). The index (`<path>.idx`)
+    starts with the magic `MJPGIDX1`, followed by one entry per image: timestamp (float64, in
+    seconds), offset (uint64) and size (uint32), little-endian.
+
+    Both files are written through buffers, :meth:`flush` writes the images before their index
+    entries so that the index never points past the end of the MJPEG file.
+
+    Args:
+        path (:obj:`str`): Path of the MJPEG file
+        buffering (:obj:`int`): Size of the write buffer of the MJPEG file, in bytes
+    """
+
+    def __init__(self, path: str, buffering: int = -1):
+        self.path = path
+        self.frames = 0
+        self.size = 0
+        self._file = open(path, "wb", buffering=buffering)
+        try:
+            self._index = open(path + INDEX_SUFFIX, "wb")
+        except OSError:
+            self._file.close()
+            raise
+        self._index.write(_INDEX_MAGIC)
+
+    def write(self, stamp: float, data: bytes):
+        self._file.write(data)
+        self._index.write(_INDEX_ENTRY.pack(stamp, self.size, len(data)))
+        self.size += len(data)
+        self.frames += 1
+
+    def flush(self):
+        self._file.flush()
+        self._index.flush()
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self) -> "IndexedMJPEGWriter":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_index(path: str) -> List[Tuple[float, int, int]]:
+    """Reads the index of an MJPEG file written by :class:`IndexedMJPEGWriter`.
+
+    A partially written entry at the end (e.g., of a recording in progress) is ignored.
+
+    Returns:
+        :obj:`list`: The (timestamp, offset, size) of each image
+
+    Raises:
+        ValueError: If the file is not an index
+    """
+    with open(path + INDEX_SUFFIX, "rb") as f:
+        data = f.read()
+    if not data.startswith(_INDEX_MAGIC):
+        raise ValueError(f"`{path + INDEX_SUFFIX}` is not an MJPEG index.")
+    end = len(_INDEX_MAGIC) + (len(data) - len(_INDEX_MAGIC)) // _INDEX_ENTRY.size * _INDEX_ENTRY.size
+    return list(_INDEX_ENTRY.iter_unpack(memoryview(data)[len(_INDEX_MAGIC) : end]))
+
+
+class IndexedMJPEGFile:
+    """Random access to the images of an MJPEG file written by :class:`IndexedMJPEGWriter`.
+
+    Both the file and its index are memory-mapped, finding the image at a given time is a binary
+    search on the index, nothing is read or scanned beforehand. Images appended to the file after it
+    was opened are not visible.
+
+    Args:
+        path (:obj:`str`): Path of the MJPEG file
+
+    Raises:
+        ValueError: If the index is missing its magic (or the file is empty)
+        OSError: If the files cannot be opened
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index = self._mmap(path + INDEX_SUFFIX)
+        if self._index is None or self._index[: len(_INDEX_MAGIC)] != _INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"`{path + INDEX_SUFFIX}` is not an MJPEG index.")
+        # a partially written entry at the end (e.g., of a recording in progress) is ignored
+        self._length = (len(self._index) - len(_INDEX_MAGIC)) // _INDEX_ENTRY.size
+        self._data = self._mmap(path) if self._length else None
+
+    @staticmethod
+    def _mmap(path: str) -> Optional[mmap.mmap]:
+        with open(path, "rb") as f:
+            # empty files cannot be mapped
+            if not f.seek(0, 2):
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def entry(self, i: int) -> Tuple[float, int, int]:
+        """The (timestamp, offset, size) of the `i`-th image."""
+        if not 0 <= i < self._length:
+            raise IndexError(f"Image {i} out of range (0-{self._length - 1}).")
+        return _INDEX_ENTRY.unpack_from(self._index, len(_INDEX_MAGIC) + i * _INDEX_ENTRY.size)
+
+    def stamp(self, i: int) -> float:
+        return self.entry(i)[0]
+
+    def find(self, stamp: float) -> int:
+        """Index of the last image taken at or before `stamp`, -1 if all of them were taken after it."""
+        lo, hi = 0, self._length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.stamp(mid) <= stamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def read(self, i: int) -> bytes:
+        _, offset, size = self.entry(i)
+        return self._data[offset : offset + size]
+
+    def close(self):
+        for mapping in [getattr(self, "_data", None), self._index]:
+            if mapping is not None:
+                mapping.close()
+        self._data = self._index = None
@@ -0,0 +1,181 @@
+import os
+import re
+import time
+from bisect import bisect_right
+from typing import Iterator, List, Optional, Tuple
+
+from .mjpeg import IndexedMJPEGWriter, IndexedMJPEGFile
+
+SEGMENT_NAME = "segment_{:05d}.mjpeg"
+_SEGMENT_RE = re.compile(r"^segment_(\d{5})\.mjpeg$")
+
+
+def _segments(directory: str) -> List[Tuple[int, str]]:
+    """The (number, path) of the segments of a recording, in order."""
+    segments = []
+    for name in os.listdir(directory):
+        match = _SEGMENT_RE.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+class MJPEGRecorder:
+    """Records JPEG frames, as they are, into a directory of indexed MJPEG segments.
+
+    Each segment is an MJPEG file written by :class:`camera_driver.mjpeg.IndexedMJPEGWriter`
+    (i.e., playable on its own) with its index. A new segment is started once the current one
+    reaches `segment_size` bytes or `segment_duration` seconds, so that a recording that is cut
+    short (e.g., power loss) only loses the data still in the write buffers. Recording into a
+    directory that holds segments already continues after the last one.
+
+    Args:
+        directory (:obj:`str`): Directory of the recording, created if needed
+        segment_size (:obj:`int`): Maximum size of a segment, in bytes
+        segment_duration (:obj:`float`): Maximum duration of a segment, in seconds
+        flush_period (:obj:`float`): Maximum time the frames stay in the write buffers, in seconds
+        buffering (:obj:`int`): Size of the write buffer, in bytes
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = 256 * 1024 * 1024,
+        segment_duration: float = 300.0,
+        flush_period: float = 1.0,
+        buffering: int = 1024 * 1024,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._segment_size = segment_size
+        self._segment_duration = segment_duration
+        self._flush_period = flush_period
+        self._buffering = buffering
+        segments = _segments(directory)
+        self._next_segment = segments[-1][0] + 1 if segments else 0
+        self._writer: Optional[IndexedMJPEGWriter] = None
+        self._segment_start = 0.0
+        self._last_flush = 0.0
+        self.frames = 0
+
+    def write(self, stamp: float, data: bytes):
+        """Appends a frame, timestamps are expected to increase.
+
+        Raises:
+            OSError: If the frame cannot be written
+        """
+        writer = self._writer
+        if (
+            writer is None
+            or (writer.frames and writer.size + len(data) > self._segment_size)
+            or stamp - self._segment_start >= self._segment_duration
+        ):
+            writer = self._new_segment(stamp)
+        writer.write(stamp, data)
+        self.frames += 1
+        now = time.monotonic()
+        if now - self._last_flush >= self._flush_period:
+            writer.flush()
+            self._last_flush = now
+
+    def _new_segment(self, stamp: float) -> IndexedMJPEGWriter:
+        self.close()
+        path = os.path.join(self.directory, SEGMENT_NAME.format(self._next_segment))
+        self._writer = IndexedMJPEGWriter(path, buffering=self._buffering)
+        self._next_segment += 1
+        self._segment_start = stamp
+        return self._writer
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class MJPEGRecording:
+    """Random access to the frames of a recording made by :class:`MJPEGRecorder`.
+
+    Finding the frame at a given time is a binary search on the first timestamps of the segments,
+    then on the index of one segment, i.e., O(log n) without reading the recording beforehand.
+    Frames are returned as they were recorded (JPEG).
+
+    Args:
+        directory (:obj:`str`): Directory of the recording
+
+    Raises:
+        ValueError: If the directory holds no (indexed) frames
+    """
+
+    def __init__(self, directory: str):
+        self._segments: List[IndexedMJPEGFile] = []
+        for _, path in _segments(directory):
+            try:
+                segment = IndexedMJPEGFile(path)
+            except (ValueError, OSError):
+                # e.g., a segment whose index was never written
+                continue
+            if len(segment):
+                self._segments.append(segment)
+            else:
+                segment.close()
+        if not self._segments:
+            raise ValueError(f"No recorded frames found in `{directory}`.")
+        self._starts = [segment.stamp(0) for segment in self._segments]
+        self._offsets = [0]
+        for segment in self._segments:
+            self._offsets.append(self._offsets[-1] + len(segment))
+
+    def __len__(self) -> int:
+        return self._offsets[-1]
+
+    @property
+    def start(self) -> float:
+        """Timestamp of the first frame."""
+        return self._starts[0]
+
+    @property
+    def end(self) -> float:
+        """Timestamp of the last frame."""
+        last = self._segments[-1]
+        return last.stamp(len(last) - 1)
+
+    def _locate(self, i: int) -> Tuple[IndexedMJPEGFile, int]:
+        if not 0 <= i < len(self):
+            raise IndexError(f"Frame {i} out of range (0-{len(self) - 1}).")
+        s = bisect_right(self._offsets, i) - 1
+        return self._segments[s], i - self._offsets[s]
+
+    def find(self, stamp: float) -> int:
+        """Index of the last frame taken at or before `stamp` (the first one if none was)."""
+        s = max(0, bisect_right(self._starts, stamp) - 1)
+        return self._offsets[s] + max(0, self._segments[s].find(stamp))
+
+    def read(self, i: int) -> Tuple[float, bytes]:
+        """The `i`-th frame, as (timestamp, data)."""
+        segment, j = self._locate(i)
+        return segment.stamp(j), segment.read(j)
+
+    def frame_at(self, stamp: float) -> Tuple[float, bytes]:
+        """The frame shown at time `stamp`, i.e., the last one taken at or before it."""
+        return self.read(self.find(stamp))
+
+    def frames(
+        self, start: float = float("-inf"), end: float = float("inf")
+    ) -> Iterator[Tuple[float, bytes]]:
+        """Iterates over the frames taken between `start` and `end` (included)."""
+        i = self.find(start)
+        # `find` returns the frame shown at `start`, which might have been taken before it
+        if i < len(self):
+            segment, j = self._locate(i)
+            i += segment.stamp(j) < start
+        while i < len(self):
+            stamp, data = self.read(i)
+            if stamp > end:
+                return
+            yield stamp, data
+            i += 1
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
@@ -0,0 +1,91 @@
+import os
+import hashlib
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from sensor_msgs.msg import CameraInfo
+
+
+class Rectifier:
+    """Undistorts and rectifies images through precomputed lookup tables.
+
+    The maps produced by ``cv2.initUndistortRectifyMap`` only depend on the calibration and
+    on the resolution, they are computed once per pair and cached on disk under a name derived
+    from a hash of the calibration file, so that restarts load them instead of recomputing them.
+
+    Args:
+        calibration_file (:obj:`str`): Path to the intrinsic calibration YAML file
+        cache_dir (:obj:`str`): Directory the maps are cached in, `None` to disable the cache
+        interpolation (:obj:`int`): OpenCV interpolation used by the remap
+    """
+
+    def __init__(
+        self, calibration_file: str, cache_dir: Optional[str], interpolation: int = cv2.INTER_LINEAR
+    ):
+        with open(calibration_file, "rb") as f:
+            self._calibration_hash = hashlib.sha1(f.read()).hexdigest()[:16]
+        self._cache_dir = cache_dir
+        self._interpolation = interpolation
+        self._resolution: Optional[Tuple[int, int]] = None
+        self._map1: Optional[np.ndarray] = None
+        self._map2: Optional[np.ndarray] = None
+
+    @property
+    def resolution(self) -> Optional[Tuple[int, int]]:
+        """Resolution (width, height) the current maps were computed for."""
+        return self._resolution
+
+    def cache_file(self, camera_info: CameraInfo) -> Optional[str]:
+        if not self._cache_dir:
+            return None
+        name = f"rectify_{self._calibration_hash}_{camera_info.width}x{camera_info.height}"
+        roi = camera_info.roi
+        if roi.width and roi.height:
+            # frames cropped out of the full frame
+            name += f"_roi{roi.x_offset}-{roi.y_offset}-{roi.width}x{roi.height}"
+        return os.path.join(self._cache_dir, f"{name}.npz")
+
+    def prepare(self, camera_info: CameraInfo) -> bool:
+        """Loads (or computes and caches) the maps for the given camera parameters.
+
+        Args:
+            camera_info (:obj:`CameraInfo`): Calibration, already adjusted to the resolution in use
+
+        Returns:
+            :obj:`bool`: `True` if the maps were loaded from the cache
+        """
+        width, height = camera_info.width, camera_info.height
+        cache_file = self.cache_file(camera_info)
+        if cache_file is not None and os.path.isfile(cache_file):
+            try:
+                with np.load(cache_file) as maps:
+                    self._map1, self._map2 = maps["map1"], maps["map2"]
+                self._resolution = (width, height)
+                return True
+            except (OSError, KeyError, ValueError):
+                # corrupted cache, recompute
+                pass
+        K = np.array(camera_info.K, dtype=np.float64).reshape((3, 3))
+        D = np.array(camera_info.D, dtype=np.float64)
+        R = np.array(camera_info.R, dtype=np.float64).reshape((3, 3))
+        P = np.array(camera_info.P, dtype=np.float64).reshape((3, 4))
+        # fixed-point maps make the remap considerably faster than floating-point ones
+        self._map1, self._map2 = cv2.initUndistortRectifyMap(K, D, R, P, (width, height), cv2.CV_16SC2)
+        self._resolution = (width, height)
+        if cache_file is not None:
+            self._save(cache_file)
+        return False
+
+    def _save(self, cache_file: str):
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # write to a temporary file first, a crash must not leave a truncated cache behind
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(f, map1=self._map1, map2=self._map2)
+        os.replace(tmp_file, cache_file)
+
+    def rectify(self, image: np.ndarray) -> np.ndarray:
+        if self._map1 is None:
+            raise RuntimeError("The rectification maps were not prepared.")
+        return cv2.remap(image, self._map1, self._map2, self._interpolation)
@@ -0,0 +1,251 @@
+import os
+import mmap
+from abc import ABC, abstractmethod
+from typing import Optional, Union, List, Tuple
+
+import cv2
+import numpy as np
+
+from .mjpeg import index_mjpeg
+
+Frame = Union[np.ndarray, bytes]
+
+
+class AbsFrameSource(ABC):
+    """A source of recorded or synthetic frames.
+
+    Attributes:
+        format (:obj:`str`): Format of the frames returned by :meth:`read`, ``jpeg`` or ``bgr``
+    """
+
+    format: str = "bgr"
+
+    @abstractmethod
+    def open(self):
+        """Prepares the source, raises :obj:`RuntimeError` if that is not possible."""
+
+    @abstractmethod
+    def read(self, out: Optional[np.ndarray] = None) -> Optional[Frame]:
+        """Returns the next frame, or `None` at the end of the source.
+
+        Raw frames are written into `out` when it is given and has the right shape.
+        """
+
+    def skip(self) -> bool:
+        """Moves past the next frame without returning it, returns `False` at the end of the source."""
+        return self.read() is not None
+
+    @abstractmethod
+    def rewind(self):
+        """Restarts the source from its first frame."""
+
+    def close(self):
+        pass
+
+
+class MJPEGFileSource(AbsFrameSource):
+    """Replays a file of concatenated JPEG images (MJPEG), frames are returned as they are.
+
+    The file is memory-mapped and indexed once, reading a frame costs a single copy.
+    """
+
+    format = "jpeg"
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._frames: List[Tuple[int, int]] = []
+        self._next = 0
+
+    def open(self):
+        try:
+            self._file = open(self._path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            self.close()
+            raise RuntimeError(f"Cannot open MJPEG file `{self._path}`: {str(e)}")
+        self._frames = index_mjpeg(self._mmap)
+        if not self._frames:
+            self.close()
+            raise RuntimeError(f"No JPEG images found in `{self._path}`.")
+
+    def read(self, out: Optional[np.ndarray] = None) -> Optional[bytes]:
+        if self._next >= len(self._frames):
+            return None
+        start, end = self._frames[self._next]
+        self._next += 1
+        return self._mmap[start:end]
+
+    def skip(self) -> bool:
+        self._next += 1
+        return self._next <= len(self._frames)
+
+    def rewind(self):
+        self._next = 0
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class JPEGDirectorySource(AbsFrameSource):
+    """Replays the JPEG images in a directory, in alphabetical order."""
+
+    format = "jpeg"
+    EXTENSIONS = (".jpg", ".jpeg")
+
+    def __init__(self, path: str):
+        self._path = path
+        self._files: List[str] = []
+        self._next = 0
+
+    def open(self):
+        try:
+            names = sorted(os.listdir(self._path))
+        except OSError as e:
+            raise RuntimeError(f"Cannot list directory `{self._path}`: {str(e)}")
+        self._files = [os.path.join(self._path, n) for n in names if n.lower().endswith(self.EXTENSIONS)]
+        if not self._files:
+            raise RuntimeError(f"No JPEG images found in `{self._path}`.")
+
+    def read(self, out: Optional[np.ndarray] = None) -> Optional[bytes]:
+        if self._next >= len(self._files):
+            return None
+        with open(self._files[self._next], "rb") as f:
+            self._next += 1
+            return f.read()
+
+    def skip(self) -> bool:
+        self._next += 1
+        return self._next <= len(self._files)
+
+    def rewind(self):
+        self._next = 0
+
+
+class VideoFileSource(AbsFrameSource):
+    """Replays a video file (e.g., MP4) decoded by OpenCV into BGR frames."""
+
+    format = "bgr"
+
+    def __init__(self, path: str):
+        self._path = path
+        self._capture: Optional[cv2.VideoCapture] = None
+
+    def open(self):
+        self._capture = cv2.VideoCapture(self._path)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"OpenCV cannot open video file `{self._path}`.")
+
+    def read(self, out: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        retval, image = self._capture.read(out)
+        return image if retval else None
+
+    def skip(self) -> bool:
+        return self._capture.grab()
+
+    def rewind(self):
+        self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+class PatternSource(AbsFrameSource):
+    """Generates synthetic BGR frames.
+
+    The frames are precomputed, producing one costs a single copy, so that the throughput of
+    the code downstream of the camera can be measured.
+
+    Args:
+        width (:obj:`int`): Width of the frames
+        height (:obj:`int`): Height of the frames
+        pattern (:obj:`str`): One of :attr:`PATTERNS`, `bars` are color bars scrolling horizontally
+            (easy to compress), `noise` is random noise (worst case for JPEG encoders)
+    """
+
+    format = "bgr"
+    PATTERNS = ["bars", "noise"]
+    # color bars, in BGR
+    COLORS = [
+        (255, 255, 255),
+        (0, 255, 255),
+        (255, 255, 0),
+        (0, 255, 0),
+        (255, 0, 255),
+        (0, 0, 255),
+        (255, 0, 0),
+        (0, 0, 0),
+    ]
+    NOISE_FRAMES = 8
+
+    def __init__(self, width: int, height: int, pattern: str = "bars"):
+        if pattern not in self.PATTERNS:
+            raise ValueError(f"Pattern `{pattern}` not supported. Possible choices are `{self.PATTERNS}`.")
+        self._width = width
+        self._height = height
+        self._pattern = pattern
+        self._frames: Optional[np.ndarray] = None
+        self._index = 0
+
+    def open(self):
+        if self._pattern == "bars":
+            # two periods side by side, each frame is a window sliding over them
+            bar = max(1, self._width // len(self.COLORS))
+            row = np.repeat(np.array(self.COLORS, dtype=np.uint8), bar, axis=0)
+            row = np.resize(row, (self._width, 3))
+            rows = np.concatenate([row, row])[None]
+            self._frames = np.ascontiguousarray(np.tile(rows, (self._height, 1, 1)))
+        else:
+            rng = np.random.default_rng(0)
+            self._frames = rng.integers(
+                0, 256, (self.NOISE_FRAMES, self._height, self._width, 3), dtype=np.uint8
+            )
+
+    def _frame(self) -> np.ndarray:
+        if self._pattern == "bars":
+            # scroll by 4 pixels per frame
+            offset = (self._index * 4) % self._width
+            return self._frames[:, offset : offset + self._width]
+        return self._frames[self._index % self.NOISE_FRAMES]
+
+    def read(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        frame = self._frame()
+        self._index += 1
+        if out is None or out.shape != frame.shape:
+            out = np.empty_like(frame)
+        np.copyto(out, frame)
+        return out
+
+    def skip(self) -> bool:
+        self._index += 1
+        return True
+
+    def rewind(self):
+        self._index = 0
+
+
+def get_source(path: str, width: int, height: int, pattern: str = "bars") -> AbsFrameSource:
+    """Picks the frame source for the given path.
+
+    Args:
+        path (:obj:`str`): An MJPEG file (`.mjpeg`, `.mjpg`), a directory of JPEG images, any
+            other video file supported by OpenCV, or an empty string for a synthetic pattern
+        width (:obj:`int`): Width of the synthetic frames
+        height (:obj:`int`): Height of the synthetic frames
+        pattern (:obj:`str`): Synthetic pattern, see :class:`PatternSource`
+    """
+    if not path:
+        return PatternSource(width, height, pattern)
+    if os.path.isdir(path):
+        return JPEGDirectorySource(path)
+    if path.lower().endswith((".mjpeg", ".mjpg")):
+        return MJPEGFileSource(path)
+    return VideoFileSource(path)
@@ -0,0 +1,137 @@
+import dataclasses
+from typing import List, Tuple, Optional
+
+import cv2
+import numpy as np
+from sensor_msgs.msg import CameraInfo
+
+
+@dataclasses.dataclass
+class CameraROI:
+    """A region of interest within the `res_w`x`res_h` camera frame, optionally binned.
+
+    Coordinates are in pixels of the full frame. They are aligned so that the region stays
+    within the frame and the output (binned) frame has even dimensions.
+
+    Attributes:
+        x (:obj:`int`): Horizontal offset of the region
+        y (:obj:`int`): Vertical offset of the region
+        w (:obj:`int`): Width of the region
+        h (:obj:`int`): Height of the region
+        binning (:obj:`int`): Downscaling factor applied to the region, one of :attr:`BINNINGS`
+        frame_w (:obj:`int`): Width of the full frame
+        frame_h (:obj:`int`): Height of the full frame
+    """
+
+    x: int
+    y: int
+    w: int
+    h: int
+    binning: int
+    frame_w: int
+    frame_h: int
+
+    # powers of two, so that JPEG frames can be binned while being decoded
+    BINNINGS = [1, 2, 4, 8]
+
+    @staticmethod
+    def from_params(roi: List[float], binning: int, frame_w: int, frame_h: int) -> "CameraROI":
+        """Builds the region from normalized coordinates.
+
+        Args:
+            roi (:obj:`list`): The region as `[x, y, w, h]`, in fractions of the full frame
+            binning (:obj:`int`): Downscaling factor, one of :attr:`BINNINGS`
+            frame_w (:obj:`int`): Width of the full frame
+            frame_h (:obj:`int`): Height of the full frame
+
+        Raises:
+            ValueError: If the region is empty or outside of the frame, or the binning is not supported
+        """
+        if binning not in CameraROI.BINNINGS:
+            raise ValueError(
+                f"Binning `{binning}` not supported. Possible choices are `{CameraROI.BINNINGS}`."
+            )
+        if len(roi) != 4:
+            raise ValueError(f"The ROI must be given as [x, y, w, h], got `{roi}`.")
+        nx, ny, nw, nh = map(float, roi)
+        if nx < 0 or ny < 0 or nw <= 0 or nh <= 0 or nx + nw > 1 or ny + nh > 1:
+            raise ValueError(f"The ROI `{roi}` is not within the frame (normalized coordinates).")
+        align = 2 * binning
+
+        def span(offset: float, size: float, full: int) -> Tuple[int, int]:
+            start = int(round(offset * full)) // align * align
+            length = max(align, int(round(size * full)) // align * align)
+            return start, min(length, (full - start) // align * align)
+
+        x, w = span(nx, nw, frame_w)
+        y, h = span(ny, nh, frame_h)
+        return CameraROI(x, y, w, h, binning, frame_w, frame_h)
+
+    @staticmethod
+    def full(frame_w: int, frame_h: int) -> "CameraROI":
+        """The whole frame, unbinned."""
+        return CameraROI(0, 0, frame_w, frame_h, 1, frame_w, frame_h)
+
+    @property
+    def is_full(self) -> bool:
+        """Whether the region covers the full frame, unbinned (i.e., there is nothing to do)."""
+        return self.binning == 1 and (self.x, self.y, self.w, self.h) == (0, 0, self.frame_w, self.frame_h)
+
+    @property
+    def output_size(self) -> Tuple[int, int]:
+        """Size (width, height) of the frames once cropped and binned."""
+        return self.w // self.binning, self.h // self.binning
+
+    @property
+    def normalized(self) -> Tuple[float, float, float, float]:
+        """The region as `(x, y, w, h)`, in fractions of the full frame."""
+        return self.x / self.frame_w, self.y / self.frame_h, self.w / self.frame_w, self.h / self.frame_h
+
+    def apply(
+        self, image: np.ndarray, out: Optional[np.ndarray] = None, prebinned: bool = False
+    ) -> np.ndarray:
+        """Crops and bins a frame in software.
+
+        Args:
+            image (:obj:`numpy.ndarray`): The full frame
+            out (:obj:`numpy.ndarray`): Array the result is written into, if it has the right shape
+            prebinned (:obj:`bool`): Whether the frame was already binned (e.g., while decoding it)
+        """
+        b = self.binning
+        if prebinned:
+            view = image[self.y // b : (self.y + self.h) // b, self.x // b : (self.x + self.w) // b]
+        else:
+            view = image[self.y : self.y + self.h, self.x : self.x + self.w]
+        out_w, out_h = self.output_size
+        shape = (out_h, out_w) + view.shape[2:]
+        if out is None or out.shape != shape:
+            out = np.empty(shape, dtype=view.dtype)
+        if b == 1 or prebinned:
+            np.copyto(out, view)
+        else:
+            cv2.resize(view, (out_w, out_h), dst=out, interpolation=cv2.INTER_AREA)
+        return out
+
+    def adjust_camera_info(self, camera_info: CameraInfo):
+        """Adapts a calibration for the full frame to the cropped and binned frames.
+
+        The camera and projection matrices are modified to describe the published frames and the
+        `roi` field is set to the region (in pixels of the full frame).
+        """
+        b = float(self.binning)
+        K = np.array(camera_info.K, dtype=np.float64)
+        K[[0, 4]] /= b
+        K[2] = (K[2] - self.x) / b
+        K[5] = (K[5] - self.y) / b
+        camera_info.K = K
+        P = np.array(camera_info.P, dtype=np.float64)
+        P[[0, 3, 5, 7]] /= b
+        P[2] = (P[2] - self.x) / b
+        P[6] = (P[6] - self.y) / b
+        camera_info.P = P
+        camera_info.width, camera_info.height = self.output_size
+        camera_info.roi.x_offset = self.x
+        camera_info.roi.y_offset = self.y
+        camera_info.roi.width = self.w
+        camera_info.roi.height = self.h
+        camera_info.roi.do_rectify = False
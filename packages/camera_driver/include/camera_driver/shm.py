@@ -0,0 +1,221 @@
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+from typing import Optional
+
+import numpy as np
+
+# segment header: magic, version, number of slots, size of a slot (payload only), latest sequence number
+_HEADER = struct.Struct("<8sIIQQ")
+_HEADER_SIZE = 64
+_MAGIC = b"DTCAMSHM"
+_VERSION = 1
+# slot header: sequence number, stamp, payload size, height, width, channels, pixel format
+_SLOT_HEADER = struct.Struct("<QdIIII8s")
+_SLOT_HEADER_SIZE = 64
+_LATEST_SEQ_OFFSET = 24
+
+
+class RawFrame:
+    """A raw frame read from shared memory.
+
+    Attributes:
+        seq (:obj:`int`): Sequence number of the frame, starting from 1
+        stamp (:obj:`float`): Capture time (seconds since the epoch)
+        format (:obj:`str`): Pixel format, `bgr` or `bgrx` (Jetson Nano, as converted by its pipeline)
+        data (:obj:`numpy.ndarray`): The frame, a view on the shared memory unless copied
+    """
+
+    __slots__ = ("seq", "stamp", "format", "data")
+
+    def __init__(self, seq: int, stamp: float, fmt: str, data: np.ndarray):
+        self.seq = seq
+        self.stamp = stamp
+        self.format = fmt
+        self.data = data
+
+
+class SharedMemoryFrameWriter:
+    """Writes raw frames into a ring of slots in a POSIX shared memory segment.
+
+    Each slot is protected by its sequence number, which is zeroed while the slot is being
+    written and set once the frame is complete, readers use it to detect torn or overwritten
+    frames. The segment is (re)created to fit the frames it receives.
+
+    Args:
+        name (:obj:`str`): Name of the shared memory segment (appears under `/dev/shm/`)
+        slots (:obj:`int`): Number of frames kept in the ring
+    """
+
+    def __init__(self, name: str, slots: int = 4):
+        self._name = name
+        self._slots = max(2, slots)
+        self._slot_size = 0
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._seq = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def slots(self) -> int:
+        return self._slots
+
+    @property
+    def slot_size(self) -> int:
+        return self._slot_size
+
+    def _allocate(self, slot_size: int):
+        self.close(unlink=True)
+        # remove leftovers of a previous run
+        try:
+            stale = shared_memory.SharedMemory(name=self._name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        size = _HEADER_SIZE + self._slots * (_SLOT_HEADER_SIZE + slot_size)
+        self._shm = shared_memory.SharedMemory(name=self._name, create=True, size=size)
+        self._slot_size = slot_size
+        _HEADER.pack_into(self._shm.buf, 0, _MAGIC, _VERSION, self._slots, slot_size, 0)
+
+    def write(self, frame: np.ndarray, stamp: float, fmt: str) -> bool:
+        """Copies a frame into the next slot of the ring.
+
+        Returns:
+            :obj:`bool`: `True` if the segment had to be (re)allocated to fit the frame
+        """
+        frame = np.ascontiguousarray(frame)
+        allocated = False
+        if self._shm is None or frame.nbytes > self._slot_size:
+            self._allocate(frame.nbytes)
+            allocated = True
+        self._seq += 1
+        offset = _HEADER_SIZE + ((self._seq - 1) % self._slots) * (_SLOT_HEADER_SIZE + self._slot_size)
+        buf = self._shm.buf
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        # invalidate the slot, write the payload, then publish the slot
+        struct.pack_into("<Q", buf, offset, 0)
+        payload = np.ndarray((frame.nbytes,), dtype=np.uint8, buffer=buf, offset=offset + _SLOT_HEADER_SIZE)
+        payload[:] = frame.reshape(-1).view(np.uint8)
+        _SLOT_HEADER.pack_into(
+            buf, offset, self._seq, stamp, frame.nbytes, height, width, channels, fmt.encode("ascii")
+        )
+        struct.pack_into("<Q", buf, _LATEST_SEQ_OFFSET, self._seq)
+        return allocated
+
+    def close(self, unlink: bool = True):
+        if self._shm is None:
+            return
+        # tell readers still attached to this segment that it is gone
+        struct.pack_into("<8s", self._shm.buf, 0, b"")
+        self._shm.close()
+        if unlink:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._shm = None
+
+
+class SharedMemoryFrameReader:
+    """Reads the raw frames written by :class:`SharedMemoryFrameWriter` from another process.
+
+    Frames are returned as views on the shared memory (no copy). A view stays valid until the
+    writer wraps around the ring and reuses its slot, use :meth:`is_valid` after processing a
+    frame to make sure it was not overwritten in the meantime, or ask for a copy.
+    Views must be released before the reader is closed.
+
+    Example::
+
+        reader = SharedMemoryFrameReader("camera_node_frames")
+        frame = reader.wait_for_frame(after=0)
+        result = process(frame.data)
+        if reader.is_valid(frame):
+            use(result)
+
+    Args:
+        name (:obj:`str`): Name of the shared memory segment
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._slots = 0
+        self._slot_size = 0
+        self._open()
+
+    def _open(self):
+        self.close()
+        self._shm = shared_memory.SharedMemory(name=self._name)
+        # the segment belongs to the writer, make sure we do not unlink it when this process exits
+        # noinspection PyProtectedMember
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+        magic, version, self._slots, self._slot_size, _ = _HEADER.unpack_from(self._shm.buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError(f"Shared memory segment `{self._name}` does not contain camera frames.")
+
+    @property
+    def latest_seq(self) -> int:
+        # the writer reallocates the segment when the frame size changes
+        if self._shm is None or struct.unpack_from("<8s", self._shm.buf, 0)[0] != _MAGIC:
+            try:
+                self._open()
+            except (FileNotFoundError, ValueError):
+                return 0
+        return struct.unpack_from("<Q", self._shm.buf, _LATEST_SEQ_OFFSET)[0]
+
+    def _slot_offset(self, seq: int) -> int:
+        return _HEADER_SIZE + ((seq - 1) % self._slots) * (_SLOT_HEADER_SIZE + self._slot_size)
+
+    def read(self, copy: bool = False) -> Optional[RawFrame]:
+        """Returns the latest complete frame, or `None` if no frames were written yet."""
+        for _ in range(3):
+            seq = self.latest_seq
+            if seq == 0:
+                return None
+            offset = self._slot_offset(seq)
+            slot_seq, stamp, size, height, width, channels, fmt = _SLOT_HEADER.unpack_from(
+                self._shm.buf, offset
+            )
+            if slot_seq != seq:
+                # the writer lapped us, try again with the new latest frame
+                continue
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            data = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf, offset=offset + _SLOT_HEADER_SIZE)
+            frame = RawFrame(seq, stamp, fmt.rstrip(b"\0").decode("ascii"), data.copy() if copy else data)
+            if copy and not self.is_valid(frame):
+                continue
+            return frame
+        return None
+
+    def wait_for_frame(self, after: int, timeout: float = 1.0, copy: bool = False) -> Optional[RawFrame]:
+        """Waits for a frame with a sequence number greater than `after` and returns it."""
+        deadline = time.monotonic() + timeout
+        while self.latest_seq <= after:
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.001)
+        return self.read(copy=copy)
+
+    def is_valid(self, frame: RawFrame) -> bool:
+        """Tells whether the slot holding the given frame was not overwritten yet."""
+        return struct.unpack_from("<Q", self._shm.buf, self._slot_offset(frame.seq))[0] == frame.seq
+
+    def close(self):
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # frames are still being used, the mapping goes away with the last of them
+                pass
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
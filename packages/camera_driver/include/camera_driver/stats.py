@@ -0,0 +1,120 @@
+import time
+from threading import Lock
+from typing import Dict, Iterable
+
+import numpy as np
+
+
+class RollingHistogram:
+    """Keeps the last `size` samples of a measurement and computes percentiles on demand.
+
+    Samples are written into a preallocated ring, adding a sample never allocates memory.
+
+    Args:
+        size (:obj:`int`): Number of samples to keep
+    """
+
+    def __init__(self, size: int = 512):
+        self._samples = np.zeros(size, dtype=np.float64)
+        self._count = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def add(self, value: float):
+        self._samples[self._count % self._samples.size] = value
+        self._count += 1
+
+    def values(self) -> np.ndarray:
+        return self._samples[: min(self._count, self._samples.size)].copy()
+
+    def percentiles(self, q: Iterable[float] = (50, 95, 99)) -> Dict[str, float]:
+        q = list(q)
+        values = self.values()
+        if values.size == 0:
+            return {f"p{p:g}": 0.0 for p in q}
+        return {f"p{p:g}": float(v) for p, v in zip(q, np.percentile(values, q))}
+
+
+class RateMeter:
+    """Measures the frequency of an event over its last `size` occurrences.
+
+    Args:
+        size (:obj:`int`): Number of occurrences to keep
+        timeout (:obj:`float`): Seconds of silence after which the rate is reported as zero
+    """
+
+    def __init__(self, size: int = 64, timeout: float = 2.0):
+        self._stamps = np.zeros(size, dtype=np.float64)
+        self._count = 0
+        self._timeout = timeout
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def tick(self, stamp: float = None):
+        self._stamps[self._count % self._stamps.size] = time.monotonic() if stamp is None else stamp
+        self._count += 1
+
+    def rate(self) -> float:
+        n = min(self._count, self._stamps.size)
+        if n < 2:
+            return 0.0
+        last = self._stamps[(self._count - 1) % self._stamps.size]
+        first = self._stamps[(self._count - n) % self._stamps.size]
+        if time.monotonic() - last > self._timeout or last <= first:
+            return 0.0
+        return float((n - 1) / (last - first))
+
+
+class PipelineStats:
+    """Per-stage latency histograms and frame counters of the camera pipeline.
+
+    Stage durations are recorded in seconds and reported in milliseconds.
+    Counters are plain integers, the frames entering (committed by the capture thread)
+    and leaving (published) the pipeline are also tracked as rates.
+    """
+
+    def __init__(self, size: int = 512):
+        self._size = size
+        self._stages: Dict[str, RollingHistogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._rates: Dict[str, RateMeter] = {"frames_in": RateMeter(), "frames_out": RateMeter()}
+        self._values: Dict[str, float] = {}
+        self._lock = Lock()
+
+    def record(self, stage: str, seconds: float):
+        hist = self._stages.get(stage)
+        if hist is None:
+            with self._lock:
+                hist = self._stages.setdefault(stage, RollingHistogram(self._size))
+        hist.add(seconds)
+
+    def count(self, counter: str, n: int = 1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+        if counter in self._rates:
+            self._rates[counter].tick()
+
+    def set(self, name: str, value: float):
+        """Stores an instantaneous value (e.g., a gauge) to report along with the counters."""
+        self._values[name] = value
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            stages = dict(self._stages)
+            counters = dict(self._counters)
+        return {
+            "stages": {
+                name: {
+                    "count": hist.count,
+                    **{f"{k}_ms": v * 1000.0 for k, v in hist.percentiles().items()},
+                }
+                for name, hist in stages.items()
+            },
+            "counters": counters,
+            "rates": {f"{name}_fps": meter.rate() for name, meter in self._rates.items()},
+            "values": dict(self._values),
+        }
@@ -0,0 +1,177 @@
+import time
+import socket
+from threading import Condition, Lock, Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+
+class LatestFrame:
+    """The most recent JPEG frame, shared by any number of readers.
+
+    Readers never get a backlog: a reader slower than the camera skips to the latest frame.
+    """
+
+    def __init__(self):
+        self._lock = Condition()
+        self._data: Optional[bytes] = None
+        self._seq = 0
+        self._closed = False
+
+    def put(self, data: bytes):
+        """Replaces the frame, `data` must not be modified afterwards."""
+        with self._lock:
+            self._data = data
+            self._seq += 1
+            self._lock.notify_all()
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the latest frame, 0 before the first one."""
+        return self._seq
+
+    def get(self, after: int = 0, timeout: float = None) -> Optional[Tuple[int, bytes]]:
+        """Returns the latest frame as `(seq, data)`, waiting for one newer than `after`.
+
+        Returns `None` on timeout, or once closed.
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: self._closed or self._seq > after, timeout)
+            if self._closed or self._seq <= after:
+                return None
+            return self._seq, self._data
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+
+
+class MJPEGStreamServer(ThreadingHTTPServer):
+    """Serves the frames of a :class:`LatestFrame` over HTTP, as they are (no re-encoding).
+
+    Endpoints:
+        `/stream.mjpg` (also `/`): `multipart/x-mixed-replace` stream, viewable by any browser.
+        The optional `fps` query argument lowers the framerate of the stream below `max_framerate`.
+
+        `/snapshot.jpg`: The next frame. Pending snapshots count as viewers, so that the camera
+        captures a fresh frame for them even when nobody else is watching.
+
+    Args:
+        port (:obj:`int`): TCP port to listen on
+        frame (:obj:`LatestFrame`): Source of the frames
+        max_framerate (:obj:`float`): Maximum framerate of each stream
+    """
+
+    daemon_threads = True
+    BOUNDARY = "jpegframe"
+
+    def __init__(self, port: int, frame: LatestFrame, max_framerate: float = 15.0):
+        super(MJPEGStreamServer, self).__init__(("", port), _MJPEGRequestHandler)
+        self.frame = frame
+        self.max_framerate = max_framerate
+        self._viewers = 0
+        self._snapshots = 0
+        self._viewers_lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    @property
+    def viewers(self) -> int:
+        """Number of streams being served."""
+        return self._viewers
+
+    @property
+    def pending_snapshots(self) -> int:
+        """Number of snapshot requests waiting for a frame."""
+        return self._snapshots
+
+    def add_viewer(self, n: int):
+        with self._viewers_lock:
+            self._viewers += n
+
+    def add_snapshot(self, n: int):
+        with self._viewers_lock:
+            self._snapshots += n
+
+    def start(self):
+        """Serves requests from a background thread."""
+        self._thread = Thread(target=self.serve_forever, kwargs={"poll_interval": 0.5}, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.frame.close()
+        self.shutdown()
+        self.server_close()
+
+
+class _MJPEGRequestHandler(BaseHTTPRequestHandler):
+    server: MJPEGStreamServer
+    # viewers that stop reading are dropped rather than blocking their thread forever
+    timeout = 10
+    # frames are written in two parts (header and data), they should not wait for each other's ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path in ["/", "/stream.mjpg"]:
+            try:
+                fps = float(parse_qs(url.query).get("fps", [self.server.max_framerate])[0])
+            except ValueError:
+                self.send_error(400, "Invalid framerate")
+                return
+            self._stream(min(max(fps, 0.1), self.server.max_framerate))
+        elif url.path == "/snapshot.jpg":
+            # the latest frame might be old, if the camera was idle, wait for the next one
+            self.server.add_snapshot(1)
+            try:
+                frame = self.server.frame.get(after=self.server.frame.seq, timeout=self.timeout)
+            finally:
+                self.server.add_snapshot(-1)
+            if frame is None:
+                self.send_error(503, "No frames available")
+                return
+            self._send_headers("image/jpeg", len(frame[1]))
+            self.wfile.write(frame[1])
+        else:
+            self.send_error(404)
+
+    def _send_headers(self, content_type: str, length: Optional[int] = None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache, no-store, must-revalidate")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if length is not None:
+            self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def _stream(self, fps: float):
+        boundary = self.server.BOUNDARY
+        self._send_headers(f"multipart/x-mixed-replace; boundary={boundary}")
+        period = 1.0 / fps
+        seq, next_time = 0, 0.0
+        self.server.add_viewer(1)
+        try:
+            while True:
+                # per-viewer rate cap, frames published meanwhile are skipped
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                frame = self.server.frame.get(after=seq, timeout=self.timeout)
+                if frame is None:
+                    return
+                seq, data = frame
+                next_time = max(next_time + period, time.monotonic())
+                header = (
+                    f"--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n"
+                ).encode()
+                self.wfile.write(header)
+                self.wfile.write(data)
+                self.wfile.write(b"\r\n")
+        except (ConnectionError, socket.timeout):
+            pass
+        finally:
+            self.server.add_viewer(-1)
+
+    def log_message(self, *args):
+        # one request per viewer, not worth logging
+        pass
@@ -0,0 +1,34 @@
+class RateLimiter:
+    """Lets frames through at most `max_rate` times per second, based on their timestamps.
+
+    A frame goes through as soon as it is due, with a tolerance of `TOLERANCE` periods for the
+    jitter of the timestamps, so that, e.g., every third frame of a 30 fps stream makes a 10 fps
+    one. Rates that do not divide the framerate are met on average.
+
+    Args:
+        max_rate (:obj:`float`): Maximum rate, in frames per second
+
+    Raises:
+        ValueError: If the rate is not positive
+    """
+
+    TOLERANCE = 0.1
+
+    def __init__(self, max_rate: float):
+        if max_rate <= 0:
+            raise ValueError(f"The rate must be positive, got {max_rate}.")
+        self.period = 1.0 / max_rate
+        self._next = None
+
+    def ready(self, stamp: float) -> bool:
+        """Whether the frame captured at `stamp` (in seconds) goes through."""
+        period = self.period
+        # timestamps that went back in time (e.g., a restarted camera) start over
+        if self._next is not None and self._next - period <= stamp < self._next - self.TOLERANCE * period:
+            return False
+        if self._next is None or not self._next - period <= stamp < self._next + period:
+            # first frame, or the stream fell behind (or jumped): the next one is due in a period
+            self._next = stamp + period
+        else:
+            self._next += period
+        return True
@@ -0,0 +1,120 @@
+import os
+import errno
+import fcntl
+import struct
+from typing import Optional, Tuple
+
+# ioctl request codes (see linux/videodev2.h)
+VIDIOC_G_CTRL = 0xC008561B
+VIDIOC_S_CTRL = 0xC008561C
+VIDIOC_G_PARM = 0xC0CC5615
+VIDIOC_S_PARM = 0xC0CC5616
+VIDIOC_G_SELECTION = 0xC040565E
+VIDIOC_S_SELECTION = 0xC040565F
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+
+# selection targets
+V4L2_SEL_TGT_CROP = 0x0000
+V4L2_SEL_TGT_CROP_BOUNDS = 0x0002
+
+# control IDs
+V4L2_CID_MPEG_VIDEO_BITRATE = 0x009909CF
+V4L2_CID_EXPOSURE_AUTO = 0x009A0901
+V4L2_CID_EXPOSURE_ABSOLUTE = 0x009A0902
+V4L2_CID_JPEG_COMPRESSION_QUALITY = 0x009D0903
+
+# values of V4L2_CID_EXPOSURE_AUTO
+V4L2_EXPOSURE_AUTO = 0
+V4L2_EXPOSURE_MANUAL = 1
+
+# struct v4l2_control { __u32 id; __s32 value; }
+_CONTROL = struct.Struct("<Ii")
+# struct v4l2_streamparm { __u32 type; struct v4l2_captureparm { __u32 capability; __u32 capturemode;
+#   struct v4l2_fract timeperframe; __u32 extendedmode; __u32 readbuffers; __u32 reserved[4]; } ... }
+_STREAMPARM = struct.Struct("<IIIIIII4I")
+_STREAMPARM_SIZE = 204
+# struct v4l2_selection { __u32 type; __u32 target; __u32 flags; struct v4l2_rect { __s32 left; __s32 top;
+#   __u32 width; __u32 height; } r; __u32 reserved[9]; }
+_SELECTION = struct.Struct("<IIIiiII36x")
+
+
+class V4L2Device:
+    """Minimal access to the controls of a V4L2 device through ioctl calls.
+
+    The device is opened on a file descriptor of its own, controls can thus be changed while
+    another handle (e.g., ``cv2.VideoCapture``) is streaming from the same device.
+
+    Args:
+        path (:obj:`str`): Path to the device, e.g., `/dev/video0`
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def open(self):
+        if self._fd is None:
+            self._fd = os.open(self._path, os.O_RDWR | os.O_NONBLOCK)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def get_control(self, cid: int) -> int:
+        buf = bytearray(_CONTROL.pack(cid, 0))
+        fcntl.ioctl(self._fd, VIDIOC_G_CTRL, buf)
+        return _CONTROL.unpack(buf)[1]
+
+    def set_control(self, cid: int, value: int):
+        """Sets a control.
+
+        Raises:
+            OSError: With `errno.EINVAL` if the device does not support the control,
+                `errno.EBUSY` if the control cannot be changed right now
+        """
+        buf = bytearray(_CONTROL.pack(cid, int(value)))
+        fcntl.ioctl(self._fd, VIDIOC_S_CTRL, buf)
+
+    def set_framerate(self, fps: int):
+        """Sets the frame interval of the capture stream to `1/fps` seconds."""
+        buf = bytearray(_STREAMPARM_SIZE)
+        struct.pack_into("<I", buf, 0, V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        fcntl.ioctl(self._fd, VIDIOC_G_PARM, buf)
+        fields = list(_STREAMPARM.unpack_from(buf, 0))
+        # timeperframe = 1 / fps
+        fields[3], fields[4] = 1, int(fps)
+        _STREAMPARM.pack_into(buf, 0, *fields)
+        fcntl.ioctl(self._fd, VIDIOC_S_PARM, buf)
+
+    def get_selection(self, target: int) -> Tuple[int, int, int, int]:
+        """Returns the rectangle `(left, top, width, height)` of a selection target (e.g., crop bounds)."""
+        buf = bytearray(_SELECTION.pack(V4L2_BUF_TYPE_VIDEO_CAPTURE, target, 0, 0, 0, 0, 0))
+        fcntl.ioctl(self._fd, VIDIOC_G_SELECTION, buf)
+        return _SELECTION.unpack(buf)[3:]
+
+    def set_selection(self, target: int, rect: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        """Sets the rectangle `(left, top, width, height)` of a selection target (e.g., the crop).
+
+        Returns:
+            :obj:`tuple`: The rectangle actually set by the driver
+        """
+        buf = bytearray(_SELECTION.pack(V4L2_BUF_TYPE_VIDEO_CAPTURE, target, 0, *rect))
+        fcntl.ioctl(self._fd, VIDIOC_S_SELECTION, buf)
+        return _SELECTION.unpack(buf)[3:]
+
+    @staticmethod
+    def is_unsupported(error: OSError) -> bool:
+        return error.errno in (errno.EINVAL, errno.ENOTTY)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
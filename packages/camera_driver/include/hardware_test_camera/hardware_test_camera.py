@@ -1,11 +1,15 @@
+from typing import Optional
+
 import rospy
 
 from dt_duckiebot_hardware_tests import HardwareTest, HardwareTestJsonParamType
 
 
 class HardwareTestCamera(HardwareTest):
-    def __init__(self) -> None:
+    def __init__(self, stream_url: Optional[str] = None) -> None:
         super().__init__()
+        # URL of the MJPEG-over-HTTP stream of the camera node, if it serves one
+        self._stream_url = stream_url
 
     def test_id(self) -> str:
         return "Camera"
@@ -28,10 +32,21 @@ class HardwareTestCamera(HardwareTest):
     def cb_run_test(self, _):
         rospy.loginfo(f"[{self.test_id()}] Test service called.")
 
+        # the HTTP stream, if any, can be shown by the browser directly (no ROS bridge involved)
+        lst_blocks = []
+        if self._stream_url is not None:
+            lst_blocks.append(
+                self.format_obj(
+                    key="Camera stream (MJPEG over HTTP)",
+                    value_type=HardwareTestJsonParamType.HTML,
+                    value=f'<img src="{self._stream_url}" style="max-width: 100%" alt="Camera stream"/>',
+                )
+            )
+
         # Return the service response
         return self.format_response_stream(
             success=True,  # does not matter here
             test_topic_name=f"camera_node/image/compressed",
             test_topic_type="sensor_msgs/CompressedImage",
-            lst_blocks=[],
+            lst_blocks=lst_blocks,
         )
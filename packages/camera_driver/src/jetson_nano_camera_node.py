@@ -4,15 +4,13 @@ import cv2
 import time
 import psutil
 import rospy
-import numpy as np
 from threading import Thread
 
-from typing import Tuple, cast
+from typing import Tuple, Optional
 from collections import namedtuple
 
 from camera_driver import AbsCameraNode
-
-from sensor_msgs.msg import CompressedImage
+from camera_driver.clock import CaptureClock
 
 
 CameraMode = namedtuple("CameraMode", "id width height fps fov")
@@ -21,6 +19,21 @@ CameraMode = namedtuple("CameraMode", "id width height fps fov")
 class JetsonNanoCameraNode(AbsCameraNode):
     """
     Handles the imagery on a Jetson Nano.
+
+    Configuration:
+        ~allow_partial_fov (:obj:`bool`): Allow sensor modes that crop the field of view
+        ~use_hw_acceleration (:obj:`bool`): Encode JPEG frames with the NVJPG engine
+        ~stall_timeout (:obj:`float`): Seconds without frames after which the pipeline is considered
+            stalled and recovered (at least three frame periods), default is 1.0
+        ~startup_timeout (:obj:`float`): Seconds a (re)started pipeline has to deliver its first
+            frame before it is considered stalled, default is 20.0
+
+    The H.264 stream (see `~h264`) is encoded by a branch of the camera pipeline, in hardware
+    with `nvv4l2h264enc`. Its access units are stamped with their PTS, which takes the `gdppay`
+    element (GStreamer bad plugins).
+
+    In low latency mode (see `~low_latency`), the `appsink` keeps only the newest frame and drops
+    the older ones, instead of queueing them until they are read.
     """
 
     # each mode defines [width, height, fps]
@@ -35,6 +48,9 @@ class JetsonNanoCameraNode(AbsCameraNode):
     # exposure time range (ns)
     EXPOSURE_TIMERANGES = {"sports": [100000, 80000000], "night": [100000, 1000000000]}
     DEFAULT_EXPOSURE_MODE = "sports"
+    # period of the stall watchdog (seconds)
+    WATCHDOG_PERIOD = 0.1
+    H264_IN_PIPELINE = True
 
     def __init__(self):
         # Initialize the DTROS parent class
@@ -42,9 +58,22 @@ class JetsonNanoCameraNode(AbsCameraNode):
         # parameters
         self._allow_partial_fov = rospy.get_param("~allow_partial_fov", False)
         self._use_hw_acceleration = rospy.get_param("~use_hw_acceleration", False)
+        self._stall_timeout = float(rospy.get_param("~stall_timeout", 1.0))
+        self._startup_timeout = float(rospy.get_param("~startup_timeout", 20.0))
         # prepare gstreamer pipeline
         self._device = None
+        self._raw_format = "bgr"
+        # framerate the GStreamer pipeline was started with
+        self._pipeline_fps = None
+        # the frames are stamped by the pipeline, in a clock of its own
+        self._clock = CaptureClock()
         # prepare data flow monitor
+        self._nvargus: Optional[psutil.Process] = None
+        self._pipeline_start_time = 0
+        # time the last frame came out of the pipeline (`wants_frame` is called before reading it)
+        self._last_read_time = 0
+        # tells the capture thread to let go of the pipeline, so that it can be restarted
+        self._restarting = False
         self._flow_monitor = Thread(target=self._flow_monitor_fcn)
         self._flow_monitor.setDaemon(True)
         self._flow_monitor.start()
@@ -52,88 +81,176 @@ class JetsonNanoCameraNode(AbsCameraNode):
         self.log("[JetsonNanoCameraNode]: Initialized.")
 
     def _flow_monitor_fcn(self):
-        i = 0
-        failure_timeout = 20
+        """Stall watchdog.
+
+        Declares a stall when no frames came out of the pipeline for `~stall_timeout` seconds (or
+        for `~startup_timeout` seconds after it was opened, for the first frame) and recovers with
+        the cheapest action that works, escalating only when an action fails:
+
+            1. restart the GStreamer pipeline within this process
+            2. kill `nvargus-daemon` (respawned by its service), then restart the pipeline
+            3. exit the node and let roslaunch respawn it
+        """
         while not self.is_shutdown:
-            # do nothing for the first `sleep_until` seconds, then check every 5 seconds
-            if (self._has_published or i > failure_timeout) and i % 5 == 0:
-                elapsed_since_last = time.time() - self._last_image_published_time
-                # reset nvargus if no images were received within the last 10 secs
-                if elapsed_since_last >= 10:
+            time.sleep(self.WATCHDOG_PERIOD)
+            # the pipeline is not running (yet)
+            if self._worker is None or self.is_stopped or self._pipeline_start_time <= 0:
+                continue
+            # a pipeline that was just (re)started gets more time for its first frame
+            stamp = max(self._last_read_time, self._pipeline_start_time)
+            stalled_for = time.time() - stamp
+            if self._last_read_time < self._pipeline_start_time:
+                stall_timeout = self._startup_timeout
+            else:
+                stall_timeout = max(self._stall_timeout, 3.0 / max(1, self._framerate.value))
+            if stalled_for < stall_timeout:
+                continue
+            self.logwarn(
+                f"[data-flow-monitor]: No frames were produced in the last {stalled_for:.1f} seconds, "
+                f"recovering the camera pipeline."
+            )
+            self._stats.count("stalls")
+            tic = time.time()
+            for action in ["restart", "nvargus"]:
+                if action == "nvargus" and not self._kill_nvargus():
+                    continue
+                if self._restart_pipeline() and self._wait_for_frame(after=tic):
+                    recovery_time = time.time() - tic
+                    self._stats.record(f"recovery/{action}", recovery_time)
+                    self._stats.count(f"recoveries/{action}")
                     self.loginfo(
-                        f"[data-flow-monitor]: Detected a period of "
-                        f"{int(elapsed_since_last)} seconds during which no "
-                        f"images were produced, restarting camera process."
+                        f"[data-flow-monitor]: Recovered with action '{action}' in "
+                        f"{recovery_time * 1000:.0f}ms (stream interrupted for "
+                        f"{(time.time() - stamp) * 1000:.0f}ms)."
                     )
-                    # find PID of the nvargus process
-                    killed = False
-                    for proc in psutil.process_iter():
-                        try:
-                            # get process name and pid from process object
-                            process_cmdline = proc.cmdline()
-                            if len(process_cmdline) <= 0:
-                                continue
-                            process_bin = process_cmdline[0]
-                            # if it is not the one we are looking for, skip
-                            if not process_bin.startswith("/usr/sbin/nvargus-daemon"):
-                                continue
-                            # this is the one we are looking for
-                            self.loginfo(
-                                f"[data-flow-monitor]: Process 'nvargus-daemon' found "
-                                f"with PID #{proc.pid}"
-                            )
-                            # - kill nvargus
-                            self.loginfo(f"[data-flow-monitor]: Killing nvargus.")
-                            proc.kill()
-                            time.sleep(1)
-                            # - stop camera node, then wait 10 seconds
-                            self.loginfo(f"[data-flow-monitor]: Clearing camera...")
-                            self.stop(force=True)
-                            self.loginfo(f"[data-flow-monitor]: Camera cleared. Rebooting.")
-                            # - exit camera node, roslaunch will respawn in 10 seconds
-                            rospy.signal_shutdown("Data flow monitor has closed the node")
-                            time.sleep(1)
-                            exit(1)
-                        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                            pass
-                    if not killed:
-                        self.loginfo("[data-flow-monitor]: Process 'nvargus-daemon' not found.")
-            # ---
-            i += 1
-            time.sleep(1)
+                    break
+                self.logwarn(f"[data-flow-monitor]: Recovery action '{action}' failed.")
+            else:
+                # - exit camera node, roslaunch will respawn it
+                self.logerr("[data-flow-monitor]: Could not recover the camera pipeline, exiting.")
+                self.stop(force=True)
+                rospy.signal_shutdown("Data flow monitor has closed the node")
+                time.sleep(1)
+                exit(1)
+
+    def _restart_pipeline(self) -> bool:
+        """Restarts the GStreamer pipeline, leaving the rest of the node running.
+
+        The new pipeline is opened by the new capture thread, a pipeline that hangs while opening
+        does not block the watchdog, it fails :meth:`_wait_for_frame` instead.
+        """
+        # the capture thread exits as soon as its current read returns, the pipeline cannot be
+        # released before that (OpenCV does not support releasing a capture while it is read)
+        self._restarting = True
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                # a read stuck in the camera stack returns once `nvargus-daemon` is killed
+                self.logwarn("[data-flow-monitor]: The camera thread did not stop.")
+                return False
+        if self._device is not None:
+            try:
+                self._device.release()
+            except Exception:
+                pass
+            self._device = None
+        self._restarting = False
+        self._worker = Thread(target=self._reopen_and_run, daemon=True)
+        self._worker.start()
+        return True
+
+    def _reopen_and_run(self):
+        try:
+            self._open_pipeline()
+        except Exception as e:
+            self.logwarn(f"[data-flow-monitor]: Could not restart the pipeline: {str(e)}")
+            return
+        self.run()
+
+    def _wait_for_frame(self, after: float) -> bool:
+        """Waits for a frame to be read after `after`, as long as a new pipeline gets to start."""
+        deadline = time.time() + self._startup_timeout
+        while time.time() < deadline and not self.is_shutdown:
+            if self._last_read_time > after:
+                return True
+            # the pipeline could not be opened, or it stopped delivering frames
+            worker = self._worker
+            if worker is None or not worker.is_alive():
+                return False
+            time.sleep(0.01)
+        return False
+
+    def _kill_nvargus(self) -> bool:
+        # the PID is cached, the process table is only scanned if the daemon was restarted
+        proc = self._nvargus
+        if proc is None or not proc.is_running():
+            proc = self._nvargus = self._find_nvargus()
+        if proc is None:
+            self.loginfo("[data-flow-monitor]: Process 'nvargus-daemon' not found.")
+            return False
+        self.loginfo(f"[data-flow-monitor]: Killing 'nvargus-daemon' (PID #{proc.pid}).")
+        try:
+            proc.kill()
+            proc.wait(timeout=1)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.TimeoutExpired) as e:
+            self.logwarn(f"[data-flow-monitor]: Could not kill 'nvargus-daemon': {str(e)}")
+            return False
+        self._nvargus = None
+        return True
+
+    @staticmethod
+    def _find_nvargus() -> Optional[psutil.Process]:
+        for proc in psutil.process_iter():
+            try:
+                cmdline = proc.cmdline()
+                if cmdline and cmdline[0].startswith("/usr/sbin/nvargus-daemon"):
+                    return proc
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+        return None
 
     def run(self):
         """Image capture procedure.
 
-        Captures a frame from the /dev/video2 image sink and publishes it.
+        Captures frames from the GStreamer pipeline and hands them over to the publisher.
         """
         if self._device is None or not self._device.isOpened():
             self.logerr("Device was found closed")
             return
-        # get first frame
-        retval, image = self._device.read() if self._device else (False, None)
-        # keep reading
-        while (not self.is_stopped) and (not self.is_shutdown) and retval:
-            if image is not None:
-                if self._use_hw_acceleration:
-                    # with HW acceleration, the NVJPG Engine module is used to encode RGB -> JPEG
-                    image = cast(np.ndarray, image)
-                    image_msg = CompressedImage()
-                    image_msg.header.stamp = rospy.Time.now()
-                    image_msg.format = "jpeg"
-                    image_msg.data = image.tobytes()
-                else:
-                    # without HW acceleration, the image is returned as RGB, encode on CPU
-                    if image is not None:
-                        image = np.uint8(image)
-                    image_msg = self._bridge.cv2_to_compressed_imgmsg(image, dst_format="jpeg")
-                # publish the compressed image
-                self.publish(image_msg)
-            # grab next frame
-            retval, image = self._device.read() if self._device else (False, None)
+        # with HW acceleration, the NVJPG Engine module is used to encode RGB -> JPEG,
+        # without it, the image is returned as BGR(x) and encoded on CPU by the publisher
+        fmt = "jpeg" if self._use_hw_acceleration else self._raw_format
+        device = self._device
+        buf = self.acquire_buffer()
+        retval = True
+        # keep reading (until the pipeline is replaced)
+        while (not self.is_stopped) and (not self.is_shutdown) and retval and not self._restarting:
+            if self.wants_frame():
+                # grab next frame (into a recycled buffer)
+                tic = time.monotonic()
+                retval, buf.data = device.read(buf.data)
+                self._stats.record("read", time.monotonic() - tic)
+                if retval and buf.data is not None:
+                    self._last_read_time = time.time()
+                    # OpenCV does not expose the PTS of the sample pulled from the appsink, this is a
+                    # position query on the pipeline, i.e., where its clock is now rather than when the
+                    # frame was captured. Frames that waited in the appsink (or in the queues before it)
+                    # are stamped as if they had not, so their `frame_age` is underestimated
+                    stamp = self._clock.to_time(device.get(cv2.CAP_PROP_POS_MSEC) / 1000.0)
+                    self.commit_buffer(buf, fmt, stamp)
+                    buf = self.acquire_buffer()
+            else:
+                # nobody is listening, drain the frame without retrieving it
+                retval = device.grab()
+                if retval:
+                    self._last_read_time = time.time()
+        self.release_buffer(buf)
         self.loginfo("Camera worker stopped.")
 
     def setup(self):
+        # a fresh pipeline runs at the requested framerate
+        self._rate_limit = None
         if self._device is None:
             self._device = cv2.VideoCapture()
         # check if the device is opened
@@ -144,23 +261,41 @@ class JetsonNanoCameraNode(AbsCameraNode):
         # open the device
         if not self._device.isOpened():
             try:
+                self._open_pipeline()
+            except (Exception, RuntimeError):
+                self.stop()
+                msg = "Could not start camera"
+                self.logerr(msg)
+                raise RuntimeError(msg)
+
+    def _open_pipeline(self):
+        if self._device is None:
+            self._device = cv2.VideoCapture()
+        if not self._device.isOpened():
+            # without HW acceleration, try to get BGRx frames straight out of nvvidconv and skip
+            # `videoconvert`, fall back to BGR if this OpenCV build does not support BGRx sinks
+            raw_formats = ["bgr"] if self._use_hw_acceleration else ["bgrx", "bgr"]
+            for raw_format in raw_formats:
+                self._raw_format = raw_format
                 self._device.open(self.gst_pipeline_string(), cv2.CAP_GSTREAMER)
                 # make sure the device is open
                 if not self._device.isOpened():
-                    msg = "OpenCV cannot open gstreamer resource"
-                    self.logerr(msg)
-                    raise RuntimeError(msg)
+                    self.logwarn(f"OpenCV cannot open gstreamer resource with format '{raw_format}'")
+                    continue
                 # try getting a sample image
-                retval, _ = self._device.read()
-                if not retval:
-                    msg = "Could not read image from camera"
-                    self.logerr(msg)
-                    raise RuntimeError(msg)
-            except (Exception, RuntimeError):
-                self.stop()
-                msg = "Could not start camera"
+                retval, image = self._device.read()
+                channels = image.shape[2] if retval and image.ndim == 3 else 0
+                if retval and (self._use_hw_acceleration or channels == len(raw_format)):
+                    break
+                self.logwarn(f"Could not read '{raw_format}' images from camera")
+                self._device.release()
+            else:
+                msg = "Could not read image from camera"
                 self.logerr(msg)
                 raise RuntimeError(msg)
+        self._pipeline_start_time = time.time()
+        self._clock.reset()
+        self._roi_applied = True
 
     def release(self, force: bool = False):
         if self._device is not None:
@@ -175,6 +310,21 @@ class JetsonNanoCameraNode(AbsCameraNode):
         self.loginfo("GST pipeline released.")
         self._device = None
 
+    def reconfigure(self, changes: dict) -> bool:
+        # the pipeline is owned by OpenCV, its elements cannot be reached while it is playing
+        if "exposure_mode" in changes:
+            return False
+        # the hardware encoder's quality is fixed in the pipeline, the software one is not
+        if "jpeg_quality" in changes and self._use_hw_acceleration:
+            return False
+        if "framerate" in changes:
+            fps = changes["framerate"]
+            if self._pipeline_fps is None or fps > self._pipeline_fps:
+                return False
+            # lower framerates are obtained by skipping frames produced by the pipeline
+            self._rate_limit = None if fps == self._pipeline_fps else fps
+        return True
+
     def gst_pipeline_string(self):
         res_w, res_h, fps = self._res_w.value, self._res_h.value, self._framerate.value
         fov = ("full", "partial") if self._allow_partial_fov else ("full",)
@@ -187,32 +337,73 @@ class JetsonNanoCameraNode(AbsCameraNode):
                 "capping at {}fps.".format(fps, camera_mode.fps, camera_mode.fps)
             )
             fps = camera_mode.fps
+        self._pipeline_fps = fps
         # get exposure time
         exposure_time = self.EXPOSURE_TIMERANGES.get(
-            self._exposure_mode, self.EXPOSURE_TIMERANGES[self.DEFAULT_EXPOSURE_MODE]
+            self._exposure_mode.value, self.EXPOSURE_TIMERANGES[self.DEFAULT_EXPOSURE_MODE]
         )
+        # the region of interest is cropped and binned by `nvvidconv`, before leaving the NVMM memory
+        roi_w, roi_h = self.roi.output_size
+        crop = "left={} right={} top={} bottom={}".format(
+            self.roi.x, self.roi.x + self.roi.w, self.roi.y, self.roi.y + self.roi.h
+        )
+        hw_crop = f"nvvidconv {crop} ! video/x-raw(memory:NVMM), width={roi_w}, height={roi_h}, format=I420 !"
+        # in low latency mode, frames that were not read in time are dropped rather than queued
+        appsink = "appsink"
+        queue = "queue"
+        if self._low_latency:
+            appsink = "appsink drop=true max-buffers=1 sync=false"
+            queue = "queue leaky=downstream max-size-buffers=1"
+        # the H.264 encoder gets the same frames through a second branch
+        tee, h264_branch = "", ""
+        if self.h264 is not None:
+            tee = f"tee name=camera ! {queue} ! "
+            h264_branch = "camera. ! queue leaky=downstream max-size-buffers=4 ! {}{}".format(
+                "" if self.roi.is_full else f"{hw_crop} ", self.h264.gst_branch_string(nvmm=True)
+            )
         # compile gst pipeline
         if self._use_hw_acceleration:
+            # the encoder keeps its own default quality unless one is asked for
+            quality = self.device_jpeg_quality
             gst_pipeline = """ \
                 nvarguscamerasrc \
                 sensor-mode={} exposuretimerange="{} {}" ! \
                 video/x-raw(memory:NVMM), width={}, height={}, format=NV12, framerate={}/1 ! \
-                nvjpegenc ! \
-                appsink \
+                {}{}nvjpegenc{} ! \
+                {} {} \
             """.format(
-                camera_mode.id, *exposure_time, self._res_w.value, self._res_h.value, fps
+                camera_mode.id,
+                *exposure_time,
+                self._res_w.value,
+                self._res_h.value,
+                fps,
+                tee,
+                "" if self.roi.is_full else f"{hw_crop} ",
+                "" if quality is None else f" quality={quality}",
+                appsink,
+                h264_branch,
             )
         else:
             gst_pipeline = """ \
                 nvarguscamerasrc \
                 sensor-mode={} exposuretimerange="{} {}" ! \
                 video/x-raw(memory:NVMM), width={}, height={}, format=NV12, framerate={}/1 ! \
-                nvvidconv ! 
-                video/x-raw, format=BGRx ! 
-                videoconvert ! \
-                appsink \
+                {}nvvidconv {} ! \
+                video/x-raw, width={}, height={}, format=BGRx ! \
+                {}{} {} \
             """.format(
-                camera_mode.id, *exposure_time, self._res_w.value, self._res_h.value, fps
+                camera_mode.id,
+                *exposure_time,
+                self._res_w.value,
+                self._res_h.value,
+                fps,
+                tee,
+                "" if self.roi.is_full else crop,
+                roi_w,
+                roi_h,
+                "" if self._raw_format == "bgrx" else "videoconvert ! ",
+                appsink,
+                h264_branch,
             )
         # ---
         self.logdebug("Using GST pipeline: `{}`".format(gst_pipeline))
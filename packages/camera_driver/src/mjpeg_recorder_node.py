@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import rospy
+
+from sensor_msgs.msg import CompressedImage
+from duckietown.dtros import DTROS, NodeType
+
+from camera_driver.recording import MJPEGRecorder
+
+
+class MJPEGRecorderNode(DTROS):
+    """Records a stream of JPEG images into indexed MJPEG segments.
+
+    A lighter alternative to `rosbag record` for camera streams: frames are appended as they are
+    to MJPEG files, along with a binary index of their timestamps (see
+    :class:`camera_driver.recording.MJPEGRecorder`). Recordings are read back, with seeking by
+    timestamp, through :class:`camera_driver.recording.MJPEGRecording`.
+
+    Configuration:
+        ~directory (:obj:`str`): Directory of the recording, default is
+            `/data/logs/camera_recordings/<start time>`
+        ~segment_size_mb (:obj:`float`): Maximum size of a segment in MB, default is 256
+        ~segment_duration (:obj:`float`): Maximum duration of a segment in seconds, default is 300
+
+    Subscriber:
+        ~image/compressed (:obj:`CompressedImage`): The JPEG images to record
+    """
+
+    def __init__(self):
+        # Initialize the DTROS parent class
+        super(MJPEGRecorderNode, self).__init__(
+            node_name="mjpeg_recorder_node",
+            node_type=NodeType.INFRASTRUCTURE,
+            help="Records a stream of JPEG images into indexed MJPEG files",
+        )
+        directory = rospy.get_param(
+            "~directory", os.path.join("/data/logs/camera_recordings", time.strftime("%Y%m%d_%H%M%S"))
+        )
+        self._recorder = MJPEGRecorder(
+            directory,
+            segment_size=int(float(rospy.get_param("~segment_size_mb", 256)) * 1024 * 1024),
+            segment_duration=float(rospy.get_param("~segment_duration", 300)),
+        )
+        self._failed = False
+        self.sub_img = rospy.Subscriber(
+            "~image/compressed",
+            CompressedImage,
+            self._img_cb,
+            queue_size=10,
+            buff_size=2**24,
+            tcp_nodelay=True,
+        )
+        self.loginfo(f"Recording to {directory}")
+
+    def _img_cb(self, msg: CompressedImage):
+        if self._failed:
+            return
+        if "jpeg" not in msg.format:
+            self._failed = True
+            self.logerr(f"Images in format '{msg.format}' cannot be recorded, recording stopped.")
+            return
+        try:
+            self._recorder.write(msg.header.stamp.to_sec(), msg.data)
+        except OSError as e:
+            self._failed = True
+            self.logerr(f"Recording stopped: {str(e)}")
+
+    def on_shutdown(self):
+        self._recorder.close()
+        self.loginfo(f"Recorded {self._recorder.frames} frames.")
+
+
+if __name__ == "__main__":
+    # initialize the node
+    recorder_node = MJPEGRecorderNode()
+    # keep the node alive
+    rospy.spin()
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 
 import cv2
+import time
 import rospy
 import atexit
-import subprocess
-import numpy as np
-from typing import cast
 
 from camera_driver import AbsCameraNode
-from sensor_msgs.msg import CompressedImage
+from camera_driver.clock import CaptureClock
+from camera_driver.v4l2 import (
+    V4L2Device,
+    V4L2_CID_MPEG_VIDEO_BITRATE,
+    V4L2_CID_JPEG_COMPRESSION_QUALITY,
+    V4L2_SEL_TGT_CROP,
+    V4L2_SEL_TGT_CROP_BOUNDS,
+)
 
 
 class RaspberryPi64Camera(AbsCameraNode):
@@ -17,49 +22,65 @@ class RaspberryPi64Camera(AbsCameraNode):
     """
 
     VIDEO_DEVICE = "/dev/video0"
+    VIDEO_BITRATE = 25000000
+    # exposure controls (through OpenCV) used in `sports` mode
+    SPORTS_AUTO_EXPOSURE = 0.75
+    SPORTS_EXPOSURE = 40.0
+    # V4L2 buffers in low latency mode: one being filled by the driver while the other is read
+    LOW_LATENCY_BUFFERS = 2
 
     def __init__(self):
         # Initialize the DTROS parent class
         super(RaspberryPi64Camera, self).__init__()
         # prepare gstreamer pipeline
         self._device = None
+        # controls are set through ioctl calls on a separate handle, also while streaming
+        self._controls = V4L2Device(RaspberryPi64Camera.VIDEO_DEVICE)
+        # V4L2 stamps the buffers with the monotonic clock
+        self._clock = CaptureClock(now=time.monotonic)
         # ---
         self.log("[RaspberryPi64Camera]: Initialized.")
 
     def run(self):
         """Image capture procedure.
 
-        Captures a frame from the /dev/video0 image sink and publishes it.
+        Captures frames from the /dev/video0 device and hands them over to the publisher.
         """
         if self._device is None or not self._device.isOpened():
             self.logerr("Device was found closed")
             return
-        # get first frame
-        retval, image = self._device.read() if self._device else (False, None)
+        # frames are already JPEG encoded
+        buf = self.acquire_buffer()
+        retval = True
         # keep reading
         while (not self.is_stopped) and (not self.is_shutdown) and retval:
-            if image is not None:
-                # image is already JPEG encoded
-                image = cast(np.ndarray, image)
-                image_msg = CompressedImage()
-                image_msg.header.stamp = rospy.Time.now()
-                image_msg.format = "jpeg"
-                image_msg.data = image.tobytes()
-                # publish the compressed image
-                self.publish(image_msg)
-            # grab next frame
-            retval, image = self._device.read() if self._device else (False, None)
+            if self.wants_frame():
+                # grab next frame (into a recycled buffer)
+                tic = time.monotonic()
+                retval, buf.data = self._device.read(buf.data) if self._device else (False, None)
+                self._stats.record("read", time.monotonic() - tic)
+                if retval and buf.data is not None:
+                    stamp = self._clock.to_time(self._device.get(cv2.CAP_PROP_POS_MSEC) / 1000.0)
+                    self.commit_buffer(buf, "jpeg", stamp)
+                    buf = self.acquire_buffer()
+            else:
+                # nobody is listening, drain the frame without retrieving it
+                retval = self._device.grab() if self._device else False
+        self.release_buffer(buf)
         self.loginfo("Camera worker stopped.")
 
     def setup(self):
         # setup camera
-        cam_props = {
-            "video_bitrate": 25000000,
-        }
-        for key in cam_props:
-            subprocess.call(
-                f"v4l2-ctl -d {RaspberryPi64Camera.VIDEO_DEVICE} -c {key}={str(cam_props[key])}", shell=True
-            )
+        try:
+            self._controls.open()
+        except OSError as e:
+            msg = f"Cannot open camera device {RaspberryPi64Camera.VIDEO_DEVICE}: {str(e)}"
+            self.logerr(msg)
+            raise RuntimeError(msg)
+        self._set_control("video_bitrate", V4L2_CID_MPEG_VIDEO_BITRATE, RaspberryPi64Camera.VIDEO_BITRATE)
+        # the region of interest is cropped by the ISP and the binning comes with the output size
+        cropped = self._set_crop()
+        width, height = self.roi.output_size if cropped else (self._res_w.value, self._res_h.value)
         # create VideoCapture object
         if self._device is None:
             self._device = cv2.VideoCapture()
@@ -74,23 +95,29 @@ class RaspberryPi64Camera(AbsCameraNode):
                     raise RuntimeError(msg)
                 # configure camera
                 self._device.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
-                self._device.set(cv2.CAP_PROP_FRAME_WIDTH, self._res_w.value)
-                self._device.set(cv2.CAP_PROP_FRAME_HEIGHT, self._res_h.value)
+                self._device.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                self._device.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                # setting the format might have reset the crop
+                if cropped:
+                    cropped = self._set_crop()
                 self._device.set(cv2.CAP_PROP_FPS, self._framerate.value)
+                # fewer buffers queued in the driver means fresher (but more often dropped) frames
+                if self._low_latency:
+                    self._device.set(cv2.CAP_PROP_BUFFERSIZE, RaspberryPi64Camera.LOW_LATENCY_BUFFERS)
                 self._device.set(cv2.CAP_PROP_CONVERT_RGB, False)
-                # Set auto exposure to false
-                # TODO: this should be for watchtowers only
-                if self._exposure_mode.value == "sports":
-                    msg = "Setting exposure to 'sports' mode."
-                    self.loginfo(msg)
-                    self._device.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.75)
-                    self._device.set(cv2.CAP_PROP_EXPOSURE, 40.0)
+                # TODO: the 'sports' mode should be for watchtowers only
+                self._set_exposure_mode(self._exposure_mode.value)
+                # the driver keeps its own default quality unless one is asked for
+                if self.device_jpeg_quality is not None:
+                    cid, quality = V4L2_CID_JPEG_COMPRESSION_QUALITY, self.device_jpeg_quality
+                    self._set_control("jpeg_quality", cid, quality)
                 # try getting a sample image
                 retval, _ = self._device.read()
                 if not retval:
                     msg = "Could not read image from camera"
                     self.logerr(msg)
                     raise RuntimeError(msg)
+                self._roi_applied = cropped
             except (Exception, RuntimeError):
                 self.stop()
                 msg = "Could not start camera"
@@ -109,6 +136,63 @@ class RaspberryPi64Camera(AbsCameraNode):
                 pass
             self.loginfo("Camera released.")
         self._device = None
+        self._controls.close()
+
+    def reconfigure(self, changes: dict) -> bool:
+        applied = True
+        if "framerate" in changes:
+            try:
+                self._controls.set_framerate(changes["framerate"])
+            except OSError as e:
+                self.logwarn(f"Cannot change the framerate while streaming: {str(e)}")
+                applied = False
+        if "exposure_mode" in changes:
+            # only the 'sports' mode sets the exposure, leaving it takes a restart
+            applied = changes["exposure_mode"] == "sports" and self._set_exposure_mode("sports") and applied
+        if "jpeg_quality" in changes:
+            cid, quality = V4L2_CID_JPEG_COMPRESSION_QUALITY, changes["jpeg_quality"]
+            applied = self._set_control("jpeg_quality", cid, quality) and applied
+        return applied
+
+    def _set_crop(self) -> bool:
+        """Crops the sensor to the region of interest, returns whether the camera applies it."""
+        try:
+            left, top, width, height = self._controls.get_selection(V4L2_SEL_TGT_CROP_BOUNDS)
+            if self.roi.is_full:
+                # undo crops left over by previous runs
+                self._controls.set_selection(V4L2_SEL_TGT_CROP, (left, top, width, height))
+                return False
+            x, y, w, h = self.roi.normalized
+            rect = (left + round(x * width), top + round(y * height), round(w * width), round(h * height))
+            self._controls.set_selection(V4L2_SEL_TGT_CROP, rect)
+        except OSError as e:
+            if not self.roi.is_full:
+                self.logwarn(f"The camera cannot crop frames: {str(e)}")
+            return False
+        return True
+
+    def _set_exposure_mode(self, mode: str) -> bool:
+        # the other modes leave the exposure to the driver
+        if mode != "sports":
+            return True
+        self.loginfo("Setting exposure to 'sports' mode.")
+        applied = self._device.set(cv2.CAP_PROP_AUTO_EXPOSURE, RaspberryPi64Camera.SPORTS_AUTO_EXPOSURE)
+        return self._device.set(cv2.CAP_PROP_EXPOSURE, RaspberryPi64Camera.SPORTS_EXPOSURE) and applied
+
+    def _set_control(self, name: str, cid: int, value: int) -> bool:
+        """Sets a V4L2 control, returns whether the camera applied the value.
+
+        Controls not supported by the device are reported and skipped, they are never applied.
+        """
+        try:
+            self._controls.set_control(cid, value)
+        except OSError as e:
+            if V4L2Device.is_unsupported(e):
+                self.logwarn(f"The camera does not support the control '{name}', ignoring.")
+                return False
+            self.logwarn(f"Cannot set the control '{name}' to {value}: {str(e)}")
+            return False
+        return True
 
 
 if __name__ == "__main__":
@@ -1,46 +1,63 @@
 #!/usr/bin/env python3
 
-import io
+import time
 import rospy
+from typing import Optional
 
 from picamera import PiCamera
-from sensor_msgs.msg import CompressedImage
 
 from camera_driver import AbsCameraNode
+from camera_driver.clock import CaptureClock
+from camera_driver.mjpeg import MJPEGStreamSplitter
 
 
 class RaspberryPiCameraNode(AbsCameraNode):
     """
     Handles the imagery on a Raspberry Pi.
+
+    Configuration:
+        ~capture_mode (:obj:`str`): How frames are obtained from the camera, one of
+            `sequence` (default), a sequence of JPEG captures from the video port, or
+            `recording`, an MJPEG recording split into frames as the encoder writes them. Frames are
+            stamped with the time of capture reported by the camera in `recording` mode only, with
+            the time they were received otherwise
+
+    While idle (see `~idle_mode`), the camera captures nothing: in `sequence` mode, the next capture
+    waits until a frame is wanted, in `recording` mode, the recording is stopped until somebody
+    subscribes, `trickle` frames are then taken with single captures from the video port.
     """
 
+    CAPTURE_MODES = ["sequence", "recording"]
+
     def __init__(self):
         # Initialize the DTROS parent class
         super(RaspberryPiCameraNode, self).__init__()
+        # parameters
+        self._capture_mode = rospy.get_param("~capture_mode", "sequence")
+        if self._capture_mode not in self.CAPTURE_MODES:
+            self.logwarn(f"Capture mode '{self._capture_mode}' not supported, using 'sequence' instead.")
+            self._capture_mode = "sequence"
         # prepare camera device
         self._device = None
-        self._stream = io.BytesIO()
+        # frames are stamped by the camera firmware, in microseconds since boot (`raw` clock mode)
+        self._clock = CaptureClock(now=lambda: self._device.timestamp / 1e6)
+        # framerate the sensor was started with, live changes go through `framerate_delta`
+        self._base_framerate = None
         # ---
         self.log("[RaspberryPiCameraNode]: Initialized.")
 
-    def _process_frame(self, stream):
+    def _process_frame(self, output: MJPEGStreamSplitter):
         # keep reading
         while (not self.is_stopped) and (not self.is_shutdown):
-            # expose buffer for the camera to populate with a new frame
-            yield stream
-            # move to the beginning of the buffer and get its value in bytes
-            stream.seek(0)
-            stream_data = stream.getvalue()
-            # make a ROS message out of the raw data
-            image_msg = CompressedImage()
-            # update message content
-            image_msg.format = "jpeg"
-            image_msg.data = stream_data
-            # publish message
-            self.publish(image_msg)
-            # clear buffer
-            stream.seek(0)
-            stream.truncate()
+            if not self.wants_frame():
+                # nothing is captured (nor encoded) until a frame is wanted
+                time.sleep(1.0 / max(1, self._framerate.value))
+                continue
+            # expose the output for the camera to write a new frame into, it goes straight into a
+            # recycled frame buffer
+            tic = time.monotonic()
+            yield output
+            self._stats.record("read", time.monotonic() - tic)
         self.loginfo("Camera worker stopped.")
 
     def run(self):
@@ -51,20 +68,87 @@ class RaspberryPiCameraNode(AbsCameraNode):
         if self._device is None or self._device.closed:
             self.logerr("Device was found closed")
             return
+        if self._capture_mode == "recording":
+            self._run_recording()
+            return
+        output = MJPEGStreamSplitter(
+            self.acquire_buffer, lambda buf: self.commit_buffer(buf, "jpeg"), self.release_buffer
+        )
         # create infinite iterator
-        processor = self._process_frame(self._stream)
+        processor = self._process_frame(output)
         # start processing data from camera
         try:
-            self._device.capture_sequence(processor, "jpeg", use_video_port=True, splitter_port=0)
+            self._device.capture_sequence(
+                processor, "jpeg", use_video_port=True, splitter_port=0, **self._quality_options()
+            )
         except StopIteration:
             pass
+        finally:
+            output.close()
+
+    def _quality_options(self) -> dict:
+        # picamera keeps its own default quality unless one is asked for
+        quality = self.device_jpeg_quality
+        return {} if quality is None else {"quality": quality}
+
+    def _acquire_wanted_buffer(self):
+        return self.acquire_buffer() if self.wants_frame() else None
+
+    def _frame_time(self) -> Optional[float]:
+        """Capture time of the frame being recorded, only known in `recording` mode."""
+        # the encoder updates the frame information before writing the data of the frame
+        frame = self._device.frame
+        if frame is None or frame.timestamp is None:
+            return None
+        return self._clock.to_time(frame.timestamp / 1e6)
+
+    def _run_recording(self):
+        # the encoder writes each frame in chunks, straight into recycled frame buffers
+        output = MJPEGStreamSplitter(
+            self._acquire_wanted_buffer,
+            lambda buf: self.commit_buffer(buf, "jpeg", self._frame_time()),
+            self.release_buffer,
+        )
+        # frames wanted while the recording is stopped are single captures
+        single = MJPEGStreamSplitter(
+            self.acquire_buffer, lambda buf: self.commit_buffer(buf, "jpeg"), self.release_buffer
+        )
+        options = self._quality_options()
+        recording = False
+        try:
+            while (not self.is_stopped) and (not self.is_shutdown):
+                streaming = self._idle_mode == "none" or self.has_subscribers()
+                if streaming != recording:
+                    if streaming:
+                        self._device.start_recording(output, format="mjpeg", splitter_port=0, **options)
+                    else:
+                        self._device.stop_recording(splitter_port=0)
+                        output.close()
+                    recording = streaming
+                if recording:
+                    # raises if the encoder failed
+                    self._device.wait_recording(0.5, splitter_port=0)
+                elif self.wants_frame():
+                    self._device.capture(single, "jpeg", use_video_port=True, **options)
+                else:
+                    time.sleep(1.0 / max(1, self._framerate.value))
+        finally:
+            if recording:
+                self._device.stop_recording(splitter_port=0)
+            output.close()
+            single.close()
+        self.loginfo("Camera worker stopped.")
 
     def setup(self):
         if self._device is None:
-            self._device = PiCamera()
+            self._device = PiCamera(clock_mode="raw")
             self._device.framerate = self._framerate.value
-            self._device.resolution = (self._res_w.value, self._res_h.value)
+            self._base_framerate = self._framerate.value
+            # the region of interest is cropped (zoom) and binned (resolution) by the ISP
+            self._device.zoom = self.roi.normalized
+            self._device.resolution = self.roi.output_size
             self._device.exposure_mode = self._exposure_mode.value
+        self._roi_applied = True
 
     def release(self, force: bool = False):
         if self._device is not None:
@@ -76,6 +160,23 @@ class RaspberryPiCameraNode(AbsCameraNode):
             self.loginfo("CSI camera released.")
         self._device = None
 
+    def reconfigure(self, changes: dict) -> bool:
+        if self._device is None or self._device.closed:
+            return False
+        # the JPEG quality is fixed once the capture sequence has started
+        if "jpeg_quality" in changes:
+            return False
+        try:
+            if "exposure_mode" in changes:
+                self._device.exposure_mode = changes["exposure_mode"]
+            if "framerate" in changes:
+                # the framerate cannot be changed while recording, its delta can
+                self._device.framerate_delta = changes["framerate"] - self._base_framerate
+        except Exception as e:
+            self.logwarn(f"Cannot reconfigure the running camera: {str(e)}")
+            return False
+        return True
+
 
 if __name__ == "__main__":
     # initialize the node
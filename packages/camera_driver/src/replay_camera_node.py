@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import rospy
+import rospkg
+
+from camera_driver import AbsCameraNode
+from camera_driver.replay import AbsFrameSource, get_source
+
+
+class ReplayCameraNode(AbsCameraNode):
+    """
+    Replays recorded or synthetic imagery, no camera needed.
+
+    Configuration:
+        ~source (:obj:`str`): An MJPEG file (`.mjpeg`, `.mjpg`), a directory of JPEG images or any
+            other video file supported by OpenCV (e.g., MP4), empty (default) for a synthetic pattern
+        ~pattern (:obj:`str`): Synthetic pattern, `bars` (default) or `noise`, frames have the
+            resolution `~res_w`x`~res_h`
+        ~realtime (:obj:`bool`): Pace the frames at `~framerate`, default is `True`. When `False`,
+            frames are produced as fast as possible, while wanted (see `~idle_mode`)
+        ~loop (:obj:`bool`): Restart from the first frame at the end of the source, default is `True`
+    """
+
+    # calibrations shipped with the package, used unless `~calibration_folder` is set
+    CALIBRATION_FOLDER = os.path.join(
+        rospkg.RosPack().get_path("camera_driver"), "config", "replay_camera_node", "calibrations"
+    )
+
+    def __init__(self):
+        # Initialize the DTROS parent class
+        super(ReplayCameraNode, self).__init__()
+        # parameters
+        self._source_path = rospy.get_param("~source", "")
+        self._pattern = rospy.get_param("~pattern", "bars")
+        self._realtime = rospy.get_param("~realtime", True)
+        self._loop = rospy.get_param("~loop", True)
+        # prepare frame source
+        self._source = None
+        # ---
+        self.log("[ReplayCameraNode]: Initialized.")
+
+    def run(self):
+        """Image capture procedure.
+
+        Reads frames from the source and hands them over to the publisher, pacing them at the
+        configured framerate unless running as fast as possible.
+        """
+        source: AbsFrameSource = self._source
+        if source is None:
+            self.logerr("Source was found closed")
+            return
+        buf = self.acquire_buffer()
+        next_frame_time = time.monotonic()
+        # keep reading
+        while (not self.is_stopped) and (not self.is_shutdown):
+            if self._realtime:
+                # the framerate is read at every frame, it can change at runtime
+                next_frame_time += 1.0 / max(1, self._framerate.value)
+                delay = next_frame_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -1.0:
+                    # we fell behind by more than a second, do not try to catch up
+                    next_frame_time = time.monotonic()
+            if self.wants_frame():
+                tic = time.monotonic()
+                buf.data = source.read(buf.data if source.format != "jpeg" else None)
+                self._stats.record("read", time.monotonic() - tic)
+                if buf.data is not None:
+                    self.commit_buffer(buf, source.format)
+                    buf = self.acquire_buffer()
+                    continue
+            elif not self._realtime:
+                # there is no timeline to keep up with, hold the position until a frame is wanted
+                time.sleep(1.0 / max(1, self._framerate.value))
+                continue
+            elif source.skip():
+                continue
+            # end of the source
+            if not self._loop:
+                self.loginfo("Reached the end of the source.")
+                break
+            source.rewind()
+        self.release_buffer(buf)
+        self.loginfo("Camera worker stopped.")
+
+    def setup(self):
+        if self._source is None:
+            try:
+                self._source = get_source(
+                    self._source_path, self._res_w.value, self._res_h.value, self._pattern
+                )
+                self._source.open()
+            except (ValueError, RuntimeError) as e:
+                self._source = None
+                msg = f"Could not open the replay source: {str(e)}"
+                self.logerr(msg)
+                raise RuntimeError(msg)
+            self.loginfo(f"Replaying from {type(self._source).__name__} ('{self._source_path}').")
+
+    def release(self, force: bool = False):
+        if self._source is not None:
+            self.loginfo("Releasing replay source...")
+            self._source.close()
+            self.loginfo("Replay source released.")
+        self._source = None
+
+    def reconfigure(self, changes: dict) -> bool:
+        # the framerate is only used for pacing, the rest has no effect on a replay
+        return True
+
+
+if __name__ == "__main__":
+    # initialize the node
+    camera_node = ReplayCameraNode()
+    camera_node.start()
+    # keep the node alive
+    rospy.spin()
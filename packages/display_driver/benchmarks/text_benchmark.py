@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Benchmark of the text renderer of the display.
+
+Renders the texts shown by the display renderers (usage stats, robot info, battery indicator,
+ToF readings) with :func:`display_renderer.text.monospace_screen` and with the previous
+implementation, which loads the font and draws the text with PIL on every call, checks that the
+two images are identical and reports, for each text:
+
+    - pil_us: time to render the text with PIL, in microseconds
+    - atlas_us: time to render the text with the glyph atlas, into a preallocated buffer
+    - speedup: pil_us / atlas_us
+
+Atlases are built on the first use of a font size, the time it takes is reported separately.
+"""
+
+import time
+import argparse
+import statistics
+from typing import Callable, List, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from display_renderer import text as display_text
+from display_renderer.text import monospace_screen
+
+USAGE_STATS = """\
+TMP |{0}| {1}C
+CPU |{2}| {3}%
+RAM |{4}| {5}%
+DSK |{6}| {7}%"""
+ROBOT_INFO = """\
+Name        autobot01
+Model           DB21J
+Firmware       v1.2.3"""
+
+
+def pil_screen(shape: tuple, text: Union[List[str], str], scale: Union[str, float] = 1.0) -> np.ndarray:
+    """The previous implementation of `monospace_screen`, drawing the text with PIL."""
+    if isinstance(text, str):
+        text = text.split("\n")
+    font_size = display_text.DEFAULT_FONT_SIZE
+    line_spacing = display_text.DEFAULT_LINE_SPACING
+    if scale == "fill":
+        vfont_size, vline_spacing = display_text._compute_sizes("vfill", text, shape)
+        hfont_size, hline_spacing = display_text._compute_sizes("hfill", text, shape)
+        font_size, line_spacing = min((vfont_size, vline_spacing), (hfont_size, hline_spacing))
+    elif isinstance(scale, str):
+        font_size, line_spacing = display_text._compute_sizes(scale, text, shape)
+    char_height, _ = display_text._CHAR_SIZE_PER_FONT_SIZE[font_size]
+    pil_im = Image.fromarray(np.zeros(shape))
+    draw = ImageDraw.Draw(pil_im)
+    font = ImageFont.truetype(display_text._FONT_FILEPATH, font_size)
+    for i, line in enumerate(text):
+        draw.text((0, -2 + int(i * (char_height + line_spacing))), line, font=font)
+    return np.array(pil_im).astype(np.uint8) * 255
+
+
+def usage_stats(i: int) -> str:
+    values = [(i * 7 + k * 13) % 101 for k in range(4)]
+    bars = ["#" * (11 * v // 100) + " " * (11 - 11 * v // 100) for v in values]
+    return USAGE_STATS.format(*[x for pair in zip(bars, values) for x in pair])
+
+
+# (name, shape, texts, scale), the texts are rendered in turn
+CASES: List[Tuple[str, tuple, Callable[[int], str], Union[str, float]]] = [
+    ("usage_stats", (44, 128), usage_stats, "fill"),
+    ("robot_info", (44, 128), lambda i: ROBOT_INFO, "fill"),
+    ("battery", (14, 100), lambda i: "%d%%" % (i % 101), "fill"),
+    ("tof_title", (12, 128), lambda i: "ToF / Front Center:", "vfill"),
+    ("tof_reading", (32, 128), lambda i: f" {(i % 1200) / 10:.1f}cm ", "hfill"),
+    ("default_size", (64, 128), lambda i: f"Line {i % 10}\nof text", 1.0),
+]
+
+
+def timed(render: Callable[[int], np.ndarray], iterations: int, repeats: int) -> float:
+    """Median time of a call, in microseconds."""
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(iterations):
+            render(i)
+        runs.append((time.perf_counter() - start) / iterations * 1e6)
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--iterations", type=int, default=500, help="Renders per timed run")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per text")
+    args = parser.parse_args()
+
+    font_size = display_text.DEFAULT_FONT_SIZE
+    start = time.perf_counter()
+    display_text._atlas(font_size)
+    print(f"atlas built in {(time.perf_counter() - start) * 1e3:.1f} ms (font size {font_size})")
+
+    print(f"{'text':<14}{'pil_us':>10}{'atlas_us':>10}{'speedup':>9}  identical")
+    for name, shape, texts, scale in CASES:
+        out = np.zeros(shape, dtype=np.uint8)
+        # builds the atlases, and checks the output on all the texts timed
+        identical = all(
+            np.array_equal(
+                monospace_screen(shape, texts(i), scale=scale, out=out), pil_screen(shape, texts(i), scale)
+            )
+            for i in range(args.iterations)
+        )
+        pil_us = timed(lambda i: pil_screen(shape, texts(i), scale), args.iterations, args.repeats)
+        atlas_us = timed(
+            lambda i: monospace_screen(shape, texts(i), scale=scale, out=out), args.iterations, args.repeats
+        )
+        print(f"{name:<14}{pil_us:>10.1f}{atlas_us:>10.1f}{pil_us / atlas_us:>8.1f}x  {identical}")
+
+
+if __name__ == "__main__":
+    main()
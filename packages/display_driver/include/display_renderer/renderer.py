@@ -93,7 +93,7 @@ class TextFragmentRenderer(AbsDisplayFragmentRenderer):
         self._text = text
 
     def _render(self):
-        self._buffer = monospace_screen(self.shape, self._text, scale=self._scale)
+        monospace_screen(self.shape, self._text, scale=self._scale, out=self._buffer)
 
 
 class NumpyArrayFragmentRenderer(AbsDisplayFragmentRenderer):
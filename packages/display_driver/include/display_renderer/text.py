@@ -1,6 +1,8 @@
+import random
+import string
 import numpy as np
 
-from typing import Union, Iterable, List, Tuple
+from typing import Union, Iterable, List, Tuple, Dict, Optional, NamedTuple, Set
 from PIL import ImageFont, ImageDraw, Image
 
 _FONT_FILEPATH = "/usr/share/fonts/ubuntu-mono-regular.ttf"
@@ -19,11 +21,210 @@ SAMPLE_CANVAS = """\
 """
 
 
+# characters in the glyph atlases, text with any other character is drawn by PIL
+_ATLAS_CHARS = " " + string.digits + string.ascii_letters + string.punctuation
+# glyph the others are measured against, drawn next to each of them
+_ATLAS_REFERENCE = "|"
+# glyphs are measured with text anchors (PIL 8), text is drawn by PIL with older versions
+_ATLAS_SUPPORTED = hasattr(ImageFont.FreeTypeFont, "getlength")
+
+
+class _Glyph(NamedTuple):
+    # the pixels of the glyph (`None` for blank characters)
+    mask: Optional[np.ndarray]
+    # position of the mask in a line, up to the offsets of the line (see `_compose`)
+    top: int
+    left: int
+    # height of the outline above and below the baseline
+    ascent: int
+    descent: int
+    # how far the top of the bitmap is below the one of the reference glyph
+    drop: int
+    # horizontal offset of the lines starting with the glyph
+    shift: int
+
+
+class _GlyphAtlas:
+    """The glyphs of the font at one size, rasterized once, exactly as PIL draws them.
+
+    PIL (FreeType) places a line of text with respect to the highest outline and bitmap of its
+    glyphs, and to the left edge of its first glyph. Those are measured by drawing each glyph next
+    to a reference one, composing the glyphs then matches PIL to the pixel for monospaced fonts
+    with integral advances, without kerning nor ligatures. This is checked once per font size,
+    text is drawn by PIL for sizes that fail the check (see :attr:`valid`).
+    """
+
+    def __init__(self, font_size: int):
+        self.font_size = font_size
+        self.glyphs: Dict[str, _Glyph] = {}
+        # blanks whose bitmaps are only known not to be higher than their drops
+        self.uncertain: Set[str] = set()
+        self._font = _FONT[font_size]
+        self._pad = 2 * font_size
+        self.ascender = self._font.getmetrics()[0]
+        self.advance = 0
+        self.valid = False
+        if _ATLAS_SUPPORTED:
+            advance = self._font.getlength("X")
+            self.advance = int(advance)
+            self.valid = (
+                advance == self.advance > 0
+                and self._measure()
+                and all(self._check(line) for line in self._check_lines())
+            )
+
+    def covers(self, text: List[str]) -> bool:
+        """Whether the glyphs of the atlas can render the given lines."""
+        glyphs = self.glyphs
+        for line in text:
+            if not all(c in glyphs for c in line):
+                return False
+            blanks = self.uncertain.intersection(line)
+            if blanks:
+                # the line is placed with respect to a glyph at least as low as these blanks
+                known = [glyphs[c].drop for c in line if c not in blanks]
+                if known and min(known) > min(glyphs[c].drop for c in blanks):
+                    return False
+        return True
+
+    def _draw(self, line: str) -> np.ndarray:
+        pad = self._pad
+        return _pil_draw((4 * pad, len(line) * self.advance + 2 * pad), [line], self._font, 0, pad + 2, pad)
+
+    def _ink(self, canvas: np.ndarray) -> Optional[Tuple[int, int, np.ndarray]]:
+        # the position (with respect to the pen) and the pixels of the ink of a canvas
+        rows = np.flatnonzero(canvas.any(axis=1))
+        cols = np.flatnonzero(canvas.any(axis=0))
+        if rows.size == 0:
+            return None
+        mask = canvas[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+        return int(rows[0]) - self._pad, int(cols[0]) - self._pad, mask
+
+    def _measure(self) -> bool:
+        advance, ref = self.advance, _ATLAS_REFERENCE
+        ascent, descent, ink = {}, {}, {}
+        for char in _ATLAS_CHARS:
+            _, top, _, bottom = self._font.getbbox(char, mode="1", anchor="ls")
+            ascent[char], descent[char] = max(0, -top), max(0, bottom)
+            ink[char] = self._ink(self._draw(char))
+        if ink[ref] is None:
+            return False
+        ref_row, ref_col, ref_mask = ink[ref]
+        split = self._pad + ref_col + ref_mask.shape[1]
+        drop, shift = {ref: 0}, {ref: 0}
+        # inked glyphs, drawn after the reference
+        for char in _ATLAS_CHARS:
+            if char == ref or ink[char] is None:
+                continue
+            canvas = self._draw(ref + char)
+            ref_ink, char_ink = self._ink(canvas[:, :split]), self._ink(canvas[:, split:])
+            if ref_ink is None or char_ink is None:
+                return False
+            row, col, mask = ink[char]
+            if not np.array_equal(ref_ink[2], ref_mask) or not np.array_equal(char_ink[2], mask):
+                return False
+            # either glyph moves down by the difference between the tops of their bitmaps
+            highest = max(ascent[ref], ascent[char])
+            ref_down = ref_ink[0] - ref_row + highest - ascent[ref]
+            char_down = char_ink[0] - row + highest - ascent[char]
+            if min(ref_down, char_down) != 0:
+                return False
+            drop[char] = char_down - ref_down
+            shift[char] = col + advance - (char_ink[1] + split)
+        inked = list(drop)
+        if len(inked) == 1:
+            return False
+        # blank glyphs only move the others
+        for char in _ATLAS_CHARS:
+            if ink[char] is not None:
+                continue
+            ref_ink = self._ink(self._draw(ref + char))
+            highest = max(ascent[ref], ascent[char])
+            drop[char] = min(0, ref_row - ref_ink[0] - highest + ascent[ref])
+            if drop[char] == 0:
+                # the blank is no higher than the reference, glyphs lower than it show how much,
+                # unless they are pushed out of the line (clipped)
+                self.uncertain.add(char)
+                for other in sorted(inked, key=drop.get, reverse=True):
+                    other_ink = self._ink(self._draw(other + char))
+                    if other_ink is not None:
+                        highest = max(ascent[other], ascent[char])
+                        down = other_ink[0] - ink[other][0] + highest - ascent[other]
+                        drop[char] = drop[other] - down
+                        if down > 0:
+                            self.uncertain.discard(char)
+                        break
+            shift[char] = self._ink(self._draw(char + ref))[1] - ref_col - advance
+        for char in _ATLAS_CHARS:
+            row, col, mask = ink[char] if ink[char] is not None else (0, 0, None)
+            self.glyphs[char] = _Glyph(
+                mask if mask is None else mask.copy(),
+                row + drop[char] + ascent[char],
+                col - shift[char],
+                ascent[char],
+                descent[char],
+                drop[char],
+                shift[char],
+            )
+        return True
+
+    def _check_lines(self) -> List[str]:
+        chars = _ATLAS_CHARS.strip()
+        lines = [chars, chars[::-1], " " + chars, chars[1::2] + " " + chars[::2]]
+        # and lines of a few characters, whose extremes vary more
+        rand = random.Random(self.font_size)
+        lines += ["".join(rand.choice(_ATLAS_CHARS) for _ in range(rand.randint(1, 6))) for _ in range(200)]
+        return lines
+
+    def _check(self, line: str) -> bool:
+        if not self.covers([line]):
+            return True
+        pad = self._pad
+        shape = (4 * pad, len(line) * self.advance + 2 * pad)
+        expected = _pil_draw(shape, [line], self._font, 0, pad, pad)
+        actual = np.zeros(shape, dtype=np.uint8)
+        _compose(actual, [line], self, 0, pad, pad)
+        return np.array_equal(actual, expected)
+
+
+_ATLAS: Dict[int, _GlyphAtlas] = {}
+
+
+def _atlas(font_size: int) -> _GlyphAtlas:
+    if font_size not in _ATLAS:
+        _ATLAS[font_size] = _GlyphAtlas(font_size)
+    return _ATLAS[font_size]
+
+
 def monospace_screen(
-    shape: tuple, text: Union[Iterable[str], str], scale: Union[str, float] = 1.0, align: str = "left"
+    shape: tuple,
+    text: Union[Iterable[str], str],
+    scale: Union[str, float] = 1.0,
+    align: str = "left",
+    out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
+    """Renders text in white on black, in a monochrome image.
+
+    Text is composed out of glyphs rasterized once per font size, the result is the same (to the
+    pixel) as drawing it with PIL.
+
+    Args:
+        shape (:obj:`tuple`): Shape `(height, width)` of the image
+        text (:obj:`str` or :obj:`list`): Text, as a string or a list of lines
+        scale (:obj:`str` or :obj:`float`): One of `fill`, `vfill` and `hfill` to pick the largest font
+            that fits the image (in both directions, vertically, horizontally), the default font size
+            otherwise
+        align (:obj:`str`): Not used, lines are always aligned to the left
+        out (:obj:`numpy.ndarray`): Image (`uint8`, of the given shape) to render into instead of
+            a new one, e.g., a view on a larger image
+
+    Returns:
+        :obj:`numpy.ndarray`: The image, with values 0 and 255
+    """
     if isinstance(text, str):
         text = text.split("\n")
+    else:
+        text = list(text)
     if isinstance(scale, str):
         if scale not in ["fill", "vfill", "hfill"]:
             raise ValueError("The argument `scale` must be one of [`fill`, `vfill`, `hfill`]")
@@ -41,22 +242,68 @@ def monospace_screen(
             line_spacing = spacings[i]
         else:
             font_size, line_spacing = _compute_sizes(scale, text, shape)
-    char_height, char_width = _CHAR_SIZE_PER_FONT_SIZE[font_size]
-    # create empty numpy image
-    image = np.zeros(shape)
-    # pass the image to PIL
-    pil_im = Image.fromarray(image)
+    if out is None:
+        out = np.zeros(shape, dtype=np.uint8)
+    else:
+        out.fill(0)
+    atlas = _atlas(font_size)
+    if atlas.valid and atlas.covers(text):
+        _compose(out, text, atlas, line_spacing)
+    else:
+        out[...] = _pil_draw(shape, text, _FONT[font_size], line_spacing)
+    return out
+
+
+def _line_rows(text: List[str], font_size: int, line_spacing: int, top: int = 0) -> List[int]:
+    char_height = _CHAR_SIZE_PER_FONT_SIZE[font_size][0]
+    return [top - 2 + int(i * (char_height + line_spacing)) for i in range(len(text))]
+
+
+def _pil_draw(
+    shape: tuple,
+    text: List[str],
+    font: ImageFont.FreeTypeFont,
+    line_spacing: int,
+    top: int = 0,
+    left: int = 0,
+) -> np.ndarray:
+    """Draws text with PIL, the reference the glyph atlas has to match."""
+    # a float image is drawn with ink 1.0 and without antialiasing
+    pil_im = Image.fromarray(np.zeros(shape))
     draw = ImageDraw.Draw(pil_im)
-    # use a truetype font
-    font = ImageFont.truetype(_FONT_FILEPATH, font_size)
-    # draw the text
-    for i, line in enumerate(text):
-        row = -2 + int(i * (char_height + line_spacing))
-        draw.text((0, row), line, font=font, align=align)
-    # get back the image as numpy array
+    for row, line in zip(_line_rows(text, font.size, line_spacing, top), text):
+        draw.text((left, row), line, font=font)
     return np.array(pil_im).astype(np.uint8) * 255
 
 
+def _compose(
+    out: np.ndarray, text: List[str], atlas: _GlyphAtlas, line_spacing: int, top: int = 0, left: int = 0
+):
+    """Draws text with the glyphs of an atlas (see :class:`_GlyphAtlas`)."""
+    height, width = out.shape
+    advance = atlas.advance
+    for row, line in zip(_line_rows(text, atlas.font_size, line_spacing, top), text):
+        if not line:
+            continue
+        glyphs = [atlas.glyphs[c] for c in line]
+        # the line goes down with its highest outline and up with its highest bitmap, and is
+        # clipped to its outlines
+        ascent = max(g.ascent for g in glyphs)
+        y_min = max(row + atlas.ascender - ascent, 0)
+        y_max = min(row + atlas.ascender + max(g.descent for g in glyphs), height)
+        row -= ascent + min(g.drop for g in glyphs)
+        col = left + glyphs[0].shift
+        for glyph in glyphs:
+            mask = glyph.mask
+            if mask is not None:
+                y, x = row + glyph.top, col + glyph.left
+                y0, x0 = max(y, y_min), max(x, 0)
+                y1, x1 = min(y + mask.shape[0], y_max), min(x + mask.shape[1], width)
+                if y0 < y1 and x0 < x1:
+                    out[y0:y1, x0:x1] |= mask[y0 - y : y1 - y, x0 - x : x1 - x]
+            col += advance
+
+
 def _compute_sizes(fit: str, text: List[str], canvas_size: tuple) -> Tuple[int, int]:
     axis = {"vfill": 0, "hfill": 1}[fit]
     font_size = _best_fit_font_size(text, axis, canvas_size)
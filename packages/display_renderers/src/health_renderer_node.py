@@ -129,8 +129,8 @@ class BatteryIndicatorFragmentRenderer(AbsDisplayFragmentRenderer):
             # draw text
             vshift_px = 2
             text_h, text_w = 14, self._roi.w - ico_w - ico_space
-            text_buf = monospace_screen((text_h, text_w), text, scale="fill")
-            self._buffer[vshift_px : vshift_px + text_h, ico_w + ico_space :] = text_buf
+            text_buf = self._buffer[vshift_px : vshift_px + text_h, ico_w + ico_space :]
+            monospace_screen((text_h, text_w), text, scale="fill", out=text_buf)
 
         # battery not found
         if not self._present:
@@ -142,11 +142,14 @@ class ToFSensorFragmentRenderer(MonoImageFragmentRenderer):
             if (measurement_mm / 1000) < self._accuracy.max_range
             else "Out-Of-Range"
         )
-        reading = monospace_screen(
-            (self.roi.h - self._title_h, self.roi.w), pretty_measurement, scale="hfill", align="center"
-        )
         self.data[: self._title_h, :] = self._title
-        self.data[self._title_h:, :] = reading
+        monospace_screen(
+            (self.roi.h - self._title_h, self.roi.w),
+            pretty_measurement,
+            scale="hfill",
+            align="center",
+            out=self.data[self._title_h :, :],
+        )
 
 
 if __name__ == "__main__":